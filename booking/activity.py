@@ -0,0 +1,269 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import metrics
+from .models import UserActivity
+
+logger = logging.getLogger(__name__)
+
+# Failures that say nothing about the events themselves: the batch is put
+# back and tried again later.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+
+def _activity(event):
+    return UserActivity(
+        user_id=event['user_id'],
+        location=event['location'],
+        min_rating=event['min_rating'],
+        max_price=event['max_price'],
+        timestamp=parse_datetime(event['timestamp']),
+    )
+
+
+class ActivityRecorder:
+    """Buffer ``UserActivity`` events in memory and write them in batches.
+
+    ``record()`` only appends to a bounded deque, so searches never wait on
+    the SQLite write lock. A background thread flushes the buffer with
+    ``bulk_create`` once ``batch_size`` events are waiting or every
+    ``flush_interval`` seconds. When the buffer is full new events are
+    dropped rather than blocking the request.
+
+    On interpreter exit the buffer is flushed one last time; whatever cannot
+    be written (e.g. the database is unreachable) is appended to
+    ``spool_path`` as JSON lines and replayed by the next recorder that
+    starts. Counters: ``activity_events_{recorded,flushed,dropped,spooled}_total``
+    and ``activity_flush_errors_total``.
+    """
+
+    def __init__(self, max_buffer, batch_size, flush_interval, spool_path=None, background=True):
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = str(spool_path) if spool_path else None
+        self.background = background
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started = False
+        self._registered = False
+
+    def __len__(self):
+        return len(self._events)
+
+    def record(self, user, location=None, min_rating=None, max_price=None, timestamp=None):
+        self._ensure_started()
+        event = {
+            'user_id': user.pk,
+            'location': location,
+            'min_rating': None if min_rating is None else str(min_rating),
+            'max_price': None if max_price is None else str(max_price),
+            'timestamp': (timestamp or timezone.now()).isoformat(),
+        }
+        with self._lock:
+            if len(self._events) >= self.max_buffer:
+                metrics.inc('activity_events_dropped_total')
+                return False
+            self._events.append(event)
+            pending = len(self._events)
+        metrics.inc('activity_events_recorded_total')
+        if pending >= self.batch_size:
+            if self.background:
+                self._wakeup.set()
+            else:
+                self.flush()
+        return True
+
+    def _take(self, limit):
+        with self._lock:
+            return [self._events.popleft() for _ in range(min(limit, len(self._events)))]
+
+    def _requeue(self, events):
+        # Put a failed batch back in front, keeping the newest events if the
+        # buffer filled up in the meantime.
+        with self._lock:
+            room = max(self.max_buffer - len(self._events), 0)
+            kept = events[:room]
+            self._events.extendleft(reversed(kept))
+        if len(events) > len(kept):
+            metrics.inc('activity_events_dropped_total', len(events) - len(kept))
+
+    def flush(self):
+        """Write every buffered event; returns the number written.
+
+        A batch the database can't take right now (locked, unreachable) is
+        put back and the error re-raised. A batch it rejects is written one
+        event at a time, and the events that still fail (e.g. a deleted
+        user, a price that isn't a number) are logged and dropped.
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                events = self._take(self.batch_size)
+                if not events:
+                    return written
+                try:
+                    with transaction.atomic():
+                        UserActivity.objects.bulk_create([_activity(event) for event in events])
+                except TRANSIENT_ERRORS:
+                    metrics.inc('activity_flush_errors_total')
+                    self._requeue(events)
+                    raise
+                except Exception:
+                    metrics.inc('activity_flush_errors_total')
+                    written += self._write_each(events)
+                    continue
+                written += len(events)
+                metrics.inc('activity_events_flushed_total', len(events))
+
+    def _write_each(self, events):
+        written = 0
+        for i, event in enumerate(events):
+            try:
+                with transaction.atomic():
+                    _activity(event).save(force_insert=True)
+            except TRANSIENT_ERRORS:
+                self._requeue(events[i:])
+                raise
+            except Exception:
+                logger.exception('Dropping activity event %r', event)
+                metrics.inc('activity_events_dropped_total')
+                continue
+            written += 1
+            metrics.inc('activity_events_flushed_total')
+        return written
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._stopped.clear()
+        self._replay_spool()
+        if self.background:
+            self._thread = threading.Thread(target=self._run, name='activity-recorder', daemon=True)
+            self._thread.start()
+        if not self._registered:
+            atexit.register(self.shutdown)
+            self._registered = True
+
+    def _after_fork(self):
+        # The flush thread does not survive a fork, and the events buffered
+        # so far belong to the parent, which flushes them itself.
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._events.clear()
+        self._thread = None
+        self._started = False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Keep the thread alive; the events are still buffered.
+                logger.exception('Could not flush %d activity events', len(self))
+            finally:
+                close_old_connections()
+
+    def shutdown(self):
+        """Stop the flush thread and write out the buffer, spooling anything
+        the database would not take."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self._thread = None
+        self._started = False
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not flush activity events at shutdown')
+        self.spool()
+
+    def spool(self):
+        """Append the buffered events to the spool file; returns how many."""
+        events = self._take(len(self._events))
+        if not events:
+            return 0
+        if not self.spool_path:
+            metrics.inc('activity_events_dropped_total', len(events))
+            return 0
+        os.makedirs(os.path.dirname(self.spool_path) or '.', exist_ok=True)
+        with open(self.spool_path, 'a') as f:
+            f.write(''.join(json.dumps(event) + '\n' for event in events))
+        metrics.inc('activity_events_spooled_total', len(events))
+        return len(events)
+
+    def _replay_spool(self):
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+        # Claim the file first so two workers starting together don't both
+        # replay it.
+        claimed = f'{self.spool_path}.{uuid.uuid4().hex}'
+        try:
+            os.replace(self.spool_path, claimed)
+        except FileNotFoundError:
+            return
+        with open(claimed) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        self._requeue(events)
+        os.remove(claimed)
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = ActivityRecorder(
+                    max_buffer=settings.ACTIVITY_MAX_BUFFER,
+                    batch_size=settings.ACTIVITY_BATCH_SIZE,
+                    flush_interval=settings.ACTIVITY_FLUSH_INTERVAL,
+                    spool_path=settings.ACTIVITY_SPOOL_PATH,
+                    background=settings.ACTIVITY_FLUSH_IN_BACKGROUND,
+                )
+    return _recorder
+
+
+def _after_fork():
+    if _recorder is not None:
+        _recorder._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def reset_recorder():
+    global _recorder
+    with _recorder_lock:
+        recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.shutdown()
+        atexit.unregister(recorder.shutdown)
+
+
+def record_search(user, location=None, min_rating=None, max_price=None):
+    return get_recorder().record(user, location=location, min_rating=min_rating, max_price=max_price)
@@ -1,14 +1,23 @@
 from django.contrib import admin
-from .models import Hotel, Room, Customer, Booking
+from django.utils import timezone
+from django.utils.html import format_html
+from .models import Hotel, Room, Customer, Booking, ArchivedBooking, OutgoingEmail
+from .templatetags.hotel_images import hotel_thumbnail_url
 
 @admin.register(Hotel)
 class HotelAdmin(admin.ModelAdmin):
-    list_display = ('name', 'location')
+    list_display = ('thumbnail', 'name', 'location')
+
+    @admin.display(description='Image')
+    def thumbnail(self, hotel):
+        if not hotel.image:
+            return ''
+        return format_html('<img src="{}" alt="" height="40">', hotel_thumbnail_url(hotel))
 
 @admin.register(Room)
 class RoomAdmin(admin.ModelAdmin):
-    list_display = ('hotel', 'room_type', 'price', 'availability')
-    list_filter = ('hotel', 'availability')
+    list_display = ('hotel', 'room_type', 'price')
+    list_filter = ('hotel',)
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
@@ -19,3 +28,26 @@ class BookingAdmin(admin.ModelAdmin):
     list_display = ('customer', 'room', 'check_in', 'check_out', 'status')
     list_filter = ('status',)
     date_hierarchy = 'check_in'
+
+@admin.register(ArchivedBooking)
+class ArchivedBookingAdmin(admin.ModelAdmin):
+    list_display = ('id', 'customer', 'hotel_id', 'room_id', 'check_in', 'check_out', 'status', 'archived_at')
+    list_filter = ('status',)
+    date_hierarchy = 'check_in'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    readonly_fields = ('lease', 'last_error', 'created_at', 'sent_at')
+    actions = ['retry_now']
+
+    @admin.action(description='Retry selected emails now')
+    def retry_now(self, request, queryset):
+        queryset.exclude(status='sent').update(status='pending', attempts=0, next_attempt_at=timezone.now(), lease='')
@@ -0,0 +1,251 @@
+"""Read-only JSON API over the hotel and room catalog.
+
+Rows are read with ``values()`` and only the requested columns (``?fields=``)
+are selected, so no model instances are built. Lists are keyset paginated
+(``?cursor=``, ``?page_size=`` up to API_MAX_PAGE_SIZE) or fetched in bulk by
+id (``?ids=1,2,3``, up to API_MAX_IDS), and written out in chunks with a
+streaming response. Every response carries a strong ETag made from the cache
+versions of the data it shows (see booking.cache), so a client revalidating
+with If-None-Match gets a 304 without a single query.
+"""
+import hashlib
+import json
+
+from django.core.exceptions import BadRequest
+from django.core.files.storage import default_storage
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+
+from .cache import HOTELS, ROOMS, SUMMARIES, get_versions, hotel_scope
+from .facets import filter_hotels, parse_filters
+from .models import Hotel, Room
+from .pagination import keyset_paginate
+
+# Bump when the representation changes, so clients don't revalidate old
+# bodies against new ETags.
+API_VERSION = 1
+
+# Rows serialized per chunk of a streamed list.
+CHUNK_SIZE = 100
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def _image_url(name):
+    return default_storage.url(name) if name else None
+
+
+def _date(value):
+    return None if value is None else value.isoformat()
+
+
+def _hotel_url(row):
+    return reverse('booking:hotel_detail', args=[row['id']])
+
+
+# API field -> (values() lookup, how to render it). Fields with no lookup
+# are computed from the others.
+HOTEL_FIELDS = {
+    'id': ('id', None),
+    'name': ('name', None),
+    'location': ('location', None),
+    'description': ('description', None),
+    'rating': ('rating', _float),
+    'amenities': ('amenities', None),
+    'image': ('image', _image_url),
+    'url': (None, _hotel_url),
+    # From HotelSummary, one row per hotel joined on its primary key.
+    'min_price': ('summary__min_price', _float),
+    'max_price': ('summary__max_price', _float),
+    'available_rooms': ('summary__available_rooms', None),
+    'next_free_date': ('summary__next_free_date', _date),
+}
+HOTEL_DEFAULT_FIELDS = ['id', 'name', 'location', 'rating', 'amenities', 'image', 'url']
+HOTEL_ORDERINGS = {
+    'id': ['id'],
+    '-rating': ['-rating', '-id'],
+}
+
+ROOM_FIELDS = {
+    'id': ('id', None),
+    'hotel': ('hotel_id', None),
+    'hotel_name': ('hotel__name', None),
+    'room_type': ('room_type', None),
+    'price': ('price', _float),
+}
+ROOM_DEFAULT_FIELDS = ['id', 'hotel', 'room_type', 'price']
+
+
+class Projection:
+    """The ``?fields=`` a client asked for, and how to select and render
+    them. ``id`` is always included."""
+
+    def __init__(self, params, fields, defaults):
+        names = [name.strip() for name in params.get('fields', '').split(',') if name.strip()]
+        unknown = [name for name in names if name not in fields]
+        if unknown:
+            raise BadRequest(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(fields)}.")
+        self.names = list(dict.fromkeys(['id'] + (names or defaults)))
+        self.columns = []
+        self.renderers = []
+        for name in self.names:
+            lookup, render = fields[name]
+            if lookup is not None:
+                self.columns.append(lookup)
+            self.renderers.append((name, lookup, render))
+
+    def select(self, queryset, extra=()):
+        return queryset.values(*dict.fromkeys([*self.columns, *extra]))
+
+    def render(self, row):
+        data = {}
+        for name, key, render in self.renderers:
+            value = row[key] if key is not None else row
+            data[name] = render(value) if render else value
+        return data
+
+
+def parse_ids(params):
+    """``?ids=3,1,2`` as a list of ints in the given order, or None."""
+    if 'ids' not in params:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(value) for value in params['ids'].split(',') if value.strip()))
+    except ValueError:
+        raise BadRequest('ids must be a comma-separated list of integers.')
+    if len(ids) > settings.API_MAX_IDS:
+        raise BadRequest(f'At most {settings.API_MAX_IDS} ids per request.')
+    return ids
+
+
+def _etag(request, scopes):
+    versions = get_versions(scopes)
+    stamp = ':'.join(f'{scope}={version}' for scope, version in sorted(versions.items()))
+    digest = hashlib.sha1(f'{API_VERSION}|{stamp}|{request.get_full_path()}'.encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def _not_modified(request, etag):
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+    return response
+
+
+def _error(message, status=400):
+    return JsonResponse({'error': str(message)}, status=status)
+
+
+def _stream(rows, render, **extra):
+    yield '{"results":['
+    for start in range(0, len(rows), CHUNK_SIZE):
+        chunk = ','.join(json.dumps(render(row)) for row in rows[start:start + CHUNK_SIZE])
+        yield (',' if start else '') + chunk
+    yield ']'
+    for key, value in extra.items():
+        yield f',{json.dumps(key)}:{json.dumps(value)}'
+    yield '}'
+
+
+def _list_response(etag, rows, render, **extra):
+    response = StreamingHttpResponse(_stream(rows, render, **extra), content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+def _detail_response(etag, data):
+    response = JsonResponse(data)
+    response['ETag'] = etag
+    return response
+
+
+def _bulk(queryset, projection, ids):
+    rows = {row['id']: row for row in projection.select(queryset.filter(id__in=ids))}
+    return [rows[pk] for pk in ids if pk in rows], [pk for pk in ids if pk not in rows]
+
+
+def _list(request, queryset, projection, ordering, etag):
+    ids = parse_ids(request.GET)
+    if ids is not None:
+        rows, missing = _bulk(queryset, projection, ids)
+        return _list_response(etag, rows, projection.render, missing=missing)
+    fields = [field.lstrip('-') for field in ordering]
+    page = keyset_paginate(request, projection.select(queryset, fields), ordering, settings.API_MAX_PAGE_SIZE)
+    return _list_response(etag, page.object_list, projection.render,
+                          next=page.next_cursor, previous=page.previous_cursor)
+
+
+@require_GET
+def hotels(request):
+    """``/api/hotels/``: filtered by location, min_rating, max_price,
+    amenity and available like hotel_search, ordered by ``?ordering=id`` (default) or
+    ``-rating``, or looked up with ``?ids=``."""
+    etag = _etag(request, [HOTELS, ROOMS, SUMMARIES])
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        projection = Projection(request.GET, HOTEL_FIELDS, HOTEL_DEFAULT_FIELDS)
+        ordering = HOTEL_ORDERINGS.get(request.GET.get('ordering', 'id'))
+        if ordering is None:
+            raise BadRequest(f"ordering must be one of: {', '.join(HOTEL_ORDERINGS)}.")
+        hotels = filter_hotels(Hotel.objects.all(), parse_filters(request.GET))
+        return _list(request, hotels, projection, ordering, etag)
+    except (BadRequest, ValueError) as e:
+        return _error(e)
+
+
+@require_GET
+def hotel(request, hotel_id):
+    etag = _etag(request, [hotel_scope(hotel_id), SUMMARIES])
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        projection = Projection(request.GET, HOTEL_FIELDS, HOTEL_DEFAULT_FIELDS)
+    except BadRequest as e:
+        return _error(e)
+    row = projection.select(Hotel.objects.filter(pk=hotel_id)).first()
+    if row is None:
+        return _error('Hotel not found.', status=404)
+    return _detail_response(etag, projection.render(row))
+
+
+@require_GET
+def rooms(request):
+    """``/api/rooms/``: optionally of one ``?hotel=``, ordered by id, or
+    looked up with ``?ids=``."""
+    etag = _etag(request, [ROOMS])
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        projection = Projection(request.GET, ROOM_FIELDS, ROOM_DEFAULT_FIELDS)
+        rooms = Room.objects.all()
+        if request.GET.get('hotel'):
+            rooms = rooms.filter(hotel_id=int(request.GET['hotel']))
+        return _list(request, rooms, projection, ['id'], etag)
+    except (BadRequest, ValueError) as e:
+        return _error(e)
+
+
+@require_GET
+def room(request, room_id):
+    etag = _etag(request, [ROOMS])
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        projection = Projection(request.GET, ROOM_FIELDS, ROOM_DEFAULT_FIELDS)
+    except BadRequest as e:
+        return _error(e)
+    row = projection.select(Room.objects.filter(pk=room_id)).first()
+    if row is None:
+        return _error('Room not found.', status=404)
+    return _detail_response(etag, projection.render(row))
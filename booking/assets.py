@@ -0,0 +1,177 @@
+"""Static files: fingerprinted, precompressed and served with long-lived
+cache headers.
+
+``collectstatic`` copies every file under a content-hashed name (e.g.
+``booking/css/booking.3f2a9c1e7b4d.css``) through
+CompressedManifestStaticFilesStorage, which also writes a gzip variant of
+each text file next to it, and a Brotli one when the ``brotli`` package is
+installed. ``{% static %}`` links to the hashed names, so they can be
+cached forever: a changed file gets a new name.
+
+serve() hands out STATIC_ROOT with the smallest variant the client
+accepts, for deployments where nothing in front of Django serves static
+files (settings.SERVE_STATIC_FILES). A web server can do the same from
+the same directory, e.g. nginx with ``gzip_static on``.
+
+Bootstrap is vendored under booking/static/booking/vendor/ rather than
+loaded from a CDN; ``manage.py fetch_vendor_assets`` downloads the pinned
+files and checks their hashes.
+"""
+import base64
+import gzip
+import hashlib
+import mimetypes
+from functools import cached_property
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.checks import Tags, Warning, register
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:  # only gzip variants then
+    brotli = None
+
+# Static path -> (source URL, Subresource Integrity hash or None).
+BOOTSTRAP = 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist'
+VENDORED = {
+    'booking/vendor/bootstrap/bootstrap.min.css': (
+        f'{BOOTSTRAP}/css/bootstrap.min.css',
+        'sha384-9ndCyUaIbzAi2FUVXJi0CjmCapSmO7SnpJef0486qhLnuZ2cdeRhO02iuK6FUUVM',
+    ),
+    'booking/vendor/bootstrap/bootstrap.bundle.min.js': (
+        f'{BOOTSTRAP}/js/bootstrap.bundle.min.js',
+        'sha384-geWF76RCwLtnZ8qwWowPQNguL3RmwHVBC9FhGdlKrxdiJJigb/j/68SIy3Te4Bkz',
+    ),
+    # Referenced by the files above, so collectstatic needs them to hash
+    # those references.
+    'booking/vendor/bootstrap/bootstrap.min.css.map': (f'{BOOTSTRAP}/css/bootstrap.min.css.map', None),
+    'booking/vendor/bootstrap/bootstrap.bundle.min.js.map': (f'{BOOTSTRAP}/js/bootstrap.bundle.min.js.map', None),
+}
+
+# Compressed variants: file types worth compressing, the smallest file
+# worth it, and the Content-Encoding of each suffix, preferred first.
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.txt', '.xml', '.html', '.ico')
+MIN_COMPRESS_SIZE = 256
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def integrity(data):
+    """Subresource Integrity hash of ``data``, as in ``VENDORED``."""
+    return 'sha384-' + base64.b64encode(hashlib.sha384(data).digest()).decode()
+
+
+@register(Tags.staticfiles)
+def check_vendored_assets(app_configs, **kwargs):
+    missing = [path for path in VENDORED if finders.find(path) is None]
+    if not missing:
+        return []
+    return [Warning(
+        f"Vendored static files are missing: {', '.join(missing)}.",
+        hint='Run `manage.py fetch_vendor_assets` and commit the files; pages link to them.',
+        id='booking.W001',
+    )]
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        # Until collectstatic has written a manifest (development, tests)
+        # files keep their own names.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            if name.endswith(COMPRESSIBLE):
+                for variant in self.compress(name):
+                    yield name, variant, True
+
+    def compress(self, name):
+        """Write the compressed variants of ``name`` that are smaller than
+        it and return their names."""
+        with self.open(name) as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return []
+        variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data, quality=11)
+        written = []
+        for suffix, compressed in variants.items():
+            if len(compressed) >= len(data):
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            written.append(self._save(name + suffix, ContentFile(compressed)))
+        return written
+
+    @cached_property
+    def immutable_names(self):
+        """The hashed names, whose content never changes."""
+        return frozenset(self.hashed_files.values())
+
+
+def accepted_encodings(request):
+    """Content codings the request's Accept-Encoding allows, e.g.
+    ``{'gzip', 'br'}``."""
+    accepted = set()
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        quality = next((param[2:] for param in params if param.startswith('q=')), '1')
+        try:
+            allowed = float(quality) > 0
+        except ValueError:
+            allowed = False
+        if coding and allowed:
+            accepted.add(coding.lower())
+    return accepted
+
+
+@require_safe
+def serve(request, path):
+    """A file from STATIC_ROOT, compressed if a smaller variant exists and
+    the client accepts it. Hashed names are cached for
+    STATIC_CACHE_MAX_AGE seconds without revalidation, others revalidated
+    on every use."""
+    try:
+        full_path = Path(safe_join(settings.STATIC_ROOT, path))
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404(path)
+    if not full_path.is_file():
+        raise Http404(path)
+    served, encoding = full_path, None
+    accepted = accepted_encodings(request)
+    for coding, suffix in ENCODINGS:
+        variant = full_path.with_name(full_path.name + suffix)
+        if coding in accepted and variant.is_file():
+            served, encoding = variant, coding
+            break
+    stat = served.stat()
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type, _ = mimetypes.guess_type(full_path.name)
+        response = FileResponse(served.open('rb'), content_type=content_type or 'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if path in getattr(staticfiles_storage, 'immutable_names', ()):
+        patch_cache_control(response, public=True, max_age=settings.STATIC_CACHE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
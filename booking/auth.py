@@ -0,0 +1,43 @@
+"""The signed-in user of each request, from the cache.
+
+Sessions themselves are read from the cache and written through to the
+database by Django's ``cached_db`` engine (settings.SESSION_ENGINE). This
+backend does the same for the user the session points to, so a request
+from a signed-in visitor whose session and user are cached runs no
+queries for either. Cached users are dropped when the user is saved or
+deleted, which includes logging in, or logs out (booking.signals).
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+
+def user_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def remember_user(user):
+    cache.set(user_key(user.pk), user, settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def forget_user(user_id):
+    cache.delete(user_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose ``get_user()``, called once per request by
+    AuthenticationMiddleware, reads through the cache.
+
+    Django still checks the session against the cached user's password
+    hash, and permissions are looked up as usual; only the user row is
+    cached.
+    """
+
+    def get_user(self, user_id):
+        user = cache.get(user_key(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            # None for unknown and inactive users, which aren't cached.
+            if user is not None:
+                remember_user(user)
+        return user
@@ -0,0 +1,84 @@
+import datetime
+
+import numpy as np
+from django.db.models import Exists, OuterRef
+from django.utils.dateparse import parse_date
+
+from .models import Booking, Room
+
+# Bookings in these states hold the room; cancelled ones free it again.
+ACTIVE_STATUSES = ('pending', 'confirmed')
+
+# Longest window the calendar API will build in one call.
+MAX_CALENDAR_DAYS = 366
+
+
+def parse_stay(check_in, check_out):
+    """Parse a ``check_in``/``check_out`` pair of ISO dates.
+
+    Raises ``ValueError`` if either is missing or invalid, or the stay is
+    not at least one night long.
+    """
+    check_in = parse_date(check_in or '')
+    check_out = parse_date(check_out or '')
+    if check_in is None or check_out is None:
+        raise ValueError('Check-in and check-out must be valid dates.')
+    if check_out <= check_in:
+        raise ValueError('Check-out must be after check-in.')
+    return check_in, check_out
+
+
+def overlapping_bookings(check_in, check_out):
+    """Active bookings that overlap the half-open stay [check_in, check_out).
+
+    A booking that checks out the day another checks in does not overlap.
+    The ``room, check_out`` index makes this a short range scan per room,
+    since only bookings ending after ``check_in`` are read.
+    """
+    return Booking.objects.filter(
+        status__in=ACTIVE_STATUSES,
+        check_out__gt=check_in,
+        check_in__lt=check_out,
+    )
+
+
+def free_rooms(check_in, check_out, hotel=None):
+    """Rooms with no active booking between ``check_in`` and ``check_out``,
+    for one hotel or across the catalog."""
+    rooms = Room.objects.all() if hotel is None else Room.objects.filter(hotel=hotel)
+    booked = overlapping_bookings(check_in, check_out).filter(room=OuterRef('pk'))
+    return rooms.filter(~Exists(booked))
+
+
+def is_room_free(room, check_in, check_out):
+    return not overlapping_bookings(check_in, check_out).filter(room=room).exists()
+
+
+def availability_calendar(hotel, start, end):
+    """Per-day availability of every room of ``hotel`` over [start, end).
+
+    Reads the hotel's rooms and the bookings overlapping the window in two
+    queries and marks occupied nights in a rooms x days matrix.
+    """
+    days = (end - start).days
+    if days <= 0 or days > MAX_CALENDAR_DAYS:
+        raise ValueError(f'The calendar window must be 1 to {MAX_CALENDAR_DAYS} days long.')
+
+    room_ids = list(Room.objects.filter(hotel=hotel).order_by('id').values_list('id', flat=True))
+    row = {room_id: i for i, room_id in enumerate(room_ids)}
+    occupied = np.zeros((len(room_ids), days), dtype=bool)
+    bookings = overlapping_bookings(start, end).filter(room__hotel=hotel).values_list('room_id', 'check_in', 'check_out')
+    for room_id, check_in, check_out in bookings.iterator():
+        first = max((check_in - start).days, 0)
+        last = min((check_out - start).days, days)
+        occupied[row[room_id], first:last] = True
+
+    free = ~occupied
+    return {
+        'hotel': hotel.id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'dates': [(start + datetime.timedelta(days=i)).isoformat() for i in range(days)],
+        'free_rooms': free.sum(axis=0).tolist(),
+        'rooms': {room_id: free[i].tolist() for room_id, i in row.items()},
+    }
@@ -0,0 +1,287 @@
+"""Request benchmarks for every booking route on synthetic catalogs.
+
+``manage.py benchmark`` seeds each scale with ``seed_data --hotels`` inside a
+transaction that is rolled back afterwards, drives the scenarios below with
+the test client and writes latency percentiles, throughput and query counts
+as JSON. Two result files can be compared with ``compare()``.
+"""
+import datetime
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+
+from .instrumentation import collect
+from .models import Booking, Hotel, Room
+from .synthetic import CITIES
+
+# Keyword arguments for seed_data; customers, users and searches follow
+# from the booking count.
+SCALES = {
+    'small': {'hotels': 500, 'rooms_per_hotel': 10, 'bookings': 10_000},
+    'medium': {'hotels': 5_000, 'rooms_per_hotel': 20, 'bookings': 200_000},
+    'large': {'hotels': 50_000, 'rooms_per_hotel': 20, 'bookings': 2_000_000},
+}
+
+QUERIES = ['beach resort', 'spa hotel', 'cheap hostel', 'luxury palace', 'family hotel with pool',
+           'quiet lodge', 'boutique hotel with bar', 'hotel near the airport']
+
+STAFF_USERNAME = 'benchmark-staff'
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def summarize(timings, queries, sql_times, errors, elapsed):
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 0.5), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        'throughput_rps': round(len(timings) / elapsed, 1) if elapsed else None,
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+        'sql_ms_mean': round(sum(sql_times) / len(sql_times), 2),
+    }
+
+
+class Scenario:
+    """One route exercised repeatedly.
+
+    ``path`` and ``params`` (the query string or form data) are called with
+    the run context and the iteration number; ``client`` picks the
+    anonymous, customer or staff client.
+    """
+
+    def __init__(self, name, path, method='get', params=None, client='anonymous', status=200, search=False,
+                 after=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.params = params
+        self.client = client
+        self.status = status
+        # Needs the embedding search index (and so the spaCy model).
+        self.search = search
+        # Called with the context and each expected response.
+        self.after = after
+
+
+class Context:
+    """What the scenarios pick their targets from: the seeded catalog and
+    one client per kind of visitor."""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.today = datetime.date.today()
+        self.hotel_ids = list(Hotel.objects.order_by('id').values_list('id', flat=True))
+        self.room_ids = list(Room.objects.order_by('id').values_list('id', flat=True))
+        self.booking_ids = list(Booking.objects.order_by('id').values_list('id', flat=True))
+        # Bookings made by the book_room scenario, removed by delete_booking.
+        self.created_bookings = []
+        # delete_hotel takes hotels from the second half of the catalog;
+        # the other scenarios pick from the first.
+        half = (len(self.hotel_ids) + 1) // 2
+        self.hotels_to_delete = self.hotel_ids[half:]
+        self.hotel_ids = self.hotel_ids[:half]
+
+        customer = User.objects.filter(username__startswith='guest').order_by('id').first()
+        staff, _ = User.objects.get_or_create(username=STAFF_USERNAME, defaults={'is_staff': True})
+        self.clients = {kind: Client(raise_request_exception=False) for kind in ('anonymous', 'customer', 'staff')}
+        if customer is not None:
+            self.clients['customer'].force_login(customer)
+        self.clients['staff'].force_login(staff)
+
+    def hotel(self):
+        return self.rng.choice(self.hotel_ids)
+
+    def room(self):
+        return self.rng.choice(self.room_ids)
+
+    def booking(self):
+        return self.rng.choice(self.booking_ids)
+
+    def hotel_to_delete(self):
+        return self.hotels_to_delete.pop()
+
+    def booking_to_delete(self):
+        return (self.created_bookings or self.booking_ids).pop()
+
+    def stay(self, offset=30):
+        check_in = self.today + datetime.timedelta(days=offset + self.rng.randrange(300))
+        return check_in, check_in + datetime.timedelta(days=self.rng.randint(1, 7))
+
+
+def _stay_params(context, i):
+    check_in, check_out = context.stay()
+    return {'check_in': check_in.isoformat(), 'check_out': check_out.isoformat()}
+
+
+def _month_params(context, i):
+    start, _ = context.stay()
+    return {'start': start.isoformat(), 'end': (start + datetime.timedelta(days=30)).isoformat()}
+
+
+def _booking_form(context, i):
+    # Far enough ahead of the seeded bookings, and a week apart per
+    # iteration, that these never conflict.
+    check_in = context.today + datetime.timedelta(days=800 + 7 * i)
+    return {
+        'name': f'Benchmark Guest {i}',
+        'email': f'benchmark{i}@example.com',
+        'phone': '+15550000000',
+        'check_in': check_in.isoformat(),
+        'check_out': (check_in + datetime.timedelta(days=2)).isoformat(),
+    }
+
+
+def _remember_booking(context, response):
+    # Redirected to the confirmation page, which ends in the booking id.
+    context.created_bookings.append(int(response['Location'].rstrip('/').rsplit('/', 1)[1]))
+
+
+def _query(context, i):
+    return {'query': context.rng.choice(QUERIES)}
+
+
+def _search_params(context, i):
+    return {'query': context.rng.choice(QUERIES), 'location': context.rng.choice(CITIES)[0]}
+
+
+def _filter_params(context, i):
+    return {'location': context.rng.choice(CITIES)[0], 'min_rating': '4', 'max_price': '250', 'amenity': 'wifi'}
+
+
+def _cheapest_available_params(context, i):
+    return {'sort': 'price', 'available': '1', 'location': context.rng.choice(CITIES)[0]}
+
+
+def _typeahead_params(context, i):
+    # What has been typed so far of a city name, one keystroke per request.
+    city = context.rng.choice(CITIES)[0]
+    return {'query': city[:1 + i % len(city)]}
+
+
+def _typeahead_typo_params(context, i):
+    city = list(context.rng.choice(CITIES)[0].lower())
+    position = context.rng.randrange(1, len(city) - 1)
+    city[position], city[position + 1] = city[position + 1], city[position]
+    return {'query': ''.join(city)}
+
+
+def _api_list_params(context, i):
+    return {'page_size': '100', 'fields': 'name,location,rating,min_price', 'ordering': '-rating'}
+
+
+def _api_bulk_params(context, i):
+    ids = context.rng.sample(context.hotel_ids, min(100, len(context.hotel_ids)))
+    return {'ids': ','.join(map(str, ids)), 'fields': 'name,rating'}
+
+
+def _url(name, *args):
+    """Path of a route without arguments, or with the results of calling
+    ``args`` on the context (e.g. ``Context.hotel``)."""
+    return lambda context, i: reverse(f'booking:{name}', args=[arg(context) for arg in args])
+
+
+SCENARIOS = [
+    Scenario('welcome', _url('welcome')),
+    Scenario('hotel_list', _url('hotel_list')),
+    Scenario('hotel_list_logged_in', _url('hotel_list'), client='customer'),
+    Scenario('hotel_list_query', _url('hotel_list'), params=_query, search=True),
+    Scenario('hotel_search', _url('hotel_search'), params=_search_params, search=True),
+    Scenario('hotel_search_filters', _url('hotel_search'), params=_filter_params),
+    Scenario('hotel_search_cheapest', _url('hotel_search'), params=_cheapest_available_params),
+    Scenario('hotel_list_cheapest', _url('hotel_list'), params=lambda c, i: {'sort': 'price', 'available': '1'}),
+    Scenario('get_suggestions', _url('get_suggestions'), params=_query, search=True),
+    Scenario('typeahead', _url('typeahead'), params=_typeahead_params),
+    Scenario('typeahead_typo', _url('typeahead'), params=_typeahead_typo_params),
+    Scenario('hotel_detail', _url('hotel_detail', Context.hotel)),
+    Scenario('hotel_detail_dates', _url('hotel_detail', Context.hotel), params=_stay_params),
+    Scenario('hotel_availability', _url('hotel_availability', Context.hotel), params=_month_params),
+    Scenario('book_room_form', _url('book_room', Context.room)),
+    Scenario('book_room', _url('book_room', Context.room), method='post', params=_booking_form, status=302,
+             after=_remember_booking),
+    Scenario('booking_confirmation', _url('booking_confirmation', Context.booking)),
+    Scenario('list_rooms', _url('list_rooms')),
+    Scenario('my_bookings', _url('my_bookings'), client='customer'),
+    Scenario('recommend_hotels', _url('recommend_hotels')),
+    Scenario('recommend_hotels_personal', _url('recommend_hotels'), client='customer'),
+    Scenario('contact_us', _url('contact_us')),
+    Scenario('contact_us_post', _url('contact_us'), method='post',
+             params=lambda c, i: {'name': 'Benchmark', 'email': 'benchmark@example.com', 'message': f'Message {i}'}),
+    Scenario('management_view', _url('management_view'), client='staff'),
+    Scenario('delete_booking', _url('delete_booking', Context.booking_to_delete), method='post', client='staff',
+             status=302),
+    Scenario('add_hotel_form', _url('add_hotel'), client='staff'),
+    Scenario('add_room_form', _url('add_room'), client='staff'),
+    Scenario('add_customer_form', _url('add_customer'), client='staff'),
+    Scenario('metrics', _url('metrics')),
+    Scenario('api_hotels', _url('api_hotels'), params=_api_list_params),
+    Scenario('api_hotels_bulk', _url('api_hotels'), params=_api_bulk_params),
+    Scenario('api_hotel', _url('api_hotel', Context.hotel)),
+    Scenario('api_rooms', _url('api_rooms'), params=lambda c, i: {'hotel': c.hotel(), 'fields': 'room_type,price'}),
+    Scenario('api_room', _url('api_room', Context.room)),
+    # Last, since it removes hotels (from the half of the catalog that
+    # Context.hotel() doesn't pick from).
+    Scenario('delete_hotel', _url('delete_hotel', Context.hotel_to_delete), method='post', client='staff',
+             status=302),
+]
+
+
+def run_scenario(scenario, context, requests, warmup):
+    client = context.clients[scenario.client]
+    timings, queries, sql_times = [], [], []
+    errors = 0
+    elapsed = 0.0
+    for i in range(warmup + requests):
+        path = scenario.path(context, i)
+        params = scenario.params(context, i) if scenario.params else None
+        start = time.perf_counter()
+        with collect() as stats:
+            response = getattr(client, scenario.method)(path, params)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        duration = time.perf_counter() - start
+        if response.status_code == scenario.status and scenario.after:
+            scenario.after(context, response)
+        if i < warmup:
+            continue
+        if response.status_code != scenario.status:
+            errors += 1
+        elapsed += duration
+        timings.append(duration * 1000)
+        queries.append(stats.query_count)
+        sql_times.append(stats.sql_time * 1000)
+    return summarize(timings, queries, sql_times, errors, elapsed)
+
+
+def compare(baseline, current, threshold=0.25, min_delta_ms=1.0):
+    """Regressions of ``current`` against ``baseline`` (both as written by
+    the benchmark command), as readable lines.
+
+    A scenario regresses when its p95 grows by more than ``threshold`` (a
+    fraction) and ``min_delta_ms``, when it runs more queries at worst, or
+    when it fails more often.
+    """
+    regressions = []
+    for scale, scenarios in current['results'].items():
+        for name, result in scenarios.items():
+            before = baseline.get('results', {}).get(scale, {}).get(name)
+            if before is None or 'skipped' in result or 'skipped' in before:
+                continue
+            label = f'{scale}/{name}'
+            delta = result['p95_ms'] - before['p95_ms']
+            if delta > min_delta_ms and result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(f"{label}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+            if result['queries_max'] > before['queries_max']:
+                regressions.append(f"{label}: up to {result['queries_max']} queries, was {before['queries_max']}")
+            if result['errors'] > before['errors']:
+                regressions.append(f"{label}: {result['errors']} unexpected responses, was {before['errors']}")
+    return regressions
@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from . import metrics
+from .routers import changed as replicas_behind
+
+# Version scopes; see get_versions(). The catalog scope covers every hotel
+# and room, the summaries scope every HotelSummary, the typeahead scope the
+# hotels' names, locations and ratings, the others what one kind of page
+# shows.
+CATALOG = 'catalog'
+SUMMARIES = 'summaries'
+TYPEAHEAD = 'typeahead'
+HOTELS = 'hotels'
+ROOMS = 'rooms'
+
+
+class LRUCache:
+    """A small thread-safe in-process LRU cache that counts hits and misses
+    as ``<name>_cache_hits_total`` / ``<name>_cache_misses_total``."""
+
+    def __init__(self, maxsize, name):
+        self.maxsize = maxsize
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                metrics.inc(f'{self.name}_cache_misses_total')
+                return None
+            self._data.move_to_end(key)
+        metrics.inc(f'{self.name}_cache_hits_total')
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                metrics.inc(f'{self.name}_cache_evictions_total')
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _fresh_version():
+    # Start from the clock rather than 1, so a version key that was evicted
+    # never comes back with a number older entries were cached under.
+    return time.time_ns() // 1000
+
+
+def hotel_scope(hotel_id):
+    """One hotel's page: its details, rooms and their bookings."""
+    return f'hotel:{hotel_id}'
+
+
+def version_key(scope):
+    return f'{scope}-version'
+
+
+def get_versions(scopes):
+    """Current version of each scope (e.g. ``'catalog'``, ``'hotel:3'``) in
+    one cache round trip. Cache keys built from them go stale as soon as
+    the scope is bumped."""
+    keys = {version_key(scope): scope for scope in scopes}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        cache.add(key, _fresh_version(), timeout=None)
+        found[key] = cache.get(key)
+    return {scope: found[key] for key, scope in keys.items()}
+
+
+def get_version(scope):
+    return get_versions([scope])[scope]
+
+
+def bump_version(scope):
+    """Invalidate everything cached against ``scope``.
+
+    Until the replicas have caught up, whatever is cached against the new
+    version is read from the primary.
+    """
+    replicas_behind()
+    try:
+        return cache.incr(version_key(scope))
+    except ValueError:
+        version = _fresh_version()
+        cache.set(version_key(scope), version, timeout=None)
+        return version
+
+
+def get_catalog_version():
+    """Return the current catalog version, part of every catalog-wide cache
+    key (search results, facets)."""
+    return get_version(CATALOG)
+
+
+def bump_catalog_version():
+    return bump_version(CATALOG)
@@ -0,0 +1,237 @@
+import threading
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, FloatField, OuterRef
+from django.db.models.functions import Cast
+
+from .cache import SUMMARIES, get_catalog_version, get_version
+from .models import Hotel, HotelAmenity, HotelSummary
+
+# Price facet buckets on a hotel's cheapest room: (label, low, high),
+# low inclusive and high exclusive; None means unbounded.
+PRICE_BUCKETS = [
+    ('under_100', None, 100),
+    ('100_200', 100, 200),
+    ('200_300', 200, 300),
+    ('300_plus', 300, None),
+]
+
+
+def _decimal(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'{name} must be a number.')
+    # Decimal() also reads 'nan' and 'inf'.
+    if not number.is_finite():
+        raise ValueError(f'{name} must be a number.')
+    return number
+
+
+def parse_filters(params):
+    """Read the facet filters from a QueryDict. Raises ``ValueError``."""
+    return {
+        'location': params.get('location') or None,
+        'min_rating': _decimal(params.get('min_rating'), 'min_rating'),
+        'max_price': _decimal(params.get('max_price'), 'max_price'),
+        'amenities': HotelAmenity.normalize(params.getlist('amenity')),
+        'available': params.get('available', '').lower() in ('1', 'true', 'on', 'yes'),
+    }
+
+
+def filter_hotels(hotels, filters):
+    """Apply ``parse_filters`` output to a Hotel queryset.
+
+    Every filter is an indexed lookup: ``Hotel.location`` and ``Hotel.rating``
+    directly, the cheapest room and free rooms tonight through HotelSummary
+    and amenities through ``HotelAmenity(name, hotel)``.
+    """
+    if filters['location']:
+        hotels = hotels.filter(location=filters['location'])
+    if filters['min_rating'] is not None:
+        hotels = hotels.filter(rating__gte=filters['min_rating'])
+    if filters['max_price'] is not None:
+        hotels = hotels.filter(summary__min_price__lte=filters['max_price'])
+    if filters['available']:
+        hotels = hotels.filter(summary__available_rooms__gt=0)
+    for amenity in filters['amenities']:
+        hotels = hotels.filter(Exists(HotelAmenity.objects.filter(hotel=OuterRef('pk'), name=amenity)))
+    return hotels
+
+
+
+# ?sort=price: cheapest room first, over hotels annotated by
+# with_min_price(). Hotels without rooms have no price and are left out.
+PRICE_ORDERING = ['min_price', 'id']
+
+
+def with_min_price(hotels):
+    """Annotate ``hotels`` with ``min_price``, the price of their cheapest
+    room, from HotelSummary."""
+    return hotels.annotate(min_price=F('summary__min_price'))
+
+
+def rank_matching(hotels, ranked, sort=''):
+    """The ids in ``ranked`` (search results, best first) of the hotels in
+    ``hotels``, annotated by with_min_price(), by relevance or, for
+    ``sort='price'``, by cheapest room with relevance breaking ties."""
+    prices = dict(hotels.filter(id__in=ranked).values_list('id', 'min_price'))
+    matching = [hotel_id for hotel_id in ranked if hotel_id in prices]
+    if sort == 'price':
+        matching = sorted((hotel_id for hotel_id in matching if prices[hotel_id] is not None), key=prices.get)
+    return matching
+
+class FacetIndex:
+    """Column snapshot of the catalog for counting facets in memory.
+
+    Counting with GROUP BY means one aggregate per facet over every matching
+    hotel, plus a cheapest-room subquery per hotel for the price buckets,
+    which takes seconds on a 100k-hotel catalog. Here the location code,
+    rating, cheapest room price and amenity codes of every hotel are numpy
+    arrays, so a request builds one boolean mask over the hotels and counts
+    every facet from it. The snapshot is tagged with the catalog version
+    and rebuilt after a hotel or room changes.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        # One snapshot, so the summaries and amenity rows are of the hotels
+        # read.
+        with transaction.atomic():
+            hotels = list(Hotel.objects.order_by('id').values_list('id', 'location', Cast('rating', FloatField())))
+            cheapest = list(HotelSummary.objects.filter(min_price__isnull=False).values_list(
+                'hotel_id', Cast('min_price', FloatField())))
+            rows = list(HotelAmenity.objects.order_by().values_list('hotel_id', 'name'))
+        self.ids = np.array([row[0] for row in hotels], dtype=np.int64)
+        self.locations, location_codes = np.unique(np.array([row[1] for row in hotels], dtype=str), return_inverse=True)
+        self.location_codes = location_codes.astype(np.int32)
+        self.ratings = np.array([row[2] for row in hotels], dtype=np.float64)
+
+        positions, found = self._positions([row[0] for row in cheapest])
+        self.min_prices = np.full(len(self.ids), np.nan)
+        self.min_prices[positions[found]] = np.array([row[1] for row in cheapest], dtype=np.float64)[found]
+
+        positions, found = self._positions([row[0] for row in rows])
+        self.amenity_hotels = positions[found]
+        names = np.array([row[1] for row in rows], dtype=str)[found]
+        self.amenities, amenity_codes = np.unique(names, return_inverse=True)
+        self.amenity_codes = amenity_codes.astype(np.int32)
+        self._available = None
+
+    def available(self):
+        """Mask of the hotels with a room free tonight. Bookings change it
+        far more often than the catalog, so it is reloaded with the
+        summaries rather than with the snapshot."""
+        version = get_version(SUMMARIES)
+        loaded = self._available
+        if loaded is not None and loaded[0] == version:
+            return loaded[1]
+        hotel_ids = HotelSummary.objects.filter(available_rooms__gt=0).values_list('hotel_id', flat=True)
+        mask = np.isin(self.ids, np.fromiter(hotel_ids, dtype=np.int64))
+        self._available = (version, mask)
+        return mask
+
+    def _positions(self, hotel_ids):
+        """Positions of ``hotel_ids`` in the snapshot, and a mask of those
+        that are in it."""
+        hotel_ids = np.array(hotel_ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, hotel_ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == hotel_ids[found]
+        return positions, found
+
+    def _code(self, values, value):
+        position = int(np.searchsorted(values, value))
+        return position if position < len(values) and values[position] == value else None
+
+    def mask(self, filters, hotel_ids=None):
+        """Boolean mask of the hotels matching ``filters``, optionally
+        restricted to ``hotel_ids`` (e.g. text search matches)."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        if hotel_ids is not None:
+            mask &= np.isin(self.ids, np.fromiter(hotel_ids, dtype=np.int64))
+        if filters['location']:
+            code = self._code(self.locations, filters['location'])
+            mask &= self.location_codes == (-1 if code is None else code)
+        if filters['min_rating'] is not None:
+            mask &= self.ratings >= float(filters['min_rating'])
+        if filters['max_price'] is not None:
+            # NaN (no rooms) compares false, like NULL in the SQL filter.
+            mask &= self.min_prices <= float(filters['max_price'])
+        if filters['available']:
+            mask &= self.available()
+        for amenity in filters['amenities']:
+            code = self._code(self.amenities, amenity)
+            having = np.zeros(len(self.ids), dtype=bool)
+            if code is not None:
+                having[self.amenity_hotels[self.amenity_codes == code]] = True
+            mask &= having
+        return mask
+
+    def _top(self, labels, counts):
+        order = sorted((-int(count), str(label)) for label, count in zip(labels, counts) if count)
+        return {label: -count for count, label in order[:settings.FACET_SIZE]}
+
+    def counts(self, filters, hotel_ids=None):
+        mask = self.mask(filters, hotel_ids)
+        locations = np.bincount(self.location_codes[mask], minlength=len(self.locations))
+        amenities = np.bincount(self.amenity_codes[mask[self.amenity_hotels]], minlength=len(self.amenities))
+        prices = self.min_prices[mask]
+        prices = prices[~np.isnan(prices)]
+        buckets = {}
+        for label, low, high in PRICE_BUCKETS:
+            selected = np.ones(len(prices), dtype=bool)
+            if low is not None:
+                selected &= prices >= low
+            if high is not None:
+                selected &= prices < high
+            buckets[label] = int(selected.sum())
+        return {
+            'total': int(mask.sum()),
+            'location': self._top(self.locations, locations),
+            'amenity': self._top(self.amenities, amenities),
+            'price': buckets,
+        }
+
+
+_facet_index = None
+_facet_index_lock = threading.Lock()
+
+
+def get_facet_index():
+    """Return the facet snapshot for the current catalog version.
+
+    After a catalog change one request rebuilds it; requests arriving in
+    the meantime keep counting on the previous snapshot instead of queueing
+    behind the rebuild.
+    """
+    global _facet_index
+    version = get_catalog_version()
+    facet_index = _facet_index
+    if facet_index is not None and facet_index.version == version:
+        return facet_index
+    if not _facet_index_lock.acquire(blocking=facet_index is None):
+        return facet_index
+    try:
+        if _facet_index is None or _facet_index.version != version:
+            _facet_index = FacetIndex(version)
+        return _facet_index
+    finally:
+        _facet_index_lock.release()
+
+
+def reset_facet_index():
+    global _facet_index
+    with _facet_index_lock:
+        _facet_index = None
+
+
+def facet_counts(filters, hotel_ids=None):
+    """Facet counts (per location, per amenity, price buckets on the
+    cheapest room) for the hotels matching ``filters``."""
+    return get_facet_index().counts(filters, hotel_ids)
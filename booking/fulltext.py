@@ -0,0 +1,87 @@
+"""Lexical search over hotel names, descriptions, locations and amenities
+with the database's own full-text engine.
+
+On SQLite the text lives in the FTS5 table ``booking_hotel_fts`` (rowid =
+hotel id), on PostgreSQL in a GIN index over a weighted tsvector of the
+hotel row. Both are created by migration 0011 and kept in sync by the
+database itself, with triggers on SQLite, so bulk inserts and raw SQL
+(seed_data) are covered as well as model saves. Other backends have no
+lexical index; search() returns None there and callers fall back to the
+vector search alone.
+"""
+import re
+
+from django.db import connections, router
+
+from .models import Hotel
+
+TABLE = 'booking_hotel_fts'
+
+# Words longer than this, and queries with more words, are cut off.
+MAX_TERM_LENGTH = 50
+MAX_TERMS = 16
+
+# bm25() weight of each FTS5 column: name, description, location,
+# amenities. A word in the name says more than one in the description.
+SQLITE_WEIGHTS = (10.0, 1.0, 5.0, 3.0)
+
+# The indexed expression; queries must repeat it verbatim to use the index.
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('english', name), 'A') || "
+    "setweight(to_tsvector('english', location), 'B') || "
+    "setweight(jsonb_to_tsvector('english', amenities, '[\"string\"]'), 'C') || "
+    "setweight(to_tsvector('english', description), 'D')"
+)
+
+_TERM = re.compile(r'\w+')
+
+
+def terms(query):
+    """The words of ``query``, lowercased, without any search syntax."""
+    return list(dict.fromkeys(word[:MAX_TERM_LENGTH] for word in _TERM.findall(query.lower())))[:MAX_TERMS]
+
+
+def _search_sqlite(cursor, words, limit):
+    # Every word quoted so it can't be read as an FTS5 operator, and any of
+    # them may match: BM25 ranks rows with more, and rarer, words first.
+    match = ' OR '.join(f'"{word}"' for word in words)
+    weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+    # bm25() is lower for better matches.
+    cursor.execute(
+        f'SELECT rowid, -bm25({TABLE}, {weights}) AS score FROM {TABLE} '
+        f'WHERE {TABLE} MATCH %s ORDER BY score DESC, rowid LIMIT %s',
+        [match, limit],
+    )
+    return cursor.fetchall()
+
+
+def _search_postgresql(cursor, words, limit):
+    cursor.execute(
+        f"SELECT id, ts_rank_cd({POSTGRES_DOCUMENT}, query) AS score "
+        f"FROM {Hotel._meta.db_table}, to_tsquery('english', %s) query "
+        f"WHERE {POSTGRES_DOCUMENT} @@ query ORDER BY score DESC, id LIMIT %s",
+        [' | '.join(words), limit],
+    )
+    return cursor.fetchall()
+
+
+BACKENDS = {
+    'sqlite': _search_sqlite,
+    'postgresql': _search_postgresql,
+}
+
+
+def search(query, limit):
+    """Up to ``limit`` ``(hotel_id, score)`` pairs for the hotels matching
+    any word of ``query``, best first; higher scores are better but only
+    comparable within one query. None if the database has no full-text
+    index."""
+    connection = connections[router.db_for_read(Hotel)]
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None:
+        return None
+    words = terms(query)
+    if not words:
+        return []
+    with connection.cursor() as cursor:
+        return [(hotel_id, float(score)) for hotel_id, score in backend(cursor, words, limit)]
@@ -0,0 +1,117 @@
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+
+from . import metrics
+from .cache import HOTELS, bump_version, hotel_scope
+from .models import Hotel
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL = 'thumb'
+
+
+def variant_name(image_name, label):
+    """Storage name of one derivative of ``image_name``, e.g.
+    ``derivatives/hotel_images/a.jpg/640w.webp``."""
+    extension = settings.IMAGE_VARIANT_FORMAT.lower()
+    return posixpath.join('derivatives', image_name, f'{label}.{extension}')
+
+
+def _save(image, name):
+    buffer = io.BytesIO()
+    image.save(buffer, settings.IMAGE_VARIANT_FORMAT, quality=settings.IMAGE_VARIANT_QUALITY, method=4)
+    # Storage.save() renames instead of overwriting.
+    default_storage.delete(name)
+    default_storage.save(name, ContentFile(buffer.getvalue()))
+    return buffer.tell()
+
+
+def render_variants(image_name):
+    """Write the thumbnail and every responsive width (never upscaled) of
+    ``image_name`` and return the ``Hotel.image_variants`` record."""
+    from PIL import Image, ImageOps
+
+    with default_storage.open(image_name, 'rb') as f:
+        image = Image.open(f)
+        # Let JPEG decode straight at a reduced scale when the original is
+        # much larger than the biggest variant.
+        largest = max(settings.IMAGE_VARIANT_WIDTHS)
+        image.draft('RGB', (largest, largest * image.height // max(image.width, 1)))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    widths = [width for width in settings.IMAGE_VARIANT_WIDTHS if width < image.width] or [image.width]
+    for width in widths:
+        resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        _save(resized, variant_name(image_name, f'{width}w'))
+    _save(ImageOps.fit(image, settings.IMAGE_THUMBNAIL_SIZE, Image.LANCZOS), variant_name(image_name, THUMBNAIL))
+    return {'name': image_name, 'widths': widths}
+
+
+def generate_variants(hotel_id):
+    """Build the derivatives of a hotel's current image and record them.
+
+    Returns False if the hotel has no image or it could not be read.
+    """
+    hotel = Hotel.objects.filter(pk=hotel_id).only('id', 'image', 'image_variants').first()
+    if hotel is None or not hotel.image:
+        return False
+    if hotel.image_variants.get('name') == hotel.image.name:
+        return True
+    try:
+        variants = render_variants(hotel.image.name)
+    except Exception:
+        metrics.inc('image_variant_errors_total')
+        logger.exception('Could not build image variants for hotel %s', hotel_id)
+        return False
+    # Only record them if the image wasn't replaced in the meantime; an
+    # update() skips the post_save handlers, so bump the pages here.
+    if Hotel.objects.filter(pk=hotel_id, image=variants['name']).update(image_variants=variants):
+        bump_version(HOTELS)
+        bump_version(hotel_scope(hotel_id))
+    metrics.inc('image_variants_generated_total')
+    return True
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _run(hotel_id):
+    try:
+        generate_variants(hotel_id)
+    finally:
+        close_old_connections()
+
+
+def schedule(hotel_id):
+    """Build a hotel's image variants on the background worker (or inline
+    with ``IMAGE_VARIANTS_IN_BACKGROUND = False``)."""
+    global _executor
+    if not settings.IMAGE_VARIANTS_IN_BACKGROUND:
+        return generate_variants(hotel_id)
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='image-variants')
+    return _executor.submit(_run, hotel_id)
+
+
+def srcset(image_name, variants):
+    """``srcset`` value for the recorded variants of ``image_name``, or ''
+    while they don't exist yet (or belong to a previous image)."""
+    if not image_name or not variants or variants.get('name') != image_name:
+        return ''
+    return ', '.join(
+        f"{default_storage.url(variant_name(image_name, f'{width}w'))} {width}w" for width in variants['widths']
+    )
@@ -0,0 +1,247 @@
+import contextlib
+import contextvars
+import json
+import logging
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import QuerySet
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger('booking.perf')
+
+_current = contextvars.ContextVar('booking_request_stats', default=None)
+
+
+class RequestStats:
+    """SQL and template timings collected while handling one request."""
+
+    def __init__(self, parent=None):
+        # An enclosing collect() block (e.g. a test around a request) sees
+        # everything recorded here too.
+        self.parent = parent
+        self.queries = []
+        self.sql_time = 0.0
+        self.template_time = 0.0
+
+    def chain(self):
+        stats = self
+        while stats is not None:
+            yield stats
+            stats = stats.parent
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    @property
+    def duplicate_queries(self):
+        """Executions repeating an earlier statement with the same parameters."""
+        counts = Counter(self.queries)
+        return sum(count - 1 for count in counts.values())
+
+    @property
+    def similar_queries(self):
+        """Executions repeating an earlier statement with other parameters,
+        the usual signature of an N+1."""
+        counts = Counter(sql for sql, _ in self.queries)
+        return sum(count - 1 for count in counts.values()) - self.duplicate_queries
+
+    def as_dict(self):
+        return {
+            'queries': self.query_count,
+            'sql_ms': round(self.sql_time * 1000, 2),
+            'duplicates': self.duplicate_queries,
+            'similar': self.similar_queries,
+            'template_ms': round(self.template_time * 1000, 2),
+        }
+
+
+def _record(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        for collector in stats.chain():
+            collector.sql_time += elapsed
+            collector.queries.append((sql, repr(params)))
+
+
+@contextlib.contextmanager
+def collect():
+    """Record every query run on any database, and every template rendered
+    through InstrumentedDjangoTemplates, inside the block."""
+    parent = _current.get()
+    stats = RequestStats(parent)
+    token = _current.set(stats)
+    try:
+        with contextlib.ExitStack() as stack:
+            if parent is None:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(_record))
+            yield stats
+    finally:
+        _current.reset(token)
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            elapsed = time.perf_counter() - start
+            for collector in stats.chain():
+                collector.template_time += elapsed
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing each top-level render."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name).template, self)
+
+
+def query_budget(view_name):
+    return settings.QUERY_BUDGETS.get(view_name)
+
+
+class QueryBudgetAssertionsMixin:
+    """TestCase mixin checking responses against ``settings.QUERY_BUDGETS``."""
+
+    def assertWithinQueryBudget(self, response):
+        view_name = response.resolver_match.view_name
+        budget = query_budget(view_name)
+        if budget is None:
+            self.fail(f'No query budget declared for {view_name} in settings.QUERY_BUDGETS.')
+        stats = response.query_stats
+        if stats.query_count > budget:
+            queries = '\n'.join(sql for sql, _ in stats.queries)
+            self.fail(f'{view_name} ran {stats.query_count} queries, over its budget of {budget}:\n{queries}')
+        return stats
+
+
+# Plan lines reading a whole table, and the table (or alias) they read.
+FULL_SCAN = {
+    'sqlite': re.compile(r'^SCAN (?!CONSTANT ROW)(\w+)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+
+
+def query_plan(sql, params=(), using='default'):
+    """The database's plan for ``sql``, one line per step."""
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Small test tables are cheaper to read whole; ask whether an
+            # index could serve the query at all.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}', params)
+        else:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(plan, vendor):
+    """Tables ``plan`` reads from start to end."""
+    pattern = FULL_SCAN.get(vendor)
+    if pattern is None:
+        return []
+    return [match.group(1) for match in map(pattern.search, plan) if match]
+
+
+class QueryPlanAssertionsMixin:
+    """TestCase mixin failing when hot queries would read a whole table
+    instead of using an index."""
+
+    def assertNoFullScans(self, *queries, allow=()):
+        """Each query, a QuerySet or an (sql, params, using) tuple, is
+        planned without a full scan of any table but those in ``allow``."""
+        for query in queries:
+            if isinstance(query, QuerySet):
+                sql, params = query.query.get_compiler(using=query.db).as_sql()
+                using = query.db
+            else:
+                sql, params, using = query
+            vendor = connections[using].vendor
+            if vendor not in FULL_SCAN:
+                self.skipTest(f'No query plan checks for {vendor}.')
+            plan = query_plan(sql, params, using)
+            scans = [table for table in full_scans(plan, vendor) if table not in allow]
+            if scans:
+                self.fail(f"Full scan of {', '.join(scans)}:\n{sql}\n" + '\n'.join(plan))
+
+    @contextlib.contextmanager
+    def assertSelectsIndexed(self, allow=()):
+        """Every SELECT run inside the block passes assertNoFullScans."""
+        selects = []
+
+        def capture(using):
+            def wrapper(execute, sql, params, many, context):
+                if not many and sql.lstrip().upper().startswith('SELECT'):
+                    selects.append((sql, params, using))
+                return execute(sql, params, many, context)
+            return wrapper
+
+        with contextlib.ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(capture(alias)))
+            yield selects
+        self.assertNoFullScans(*selects, allow=allow)
+
+
+class QueryInstrumentationMiddleware:
+    """Measure query count, SQL time, duplicate queries and template render
+    time per request.
+
+    With DEBUG on the figures are returned as ``X-Query-*`` response headers;
+    otherwise each request is logged as one JSON line on ``booking.perf``.
+    Requests exceeding their ``settings.QUERY_BUDGETS`` entry are logged as
+    warnings.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect() as stats:
+            response = self.get_response(request)
+        response.query_stats = stats
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        budget = query_budget(view_name)
+        over_budget = budget is not None and stats.query_count > budget
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(stats.query_count)
+            response['X-Query-Time-Ms'] = f'{stats.sql_time * 1000:.2f}'
+            response['X-Query-Duplicates'] = str(stats.duplicate_queries)
+            response['X-Query-Similar'] = str(stats.similar_queries)
+            response['X-Template-Time-Ms'] = f'{stats.template_time * 1000:.2f}'
+            if budget is not None:
+                response['X-Query-Budget'] = str(budget)
+        else:
+            logger.info(json.dumps({
+                'view': view_name,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                **stats.as_dict(),
+            }))
+        if over_budget:
+            logger.warning('%s ran %d queries, over its budget of %d', view_name, stats.query_count, budget)
+        return response
@@ -0,0 +1,217 @@
+import atexit
+import logging
+import os
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import DatabaseError, close_old_connections, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts):
+    """Seconds to wait after the ``attempts``-th failed try: doubling from
+    MAIL_RETRY_DELAY up to MAIL_RETRY_MAX_DELAY."""
+    return min(settings.MAIL_RETRY_DELAY * 2 ** (attempts - 1), settings.MAIL_RETRY_MAX_DELAY)
+
+
+def claim(limit):
+    """Lease up to ``limit`` due messages to this worker for MAIL_LEASE
+    seconds and return them.
+
+    The lease is a conditional update, so of several workers (threads or
+    processes) only one gets each message. A message whose worker died
+    mid-send is simply due again once its lease runs out.
+    """
+    now = timezone.now()
+    due = OutgoingEmail.objects.filter(status='pending', next_attempt_at__lte=now)
+    ids = list(due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    due.filter(id__in=ids).update(lease=token, next_attempt_at=now + timedelta(seconds=settings.MAIL_LEASE))
+    return list(OutgoingEmail.objects.filter(id__in=ids, lease=token).order_by('id'))
+
+
+def _failed(message, error):
+    attempts = message.attempts + 1
+    changes = {'attempts': attempts, 'lease': '', 'last_error': f'{type(error).__name__}: {error}'[:1000]}
+    if attempts >= settings.MAIL_MAX_ATTEMPTS:
+        changes['status'] = 'failed'
+        metrics.inc('mail_failed_total')
+        logger.error('Giving up on email %s to %s after %d attempts: %s', message.pk, message.to, attempts, error)
+    else:
+        changes['next_attempt_at'] = timezone.now() + timedelta(seconds=retry_delay(attempts))
+        metrics.inc('mail_retries_total')
+        logger.warning('Could not send email %s to %s (attempt %d): %s', message.pk, message.to, attempts, error)
+    OutgoingEmail.objects.filter(pk=message.pk, lease=message.lease).update(**changes)
+
+
+def send_batch(messages):
+    """Send leased messages over one connection; returns how many went out.
+
+    A message that fails is rescheduled (or marked failed after
+    MAIL_MAX_ATTEMPTS) and the connection reopened for the rest, since the
+    server may have dropped it.
+    """
+    connection = get_connection(fail_silently=False)
+    sent = 0
+    try:
+        for i, message in enumerate(messages):
+            try:
+                connection.open()
+            except Exception as error:
+                # The server is unreachable; try the whole rest again later.
+                for unsent in messages[i:]:
+                    _failed(unsent, error)
+                return sent
+            email = EmailMessage(message.subject, message.body, message.from_email, message.to, connection=connection)
+            try:
+                email.send()
+            except Exception as error:
+                _failed(message, error)
+                connection.close()
+                continue
+            OutgoingEmail.objects.filter(pk=message.pk, lease=message.lease).update(
+                status='sent', sent_at=timezone.now(), attempts=message.attempts + 1, lease='', last_error='',
+            )
+            sent += 1
+            metrics.inc('mail_sent_total')
+    finally:
+        connection.close()
+    return sent
+
+
+class MailSender:
+    """Deliver queued ``OutgoingEmail`` rows off the request path.
+
+    A background thread sends whatever is due in batches of ``batch_size``,
+    when woken by ``enqueue()`` and every ``poll_interval`` seconds (for
+    retries and messages queued by other processes). With ``background``
+    off, ``wake()`` sends inline instead, which is what the tests use.
+    """
+
+    def __init__(self, batch_size, poll_interval, background=True):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.background = background
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._registered = False
+
+    def wake(self):
+        if not self.background:
+            self.send_due()
+            return
+        self._ensure_started()
+        self._wakeup.set()
+
+    def send_due(self):
+        """Send every message that is due; returns how many went out."""
+        sent = 0
+        with self._send_lock:
+            while True:
+                messages = claim(self.batch_size)
+                if not messages:
+                    return sent
+                sent += send_batch(messages)
+                if len(messages) < self.batch_size:
+                    return sent
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='mail-sender', daemon=True)
+            self._thread.start()
+            if not self._registered:
+                atexit.register(self.shutdown)
+                self._registered = True
+
+    def _after_fork(self):
+        # The sending thread does not survive a fork; the child starts its
+        # own on its first wake().
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.send_due()
+            except DatabaseError:
+                logger.exception('Could not read the mail queue')
+            finally:
+                close_old_connections()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def shutdown(self):
+        """Stop the sending thread. Unsent messages stay queued in the
+        database for the next worker."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=settings.EMAIL_TIMEOUT or 30)
+        self._thread = None
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sender():
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                _sender = MailSender(
+                    batch_size=settings.MAIL_BATCH_SIZE,
+                    poll_interval=settings.MAIL_POLL_INTERVAL,
+                    background=settings.MAIL_IN_BACKGROUND,
+                )
+    return _sender
+
+
+def _after_fork():
+    if _sender is not None:
+        _sender._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def reset_sender():
+    global _sender
+    with _sender_lock:
+        sender, _sender = _sender, None
+    if sender is not None:
+        sender.shutdown()
+        atexit.unregister(sender.shutdown)
+
+
+def enqueue(subject, body, to, from_email=None):
+    """Queue a message and return its ``OutgoingEmail``. The sender is woken
+    once the current transaction commits, so the caller never waits on SMTP."""
+    message = OutgoingEmail.objects.create(
+        subject=subject[:255],
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+    )
+    metrics.inc('mail_queued_total')
+    transaction.on_commit(lambda: get_sender().wake(), robust=True)
+    return message
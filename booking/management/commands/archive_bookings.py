@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from booking.retention import archive_bookings
+
+
+class Command(BaseCommand):
+    help = ('Move bookings whose stay ended more than BOOKING_ARCHIVE_AFTER_DAYS days ago into the archive, '
+            'a chunk per transaction. Run it nightly or weekly.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive stays that ended more than this many days ago.')
+        parser.add_argument('--batch-size', type=int, help='Bookings moved per transaction.')
+        parser.add_argument('--pause', type=float, help='Seconds to wait between chunks.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        days = settings.BOOKING_ARCHIVE_AFTER_DAYS if options['days'] is None else options['days']
+        try:
+            archived = archive_bookings(
+                days=days,
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+                progress=lambda done: self.stdout.write(f'{done} bookings archived'),
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} bookings that ended over {days} days ago in {time.perf_counter() - start:.2f}s.'
+        ))
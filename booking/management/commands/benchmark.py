@@ -0,0 +1,173 @@
+import io
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.utils import timezone
+
+from booking import recommendations, search
+from booking.activity import reset_recorder
+from booking.benchmarks import SCALES, SCENARIOS, Context, compare, run_scenario
+from booking.facets import reset_facet_index
+from booking.typeahead import reset_typeahead
+
+
+class Rollback(Exception):
+    pass
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every booking route on synthetic catalogs of the given scales: p50/p95/p99 latency, '
+            'throughput and query counts, optionally written as JSON and checked against a baseline. '
+            'Each scale is seeded in a transaction that is rolled back at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', choices=list(SCALES),
+                            help='Catalog size to run at; repeat for several (default: small).')
+        parser.add_argument('--scenario', action='append', help='Only run these scenarios.')
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests first.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='Results file to check for regressions against.')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed p95 slowdown as a fraction of the baseline.')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Ignore p95 slowdowns smaller than this.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['warmup'] < 0:
+            raise CommandError('--requests must be positive and --warmup not negative.')
+        names = {scenario.name for scenario in SCENARIOS}
+        unknown = set(options['scenario'] or []) - names
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}.")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        scales = options['scale'] or ['small']
+        results = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+                'seed': options['seed'],
+                'scales': {scale: SCALES[scale] for scale in scales},
+            },
+            'results': {},
+        }
+        # Per-request log lines would drown the report; over-budget
+        # warnings still get through.
+        perf_logger = logging.getLogger('booking.perf')
+        level = perf_logger.level
+        perf_logger.setLevel(logging.WARNING)
+        try:
+            with tempfile.TemporaryDirectory() as directory, self.isolated(directory):
+                for scale in scales:
+                    results['results'][scale] = self.run_scale(scale, options)
+        finally:
+            perf_logger.setLevel(level)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(f"Results written to {options['output']}.")
+        if baseline is not None:
+            regressions = compare(baseline, results, options['threshold'], options['min_delta_ms'])
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(line))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}."))
+
+    def isolated(self, directory):
+        """Keep the run away from the real cache, search index, mailbox and
+        background workers, and measure with DEBUG off."""
+        return override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+            HOTEL_INDEX_PATH=Path(directory) / 'hotels.npz',
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            ACTIVITY_FLUSH_IN_BACKGROUND=False,
+            ACTIVITY_SPOOL_PATH=None,
+            IMAGE_VARIANTS_IN_BACKGROUND=False,
+            TYPEAHEAD_REBUILD_IN_BACKGROUND=False,
+            DEBUG=False,
+            ALLOWED_HOSTS=['testserver'],
+        )
+
+    def run_scale(self, scale, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Scale {scale}: {SCALES[scale]}'))
+        self.reset()
+        try:
+            with transaction.atomic():
+                results = self.measure(scale, options)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            self.reset()
+        return results
+
+    def reset(self):
+        # Nothing built from one scale's (rolled back) catalog may survive
+        # into the next.
+        cache.clear()
+        search.reset_index()
+        reset_facet_index()
+        reset_typeahead()
+        reset_recorder()
+
+    def measure(self, scale, options):
+        call_command('seed_data', flush=True, seed=options['seed'],
+                     stdout=self.stdout if options['verbosity'] > 1 else io.StringIO(), **SCALES[scale])
+        try:
+            search.get_index().rebuild()
+            searchable = True
+        except OSError as e:
+            # Typically the spaCy model isn't installed.
+            self.stderr.write(f'Skipping search scenarios: {e}')
+            searchable = False
+        recommendations.refresh(full=True)
+
+        context = Context(options['seed'])
+        results = {}
+        self.stdout.write(f"{'scenario':28s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'req/s':>8s} {'queries':>8s}")
+        for scenario in SCENARIOS:
+            if options['scenario'] and scenario.name not in options['scenario']:
+                continue
+            if scenario.search and not searchable:
+                results[scenario.name] = {'skipped': 'search index unavailable'}
+                continue
+            result = results[scenario.name] = run_scenario(scenario, context, options['requests'], options['warmup'])
+            line = (f"{scenario.name:28s} {result['p50_ms']:8.1f} {result['p95_ms']:8.1f} {result['p99_ms']:8.1f} "
+                    f"{result['throughput_rps']:8.1f} {result['queries_max']:8d}")
+            if result['errors']:
+                line += f" ({result['errors']} unexpected responses)"
+            self.stdout.write(self.style.WARNING(line) if result['errors'] else line)
+        return results
@@ -0,0 +1,102 @@
+import datetime
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from booking import recommendations
+from booking.benchmarks import percentile
+from booking.models import Booking, Customer, Hotel, Room, UserActivity
+
+AMENITIES = ['wifi', 'pool', 'gym', 'spa', 'beach', 'parking', 'bar', 'restaurant', 'pets', 'sauna', 'ski', 'breakfast']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Benchmark recommendation refreshes and request latency on a synthetic catalog. '
+            'Everything is created in one transaction that is rolled back at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--hotels', type=int, default=10_000)
+        parser.add_argument('--locations', type=int, default=500)
+        parser.add_argument('--searches', type=int, default=3, help='Searches per user.')
+        parser.add_argument('--bookings', type=int, default=50_000)
+        parser.add_argument('--new-users', type=int, default=1_000, help='Users with new activity for the incremental run.')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def report(self, label, value):
+        self.stdout.write(f'{label:32s} {value}')
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        locations = [f'City {i}' for i in range(options['locations'])]
+
+        start = time.perf_counter()
+        hotels = Hotel.objects.bulk_create([
+            Hotel(name=f'Hotel {i}', location=rng.choice(locations), description='Synthetic hotel.',
+                  rating=round(rng.uniform(1, 5), 2), amenities=rng.sample(AMENITIES, 3))
+            for i in range(options['hotels'])
+        ], batch_size=2000)
+        rooms = Room.objects.bulk_create([
+            Room(hotel=hotel, room_type='Room', price=rng.randint(40, 500)) for hotel in hotels for _ in range(3)
+        ], batch_size=2000)
+        users = User.objects.bulk_create([
+            User(username=f'user{i}', email=f'user{i}@example.com', password='!') for i in range(options['users'])
+        ], batch_size=2000)
+        UserActivity.objects.bulk_create([
+            UserActivity(user=user, location=rng.choice(locations), max_price=rng.choice([None, 100, 200, 300]))
+            for user in users for _ in range(options['searches'])
+        ], batch_size=2000)
+        guests = rng.sample(users, min(options['bookings'], len(users)))
+        customers = Customer.objects.bulk_create([
+            Customer(name=user.username, email=user.email, phone='0') for user in guests
+        ], batch_size=2000)
+        today = datetime.date.today()
+        Booking.objects.bulk_create([
+            Booking(customer=customer, room=rng.choice(rooms), status='confirmed',
+                    check_in=today, check_out=today + datetime.timedelta(days=2))
+            for customer in customers
+        ], batch_size=2000)
+        self.report('synthetic data', f'{time.perf_counter() - start:.1f}s')
+
+        run = recommendations.refresh(full=True)
+        self.report('full refresh', f'{run.users} users in {run.duration:.2f}s')
+
+        changed = rng.sample(users, min(options['new_users'], len(users)))
+        UserActivity.objects.bulk_create([UserActivity(user=user, location=rng.choice(locations)) for user in changed])
+        run = recommendations.refresh()
+        self.report('incremental refresh', f'{run.users} users in {run.duration:.2f}s')
+
+        client = Client()
+        url = reverse('booking:recommend_hotels')
+        for label, sample in (('anonymous', [None] * options['requests']),
+                              ('personal', rng.sample(users, min(options['requests'], len(users))))):
+            timings = []
+            for user in sample:
+                if user is None:
+                    client.logout()
+                else:
+                    client.force_login(user)
+                begin = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - begin) * 1000)
+                assert response.status_code == 200
+            self.report(f'{label} request', f'p50 {statistics.median(timings):.1f}ms p95 {percentile(timings, 0.95):.1f}ms')
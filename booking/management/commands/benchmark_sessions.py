@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from booking.benchmarks import percentile
+from booking.instrumentation import collect
+
+USERNAME_PREFIX = 'session-benchmark-'
+
+# Django's defaults, which read the session and the user from the database
+# on every request, against the settings.
+CONFIGURATIONS = {
+    'database': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+    },
+    'cached': {},
+}
+
+ROUTES = ['my_bookings', 'hotel_list', 'recommend_hotels']
+
+
+class Command(BaseCommand):
+    help = ('Compare queries per request, latency and throughput of signed-in traffic with database-backed '
+            'sessions and users against the configured cached ones. Creates its users, and their sessions, '
+            'and deletes them at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per thread.')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per thread first.')
+        parser.add_argument('--route', action='append', choices=ROUTES,
+                            help='Routes requested in turn; repeat for several (default: all).')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['threads'] < 1 or options['requests'] < 1:
+            raise CommandError('--users, --threads and --requests must be positive.')
+        # Committed, since each thread has its own database connection.
+        # Left over from an interrupted run otherwise.
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        User.objects.bulk_create([
+            User(username=f'{USERNAME_PREFIX}{i}', email=f'{USERNAME_PREFIX}{i}@example.com', password='!')
+            for i in range(options['users'])
+        ])
+        users = list(User.objects.filter(username__startswith=USERNAME_PREFIX))
+        session_keys = []
+        self.stdout.write(f"{'configuration':16s} {'queries':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'req/s':>8s}")
+        results = {}
+        # One log line per request otherwise.
+        perf_logger = logging.getLogger('booking.perf')
+        level = perf_logger.level
+        perf_logger.setLevel(logging.WARNING)
+        try:
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver'], CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'session-benchmark'},
+            }):
+                for name, overrides in CONFIGURATIONS.items():
+                    with override_settings(**overrides):
+                        results[name] = result = self.measure(users, session_keys, options)
+                    self.stdout.write(f"{name:16s} {result['queries']:8.2f} {result['p50_ms']:8.1f} "
+                                      f"{result['p95_ms']:8.1f} {result['throughput_rps']:8.1f}")
+        finally:
+            perf_logger.setLevel(level)
+            Session.objects.filter(session_key__in=session_keys).delete()
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        before, after = results['database'], results['cached']
+        self.stdout.write(
+            f"Cached sessions and users save {before['queries'] - after['queries']:.2f} queries per request, "
+            f"throughput x{after['throughput_rps'] / before['throughput_rps']:.2f}."
+        )
+
+    def measure(self, users, session_keys, options):
+        cache.clear()
+        clients = []
+        for user in users:
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            session_keys.append(client.session.session_key)
+            clients.append(client)
+        paths = [reverse(f'booking:{route}') for route in options['route'] or ROUTES]
+        timings, queries, errors = [], [], []
+        lock = threading.Lock()
+        # Passed once before the warmup and once after it, when the clock
+        # starts.
+        barrier = threading.Barrier(options['threads'] + 1)
+
+        def worker(number):
+            mine_timings, mine_queries, mine_errors = [], [], 0
+            try:
+                barrier.wait()
+                for i in range(options['warmup'] + options['requests']):
+                    if i == options['warmup']:
+                        barrier.wait()
+                    # Every thread cycles through the users, like interleaved
+                    # visitors hitting one worker.
+                    client = clients[(number + i * options['threads']) % len(clients)]
+                    path = paths[i % len(paths)]
+                    start = time.perf_counter()
+                    with collect() as stats:
+                        response = client.get(path)
+                    duration = time.perf_counter() - start
+                    if i < options['warmup']:
+                        continue
+                    mine_timings.append(duration * 1000)
+                    mine_queries.append(stats.query_count)
+                    mine_errors += response.status_code != 200
+            except BaseException:
+                # Don't leave the other threads waiting for this one.
+                barrier.abort()
+                raise
+            finally:
+                connections.close_all()
+                with lock:
+                    timings.extend(mine_timings)
+                    queries.extend(mine_queries)
+                    errors.append(mine_errors)
+
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if sum(errors):
+            self.stderr.write(f'{sum(errors)} requests did not return 200.')
+        return {
+            'queries': sum(queries) / len(queries),
+            'p50_ms': percentile(timings, 0.5),
+            'p95_ms': percentile(timings, 0.95),
+            'throughput_rps': len(timings) / elapsed,
+        }
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from booking.images import generate_variants
+from booking.models import Hotel
+
+
+class Command(BaseCommand):
+    help = 'Build the thumbnail and responsive WebP variants of hotel images that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild variants that already exist.')
+
+    def handle(self, *args, **options):
+        hotels = Hotel.objects.exclude(image='').exclude(image=None).order_by('id')
+        if options['force']:
+            hotels.update(image_variants={})
+        built = failed = 0
+        for hotel_id in hotels.values_list('id', flat=True).iterator():
+            if generate_variants(hotel_id):
+                built += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(f'Image variants ready for {built} hotels.'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} images could not be read.'))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from booking import vectorstore
+from booking.nlp import get_nlp
+
+
+class Command(BaseCommand):
+    help = 'Export the spaCy word vectors to a memory-mapped store shared by all workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(settings.WORD_VECTORS_DIR),
+                            help='Directory to write the vector store to (default: WORD_VECTORS_DIR)')
+
+    def handle(self, *args, **options):
+        count = vectorstore.export(get_nlp(), options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} word vectors to {options['output']}."))
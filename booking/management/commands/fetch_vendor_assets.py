@@ -0,0 +1,36 @@
+from pathlib import Path
+from urllib.request import urlopen
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from booking.assets import VENDORED, integrity
+
+
+class Command(BaseCommand):
+    help = ('Download the third-party static files the pages use (Bootstrap) into booking/static/, checking '
+            'them against their pinned integrity hashes. Commit the result; nothing is fetched at runtime.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Download files that are already present.')
+        parser.add_argument('--timeout', type=float, default=30)
+
+    def handle(self, *args, **options):
+        root = Path(apps.get_app_config('booking').path) / 'static'
+        for path, (url, expected) in VENDORED.items():
+            target = root / path
+            if target.exists() and not options['force']:
+                if expected and integrity(target.read_bytes()) != expected:
+                    raise CommandError(f'{target} does not match {expected}; rerun with --force.')
+                self.stdout.write(f'{path}: present')
+                continue
+            try:
+                with urlopen(url, timeout=options['timeout']) as response:
+                    data = response.read()
+            except OSError as e:
+                raise CommandError(f'Could not download {url}: {e}')
+            if expected and integrity(data) != expected:
+                raise CommandError(f'{url} does not match {expected}.')
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            self.stdout.write(f'{path}: {len(data)} bytes from {url}')
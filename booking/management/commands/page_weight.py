@@ -0,0 +1,90 @@
+import gzip
+import logging
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+# Pages measured by default; --path adds others (e.g. a hotel's page).
+PAGES = ['booking:welcome', 'booking:hotel_list', 'booking:list_rooms', 'login']
+
+INLINE = re.compile(r'<(style|script)(?![^>]*\bsrc=)[^>]*>(.*?)</\1>', re.S | re.I)
+TAG = re.compile(r'<(?:link|script)\b[^>]*>', re.I)
+ATTRIBUTE = re.compile(r'\b(rel|href|src)="([^"]*)"', re.I)
+
+
+def linked_urls(html):
+    """URLs of the stylesheets and scripts ``html`` links to."""
+    urls = []
+    for tag in TAG.findall(html):
+        attributes = {name.lower(): value for name, value in ATTRIBUTE.findall(tag)}
+        if tag[1:7].lower() == 'script' and 'src' in attributes:
+            urls.append(attributes['src'])
+        elif attributes.get('rel') == 'stylesheet' and 'href' in attributes:
+            urls.append(attributes['href'])
+    return urls
+
+
+def gzipped_size(data):
+    return len(gzip.compress(data, compresslevel=9, mtime=0))
+
+
+class Command(BaseCommand):
+    help = ('Bytes an anonymous visitor downloads per page: the HTML, its inline styles and scripts, and the '
+            'stylesheets and scripts it links to, uncompressed and gzipped. Linked static files are cacheable '
+            'across pages; inline ones are downloaded again with every page.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', default=[], help='Also measure this path.')
+
+    def handle(self, *args, **options):
+        paths = [reverse(name) for name in PAGES] + options['path']
+        client = Client()
+        rows, assets = [], {}
+        logging.getLogger('booking.perf').setLevel(logging.WARNING)
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+            for path in paths:
+                html = client.get(path).content
+                inline = sum(len(body.encode()) for _, body in INLINE.findall(html.decode()))
+                linked = linked_urls(html.decode())
+                for url in linked:
+                    assets.setdefault(url, self.asset_size(url))
+                rows.append((path, len(html), gzipped_size(html), inline, linked))
+
+        self.stdout.write(f"{'page':24s} {'html':>8s} {'gzip':>8s} {'inline':>8s} {'linked':>8s} {'gzip':>8s}")
+        for path, size, compressed, inline, linked in rows:
+            local = [assets[url] for url in linked if assets[url]]
+            self.stdout.write(
+                f'{path:24s} {size:8d} {compressed:8d} {inline:8d} '
+                f'{sum(raw for raw, _ in local):8d} {sum(gz for _, gz in local):8d}'
+            )
+        external = sorted(url for url, size in assets.items() if size is None)
+        for url in external:
+            self.stdout.write(f'Not measured: {url}')
+        html_bytes = sum(compressed for _, _, compressed, _, _ in rows)
+        asset_bytes = sum(size[1] for size in assets.values() if size)
+        self.stdout.write(
+            f'All {len(rows)} pages once, gzipped: {html_bytes} bytes of HTML and {asset_bytes} bytes of '
+            f'linked files ({len(assets) - len(external)} measured, {len(external)} not).'
+        )
+
+    def asset_size(self, url):
+        """(bytes, gzipped bytes) of a static file, or None for other URLs
+        and static files that aren't there."""
+        static_url = settings.STATIC_URL if settings.STATIC_URL.startswith('/') else f'/{settings.STATIC_URL}'
+        if not url.startswith(static_url):
+            return None
+        name = url[len(static_url):]
+        # Collected (and hashed) or, before collectstatic, in an app.
+        path = Path(settings.STATIC_ROOT) / name
+        if not path.is_file():
+            path = finders.find(name)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        return len(data), gzipped_size(data)
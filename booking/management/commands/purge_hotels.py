@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from booking.models import Hotel
+from booking.retention import purge_hotel
+
+
+class Command(BaseCommand):
+    help = ('Delete hotels with their rooms and bookings in chunks, without loading them, so large hotels '
+            'never hold the write lock for long. Archived bookings are kept.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('hotel_ids', nargs='+', type=int)
+        parser.add_argument('--batch-size', type=int, help='Rows deleted per statement.')
+        parser.add_argument('--pause', type=float, help='Seconds to wait between chunks.')
+
+    def handle(self, *args, **options):
+        hotels = list(Hotel.objects.filter(pk__in=options['hotel_ids']).order_by('id'))
+        for hotel_id in sorted(set(options['hotel_ids']) - {hotel.pk for hotel in hotels}):
+            self.stdout.write(f'No hotel {hotel_id}.')
+        for hotel in hotels:
+            start, hotel_id = time.perf_counter(), hotel.pk
+            self.stdout.write(f'Purging hotel {hotel_id} ({hotel.name})')
+            bookings, rooms = purge_hotel(
+                hotel,
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+                progress=lambda label, done: self.stdout.write(f'  {done} {label} deleted'),
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Purged hotel {hotel_id}: {rooms} rooms and {bookings} bookings in {time.perf_counter() - start:.2f}s.'
+            ))
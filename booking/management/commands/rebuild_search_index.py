@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from booking.search import get_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hotel embedding index used by hotel search and suggestions'
+
+    def handle(self, *args, **kwargs):
+        count = get_index().rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} hotels into {get_index().path}.'))
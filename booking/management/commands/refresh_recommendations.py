@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from booking.recommendations import refresh
+
+
+class Command(BaseCommand):
+    help = 'Recompute hotel recommendations for users with new searches or bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rescore every user, e.g. after catalog changes.')
+        parser.add_argument('--chunk-size', type=int, help='Users scored per batch.')
+
+    def handle(self, *args, **options):
+        run = refresh(full=options['full'], chunk_size=options['chunk_size'])
+        kind = 'Full' if run.full else 'Incremental'
+        self.stdout.write(self.style.SUCCESS(f'{kind} refresh: {run.users} users in {run.duration:.2f}s.'))
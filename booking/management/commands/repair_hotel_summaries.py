@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from booking.cache import bump_version
+from booking.summaries import repair, stale_scopes
+
+
+class Command(BaseCommand):
+    help = ('Recompute every hotel\'s price and availability summary from its rooms and bookings. '
+            'Run it nightly, since which rooms are free tonight changes with the date.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help='Hotels recomputed per transaction.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        hotels, changed = repair(chunk_size=options['chunk_size'])
+        for scope in stale_scopes(changed):
+            bump_version(scope)
+        fields = ', '.join(sorted(changed)) or 'nothing'
+        self.stdout.write(self.style.SUCCESS(
+            f'Summarized {hotels} hotels in {time.perf_counter() - start:.2f}s; changed: {fields}.'
+        ))
@@ -1,12 +1,47 @@
-from django.core.management.base import BaseCommand
-from booking.models import Hotel, Room, Customer, Booking
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from booking.cache import CATALOG, HOTELS, ROOMS, SUMMARIES, TYPEAHEAD, bump_version
+from booking.models import (
+    ArchivedBooking, Hotel, HotelAmenity, HotelSummary, Room, Customer, Booking, Recommendation, RecommendationRun,
+    UserActivity,
+)
+from booking.summaries import refresh as refresh_summaries
+from booking.synthetic import SyntheticData, chunked, customer_email
 from django.core.files import File
 import os
 
+# Synthetic users are named guest1, guest2, ... and share an email with the
+# customer of the same number, so their bookings show up in my_bookings.
+USERNAME_PREFIX = 'guest'
+
+
 class Command(BaseCommand):
-    help = 'Seed initial data for hotels, rooms, customers, and bookings'
+    help = ('Seed initial data for hotels, rooms, customers, and bookings. '
+            'With --hotels, generate a large deterministic catalog for load testing instead.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotels', type=int, help='Generate this many synthetic hotels (scale mode).')
+        parser.add_argument('--rooms-per-hotel', type=int, default=20)
+        parser.add_argument('--bookings', type=int, help='Total bookings (default: one per room).')
+        parser.add_argument('--customers', type=int, help='Default: one per five bookings.')
+        parser.add_argument('--users', type=int, help='Users with search history (default: a tenth of the customers).')
+        parser.add_argument('--activities', type=int, help='Searches logged in total (default: five per user).')
+        parser.add_argument('--password', default='password', help='Password of every synthetic user.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Hotels (with their rooms and bookings) written per transaction; '
+                                 'customers, users and searches go ten times as many at once.')
+        parser.add_argument('--flush', action='store_true',
+                            help='Delete the existing catalog, bookings, searches and synthetic users first.')
+
+    def handle(self, *args, **options):
+        if options['hotels'] is not None:
+            return self.seed_scale(options)
 
-    def handle(self, *args, **kwargs):
         # Clear existing data
         Booking.objects.all().delete()
         Customer.objects.all().delete()
@@ -44,28 +79,121 @@ class Command(BaseCommand):
         Room.objects.create(
             hotel=hotel1,
             room_type='Single',
-            price=120.00,
-            availability=True
+            price=120.00
         )
         Room.objects.create(
             hotel=hotel1,
             room_type='Double',
-            price=180.00,
-            availability=True
+            price=180.00
         )
 
         # Create rooms for hotel2
         Room.objects.create(
             hotel=hotel2,
             room_type='Suite',
-            price=250.00,
-            availability=True
+            price=250.00
         )
         Room.objects.create(
             hotel=hotel2,
             room_type='Double',
-            price=200.00,
-            availability=True
+            price=200.00
         )
 
         self.stdout.write(self.style.SUCCESS('Successfully seeded hotel, room, customer, and booking data with local images.'))
+
+    def seed_scale(self, options):
+        hotels = options['hotels']
+        rooms = hotels * options['rooms_per_hotel']
+        bookings = rooms if options['bookings'] is None else options['bookings']
+        customers = max(bookings // 5, 1) if options['customers'] is None else options['customers']
+        users = customers // 10 if options['users'] is None else min(options['users'], customers)
+        activities = 5 * users if options['activities'] is None else options['activities']
+        chunk_size = options['chunk_size']
+        if min(hotels, options['rooms_per_hotel'], bookings, customers, users, activities) < 0 or chunk_size < 1:
+            raise CommandError('Counts must not be negative.')
+        if bookings and not (rooms and customers):
+            raise CommandError('Bookings need at least one room and one customer.')
+        if activities and not users:
+            raise CommandError('Searches need at least one user.')
+
+        if options['flush']:
+            self.flush()
+        elif (Hotel.objects.exists() or Customer.objects.exists()
+              or User.objects.filter(username__startswith=USERNAME_PREFIX).exists()):
+            raise CommandError('The database already has data; pass --flush to replace it.')
+
+        data = SyntheticData(seed=options['seed'])
+        self.started = self.reported = time.perf_counter()
+        row_chunk = chunk_size * 10
+
+        customer_ids = []
+        for start, stop in chunked(customers, row_chunk):
+            with transaction.atomic():
+                created = Customer.objects.bulk_create(data.customers(start, stop))
+            customer_ids.extend(customer.pk for customer in created)
+            self.progress('customers', stop, customers)
+
+        # Hashing is deliberately slow, so every user shares one hash.
+        password = make_password(options['password'])
+        user_ids = []
+        for start, stop in chunked(users, row_chunk):
+            with transaction.atomic():
+                created = User.objects.bulk_create([
+                    User(username=f'{USERNAME_PREFIX}{i + 1}', email=customer_email(i), password=password)
+                    for i in range(start, stop)
+                ])
+            user_ids.extend(user.pk for user in created)
+            self.progress('users', stop, users)
+
+        for start, stop in chunked(activities, row_chunk):
+            with transaction.atomic():
+                UserActivity.objects.bulk_create(data.activities(user_ids, stop - start))
+            self.progress('searches', stop, activities)
+
+        # Bookings are spread evenly over the rooms: the first `extra` rooms
+        # get one more than the rest.
+        per_room, extra = divmod(bookings, rooms) if rooms else (0, 0)
+        room_number = booked = 0
+        for start, stop in chunked(hotels, chunk_size):
+            with transaction.atomic():
+                batch = Hotel.objects.bulk_create(data.hotels(start, stop))
+                HotelAmenity.objects.bulk_create(data.amenities(batch))
+                batch_rooms = Room.objects.bulk_create(data.rooms(batch, options['rooms_per_hotel']))
+                counts = [per_room + (room_number + i < extra) for i in range(len(batch_rooms))]
+                Booking.objects.bulk_create(data.bookings(batch_rooms, counts, customer_ids))
+                refresh_summaries([hotel.pk for hotel in batch])
+            room_number += len(batch_rooms)
+            booked += sum(counts)
+            self.progress('hotels', stop, hotels, f'{room_number} rooms, {booked} bookings')
+
+        # Cached pages, the facet index and the typeahead don't know about
+        # bulk inserts.
+        for scope in (CATALOG, HOTELS, ROOMS, SUMMARIES, TYPEAHEAD):
+            bump_version(scope)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {hotels} hotels, {rooms} rooms, {bookings} bookings, {customers} customers, '
+            f'{users} users and {activities} searches in {time.perf_counter() - self.started:.0f}s.'
+        ))
+        self.stdout.write('Run rebuild_search_index and refresh_recommendations --full to index the new data.')
+
+    def flush(self):
+        # Plain DELETEs: going through the ORM would load every row to run
+        # the per-hotel signal handlers.
+        models = [
+            Recommendation, RecommendationRun, UserActivity, Booking, ArchivedBooking, Customer, HotelAmenity, HotelSummary, Room, Hotel,
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in models:
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+            User.objects.filter(username__startswith=USERNAME_PREFIX, is_staff=False, is_superuser=False).delete()
+
+    def progress(self, label, done, total, detail=''):
+        now = time.perf_counter()
+        if done < total and now - self.reported < 1:
+            return
+        self.reported = now
+        elapsed = now - self.started
+        line = f'{label}: {done}/{total}'
+        if detail:
+            line += f' ({detail})'
+        self.stdout.write(f'{line} after {elapsed:.1f}s')
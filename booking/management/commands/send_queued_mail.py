@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from booking.mailqueue import MailSender
+
+
+class Command(BaseCommand):
+    help = 'Send the queued emails that are due, e.g. from cron or as a dedicated mail worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling every MAIL_POLL_INTERVAL seconds.')
+        parser.add_argument('--batch-size', type=int, help='Messages sent per SMTP connection.')
+
+    def handle(self, *args, **options):
+        sender = MailSender(
+            batch_size=options['batch_size'] or settings.MAIL_BATCH_SIZE,
+            poll_interval=settings.MAIL_POLL_INTERVAL,
+            background=False,
+        )
+        while True:
+            sent = sender.send_due()
+            if sent or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails.'))
+            if not options['loop']:
+                return
+            time.sleep(sender.poll_interval)
@@ -0,0 +1,37 @@
+import contextlib
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+def copy_database(source, target):
+    """Copy SQLite database ``source`` over ``target`` as one consistent
+    snapshot; both stay usable meanwhile."""
+    with contextlib.closing(sqlite3.connect(source)) as primary, contextlib.closing(sqlite3.connect(target)) as replica:
+        primary.backup(replica)
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database over every replica in settings.DATABASE_REPLICAS, to try '
+            'replica routing locally. With --interval, keep copying, like replication lagging that much.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Copy again every this many seconds.')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No replicas configured; set DATABASE_REPLICA_PATHS.')
+        databases = settings.DATABASES
+        if any(databases[alias]['ENGINE'] != 'django.db.backends.sqlite3' for alias in [DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS]):
+            raise CommandError('Only SQLite databases can be copied; use the database\'s own replication.')
+        while True:
+            start = time.perf_counter()
+            for alias in settings.DATABASE_REPLICAS:
+                copy_database(databases[DEFAULT_DB_ALIAS]['NAME'], databases[alias]['NAME'])
+            self.stdout.write(f'Copied the primary to {len(settings.DATABASE_REPLICAS)} replicas in {time.perf_counter() - start:.2f}s.')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,49 @@
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+_counters = defaultdict(int)
+_gauges = {}
+_lock = threading.Lock()
+
+
+def inc(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def value(name):
+    return _counters.get(name, _gauges.get(name, 0))
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+def render():
+    """Counters and gauges in the Prometheus text exposition format."""
+    lines = []
+    for name, count in sorted(snapshot().items()):
+        lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name} {count}')
+    with _lock:
+        gauges = dict(_gauges)
+    for name, gauge in sorted(gauges.items()):
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {gauge}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Expose this process's counters to scrapers on INTERNAL_IPS and to staff."""
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0003_useractivity'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='room',
+            name='availability',
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['room', 'check_out', 'check_in'], name='booking_room_dates_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_amenities(apps, schema_editor):
+    Hotel = apps.get_model('booking', 'Hotel')
+    HotelAmenity = apps.get_model('booking', 'HotelAmenity')
+    rows = []
+    for hotel_id, amenities in Hotel.objects.values_list('id', 'amenities').iterator():
+        names = {str(name).strip().lower()[:100] for name in amenities or [] if str(name).strip()}
+        rows.extend(HotelAmenity(hotel_id=hotel_id, name=name) for name in names)
+        if len(rows) >= 5000:
+            HotelAmenity.objects.bulk_create(rows)
+            rows = []
+    HotelAmenity.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0004_room_availability_booking_dates_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hotel',
+            name='location',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='hotel',
+            name='rating',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0.0, max_digits=3),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='price',
+            field=models.DecimalField(db_index=True, decimal_places=2, max_digits=8),
+        ),
+        migrations.CreateModel(
+            name='HotelAmenity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='amenity_rows', to='booking.hotel')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('name', 'hotel'), name='hotel_amenity_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_amenities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:53
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_summaries(apps, schema_editor):
+    Booking = apps.get_model('booking', 'Booking')
+    Hotel = apps.get_model('booking', 'Hotel')
+    HotelSummary = apps.get_model('booking', 'HotelSummary')
+    Room = apps.get_model('booking', 'Room')
+    today = timezone.localdate()
+    rooms = defaultdict(list)
+    for hotel_id, room_id, price in Room.objects.values_list('hotel_id', 'id', 'price').iterator():
+        rooms[hotel_id].append((room_id, price))
+    # Each room's first free night from today on.
+    free_from = {}
+    bookings = Booking.objects.filter(status__in=['pending', 'confirmed'], check_out__gt=today).order_by('room_id', 'check_in')
+    for room_id, check_in, check_out in bookings.values_list('room_id', 'check_in', 'check_out').iterator():
+        night = free_from.get(room_id, today)
+        if check_in <= night:
+            free_from[room_id] = max(night, check_out)
+    summaries = []
+    for hotel_id in Hotel.objects.values_list('id', flat=True).iterator():
+        prices = [price for room_id, price in rooms[hotel_id]]
+        nights = [free_from.get(room_id, today) for room_id, price in rooms[hotel_id]]
+        summaries.append(HotelSummary(
+            hotel_id=hotel_id,
+            min_price=min(prices, default=None),
+            max_price=max(prices, default=None),
+            room_count=len(prices),
+            available_rooms=nights.count(today),
+            next_free_date=min(nights, default=None),
+            as_of=today,
+        ))
+        if len(summaries) >= 5000:
+            HotelSummary.objects.bulk_create(summaries)
+            summaries = []
+    HotelSummary.objects.bulk_create(summaries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0009_outgoing_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotelSummary',
+            fields=[
+                ('hotel', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='booking.hotel')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('room_count', models.PositiveIntegerField(default=0)),
+                ('available_rooms', models.PositiveIntegerField(default=0)),
+                ('next_free_date', models.DateField(blank=True, db_index=True, null=True)),
+                ('as_of', models.DateField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['min_price', 'hotel'], name='hotel_summary_price_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# The hotel's amenities as one space-separated string.
+SQLITE_AMENITIES = "(SELECT group_concat(value, ' ') FROM json_each({row}.amenities))"
+
+SQLITE_INSERT = (
+    "INSERT INTO booking_hotel_fts(rowid, name, description, location, amenities) "
+    "VALUES ({row}.id, {row}.name, {row}.description, {row}.location, " + SQLITE_AMENITIES + ");"
+)
+
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE booking_hotel_fts USING fts5("
+    "name, description, location, amenities, tokenize='porter unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER booking_hotel_fts_insert AFTER INSERT ON booking_hotel BEGIN "
+    + SQLITE_INSERT.format(row='new') + " END",
+    "CREATE TRIGGER booking_hotel_fts_update AFTER UPDATE OF name, description, location, amenities ON booking_hotel BEGIN "
+    "DELETE FROM booking_hotel_fts WHERE rowid = old.id; " + SQLITE_INSERT.format(row='new') + " END",
+    "CREATE TRIGGER booking_hotel_fts_delete AFTER DELETE ON booking_hotel BEGIN "
+    "DELETE FROM booking_hotel_fts WHERE rowid = old.id; END",
+    "INSERT INTO booking_hotel_fts(rowid, name, description, location, amenities) "
+    "SELECT id, name, description, location, " + SQLITE_AMENITIES.format(row='booking_hotel') + " FROM booking_hotel",
+]
+
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS booking_hotel_fts_insert",
+    "DROP TRIGGER IF EXISTS booking_hotel_fts_update",
+    "DROP TRIGGER IF EXISTS booking_hotel_fts_delete",
+    "DROP TABLE IF EXISTS booking_hotel_fts",
+]
+
+# Must match booking.fulltext.POSTGRES_DOCUMENT, which queries it.
+POSTGRES_FORWARDS = [
+    "CREATE INDEX booking_hotel_fts ON booking_hotel USING gin (("
+    "setweight(to_tsvector('english', name), 'A') || "
+    "setweight(to_tsvector('english', location), 'B') || "
+    "setweight(jsonb_to_tsvector('english', amenities, '[\"string\"]'), 'C') || "
+    "setweight(to_tsvector('english', description), 'D')))",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS booking_hotel_fts",
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0010_hotel_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARDS, 'postgresql': POSTGRES_FORWARDS}),
+            run({'sqlite': SQLITE_BACKWARDS, 'postgresql': POSTGRES_BACKWARDS}),
+        ),
+    ]
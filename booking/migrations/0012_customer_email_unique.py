@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_customers(apps, schema_editor):
+    """Keep the oldest customer of each email, moving the others' bookings
+    to it, so the unique constraint can be added."""
+    Booking = apps.get_model('booking', 'Booking')
+    Customer = apps.get_model('booking', 'Customer')
+    duplicated = (
+        Customer.objects.values('email').annotate(customers=Count('id'), keep=Min('id')).filter(customers__gt=1)
+    )
+    for row in duplicated.iterator():
+        others = Customer.objects.filter(email=row['email']).exclude(id=row['keep'])
+        Booking.objects.filter(customer__in=others).update(customer_id=row['keep'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0011_hotel_fulltext'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_customers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='customer',
+            constraint=models.UniqueConstraint(fields=['email'], name='customer_email_unique'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0012_customer_email_unique'),
+    ]
+
+    # The replacement is added before booking_room_dates_idx goes, so
+    # overlap checks are indexed throughout.
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['room', 'check_out', 'check_in', 'status'], name='booking_room_stay_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='booking_room_dates_idx',
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['customer', 'check_in', 'id'], name='booking_customer_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['check_in', 'status', 'room'], name='booking_check_in_idx'),
+        ),
+    ]
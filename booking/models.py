@@ -1,31 +1,87 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Hotel(models.Model):
     name = models.CharField(max_length=200)
-    location = models.CharField(max_length=200)
+    location = models.CharField(max_length=200, db_index=True)
     description = models.TextField()
     image = models.ImageField(upload_to='hotel_images/', blank=True, null=True)
-    rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.0)
+    # Derivatives of ``image`` written by booking.images: {'name': image
+    # name, 'widths': [...]}. Empty until the background worker is done.
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.0, db_index=True)
     amenities = models.JSONField(default=list, blank=True)
 
     def __str__(self):
         return self.name
 
+class HotelAmenity(models.Model):
+    """One row per amenity in ``Hotel.amenities``, so amenity filters and
+    facet counts are indexed lookups instead of JSON parsing per row. Kept in
+    sync by booking.signals."""
+    hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='amenity_rows')
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'hotel'], name='hotel_amenity_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} - {self.hotel_id}"
+
+    @staticmethod
+    def normalize(names):
+        return sorted({str(name).strip().lower()[:100] for name in names or [] if str(name).strip()})
+
 class Room(models.Model):
     hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='rooms')
     room_type = models.CharField(max_length=100)
-    price = models.DecimalField(max_digits=8, decimal_places=2)
-    availability = models.BooleanField(default=True)
+    price = models.DecimalField(max_digits=8, decimal_places=2, db_index=True)
 
     def __str__(self):
         return f"{self.room_type} - {self.hotel.name}"
 
+class HotelSummary(models.Model):
+    """Per-hotel aggregates over its rooms and bookings, so hotels can be
+    sorted and filtered by price and availability with indexed lookups
+    instead of joining Room and Booking per hotel. Kept up to date by
+    booking.signals and rebuilt by ``manage.py repair_hotel_summaries``.
+
+    Availability is as of ``as_of``: ``available_rooms`` are free that
+    night and ``next_free_date`` is the first night from then on with a
+    free room (None without rooms).
+    """
+    hotel = models.OneToOneField(Hotel, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    min_price = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
+    max_price = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
+    room_count = models.PositiveIntegerField(default=0)
+    available_rooms = models.PositiveIntegerField(default=0)
+    next_free_date = models.DateField(blank=True, null=True, db_index=True)
+    as_of = models.DateField()
+
+    class Meta:
+        indexes = [
+            # Cheapest-first listings walk this, keyset paginated.
+            models.Index(fields=['min_price', 'hotel'], name='hotel_summary_price_idx'),
+        ]
+
+    def __str__(self):
+        return f"Summary of {self.hotel_id}"
+
 class Customer(models.Model):
     name = models.CharField(max_length=200)
     email = models.EmailField()
     phone = models.CharField(max_length=20)
 
+    class Meta:
+        constraints = [
+            # One customer per email: book_room looks customers up by it, and
+            # my_bookings and recommendations match them to users by it.
+            models.UniqueConstraint(fields=['email'], name='customer_email_unique'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -41,15 +97,98 @@ class Booking(models.Model):
     check_out = models.DateField()
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
 
+    class Meta:
+        indexes = [
+            # Date-range overlap checks per room; see booking.availability.
+            # The status is in the index so inactive bookings are skipped
+            # without reading the rows.
+            models.Index(fields=['room', 'check_out', 'check_in', 'status'], name='booking_room_stay_idx'),
+            # A customer's bookings, latest stay first (my_bookings).
+            models.Index(fields=['customer', 'check_in', 'id'], name='booking_customer_dates_idx'),
+            # Bookings by date across the catalog (popular hotels), with
+            # what the recommendations count so no rows are read.
+            models.Index(fields=['check_in', 'status', 'room'], name='booking_check_in_idx'),
+        ]
+
     def __str__(self):
         return f"Booking by {self.customer.name} for {self.room} from {self.check_in} to {self.check_out}"
 
+class ArchivedBooking(models.Model):
+    """A booking whose stay ended long ago, moved out of Booking by
+    booking.retention so the live table only holds current stays. It keeps
+    the booking's id. Room and hotel are unconstrained references, so
+    purging a hotel leaves its history alone."""
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='archived_bookings')
+    room = models.ForeignKey(Room, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    hotel = models.ForeignKey(Hotel, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    check_in = models.DateField()
+    check_out = models.DateField()
+    status = models.CharField(max_length=10, choices=Booking.STATUS_CHOICES)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Archived booking {self.pk} from {self.check_in} to {self.check_out}"
+
 class UserActivity(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     location = models.CharField(max_length=200, blank=True, null=True)
     min_rating = models.DecimalField(max_digits=3, decimal_places=2, blank=True, null=True)
     max_price = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set by the recorder when the search happened, not when the batch lands.
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.location or 'Any Location'}"
+class Recommendation(models.Model):
+    """A user's precomputed top hotels, best first. Written by
+    booking.recommendations.refresh; the recommendations view only reads it."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='recommendation')
+    hotel_ids = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Recommendations for {self.user_id}"
+
+class RecommendationRun(models.Model):
+    """One refresh of the recommendations. ``activity_id`` and ``booking_id``
+    are the highest ids it had seen, so the next run only revisits users
+    with newer searches or bookings."""
+    activity_id = models.BigIntegerField(default=0)
+    booking_id = models.BigIntegerField(default=0)
+    full = models.BooleanField(default=False)
+    users = models.IntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+    duration = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"Recommendation run {self.pk} ({self.users} users)"
+
+class OutgoingEmail(models.Model):
+    """A message waiting in (or done with) the outbound mail queue; see
+    booking.mailqueue. ``lease`` marks the worker currently sending it."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    lease = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # The worker's "what is due" scan.
+            models.Index(fields=['status', 'next_attempt_at'], name='outgoing_email_due_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.location or 'Any Location'}"
\ No newline at end of file
+        return f"{self.subject} to {', '.join(self.to)}"
@@ -0,0 +1,40 @@
+import threading
+
+from django.conf import settings
+
+_nlp = None
+_lock = threading.Lock()
+
+
+def get_nlp():
+    """Return the shared spaCy pipeline, loading it on first use.
+
+    Only the tokenizer and word vectors are needed for document vectors, so
+    the components listed in ``settings.SPACY_EXCLUDE`` (parser, NER, ...)
+    are never loaded.
+    """
+    global _nlp
+    if _nlp is None:
+        with _lock:
+            if _nlp is None:
+                # spaCy itself is slow to import, so defer that too.
+                import spacy
+
+                _nlp = spacy.load(settings.SPACY_MODEL, exclude=settings.SPACY_EXCLUDE)
+    return _nlp
+
+
+def is_loaded():
+    return _nlp is not None
+
+
+def reset():
+    """Drop the loaded pipeline so the next call reloads it from settings."""
+    global _nlp
+    with _lock:
+        _nlp = None
+
+
+def warm_up():
+    """Load the pipeline ahead of the first request, e.g. at worker boot."""
+    get_nlp()('warm up')
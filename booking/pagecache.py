@@ -0,0 +1,73 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from . import metrics
+from .cache import get_versions
+
+
+def page_cache_key(request, view_name, versions):
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    stamp = ':'.join(f'{scope}={version}' for scope, version in sorted(versions.items()))
+    return f'page:{view_name}:{stamp}:{path}'
+
+
+def _cacheable(response):
+    return response.status_code == 200 and not response.streaming and not response.cookies
+
+
+def cache_page_for_anonymous(*scopes):
+    """Cache a view's whole response for anonymous GETs.
+
+    ``scopes`` name the version scopes (see booking.cache.get_versions) the
+    page depends on, formatted with the view's keyword arguments, e.g.
+    ``'hotel:{hotel_id}'``. The key includes their versions, so the signal
+    handlers that bump a scope invalidate exactly the pages built from it.
+
+    Logged-in users always get a fresh render, since the page greets them
+    and carries their CSRF token; the fragments inside are still cached
+    for them with ``{% cache %}``. Cached responses carry an ETag and
+    Last-Modified, so repeat visitors get a 304.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            versions = get_versions([scope.format(**kwargs) for scope in scopes])
+            key = page_cache_key(request, view.__name__, versions)
+            entry = cache.get(key)
+            if entry is None:
+                metrics.inc('page_cache_misses_total')
+                response = view(request, *args, **kwargs)
+                if not _cacheable(response):
+                    return response
+                entry = {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'etag': quote_etag(hashlib.sha1(response.content).hexdigest()),
+                    'last_modified': int(time.time()),
+                }
+                cache.set(key, entry, settings.PAGE_CACHE_TIMEOUT)
+            else:
+                metrics.inc('page_cache_hits_total')
+                response = HttpResponse(entry['content'], content_type=entry['content_type'])
+
+            response['ETag'] = entry['etag']
+            response['Last-Modified'] = http_date(entry['last_modified'])
+            patch_vary_headers(response, ('Cookie',))
+            return get_conditional_response(
+                request,
+                etag=entry['etag'],
+                last_modified=entry['last_modified'],
+                response=response,
+            )
+        return wrapper
+    return decorator
@@ -0,0 +1,197 @@
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import math
+
+from django.conf import settings
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(direction, values):
+    data = json.dumps([direction, values], separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(data)
+    except (binascii.Error, ValueError, TypeError):
+        raise BadRequest('Invalid cursor.')
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        raise BadRequest('Invalid cursor.')
+    return direction, values
+
+
+def get_page_size(request, max_size=None):
+    try:
+        size = int(request.GET.get('page_size', settings.PAGE_SIZE))
+    except ValueError:
+        size = settings.PAGE_SIZE
+    return max(1, min(size, max_size or settings.MAX_PAGE_SIZE))
+
+
+def _cursor_value(obj, field):
+    value = obj
+    for part in field.split('__'):
+        # Model instances, or rows from values().
+        value = value[part] if isinstance(value, dict) else getattr(value, part)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def _ordering_field(queryset, name):
+    """The model field (or annotation's output field) ``name`` orders by."""
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    model = queryset.model
+    *path, last = name.split('__')
+    for part in path:
+        model = model._meta.get_field(part).related_model
+    field = model._meta.get_field(last)
+    return field.target_field if field.is_relation else field
+
+
+def _cursor_values(queryset, ordering, values):
+    """The cursor's ``values`` as Python values of the ordering fields.
+    Raises ``BadRequest`` for anything else, e.g. a tampered cursor."""
+    if len(values) != len(ordering):
+        raise BadRequest('Invalid cursor.')
+    parsed = []
+    for field, value in zip(ordering, values):
+        try:
+            value = _ordering_field(queryset, field.lstrip('-')).to_python(value)
+            if value is None or (isinstance(value, (float, decimal.Decimal)) and not math.isfinite(value)):
+                raise ValueError(value)
+        except (ValidationError, ValueError, TypeError, decimal.InvalidOperation):
+            raise BadRequest('Invalid cursor.')
+        parsed.append(value)
+    return parsed
+
+
+def _after(ordering, values):
+    """Q for rows strictly after ``values`` in ``ordering``:
+    (a > x) OR (a = x AND b > y) OR ..."""
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        term = Q(**{f'{name}__{lookup}': values[i]})
+        for previous, value in zip(ordering[:i], values):
+            term &= Q(**{previous.lstrip('-'): value})
+        condition |= term
+    return condition
+
+
+def _reverse(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+class KeysetPage:
+    def __init__(self, items, request, next_values=None, prev_values=None):
+        self.object_list = items
+        self.request = request
+        self.next_cursor = encode_cursor('next', next_values) if next_values is not None else None
+        self.previous_cursor = encode_cursor('prev', prev_values) if prev_values is not None else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def _query(self, cursor):
+        params = self.request.GET.copy()
+        params['cursor'] = cursor
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query(self.next_cursor) if self.has_next else ''
+
+    @property
+    def previous_query(self):
+        return self._query(self.previous_cursor) if self.has_previous else ''
+
+
+def keyset_paginate(request, queryset, ordering, max_size=None):
+    """Return one page of ``queryset`` after/before ``request.GET['cursor']``.
+
+    ``ordering`` must be unique (end it with the primary key). Each page is a
+    ``WHERE (ordering) > (cursor) ORDER BY ... LIMIT n`` range read, so deep
+    pages cost the same as the first one, unlike OFFSET pagination.
+    ``queryset`` may be a ``values()`` queryset that includes the ordering
+    fields. ``max_size`` overrides settings.MAX_PAGE_SIZE.
+    """
+    ordering = list(ordering)
+    size = get_page_size(request, max_size)
+    cursor = request.GET.get('cursor')
+    direction, values = decode_cursor(cursor) if cursor else ('next', None)
+    if values is not None:
+        values = _cursor_values(queryset, ordering, values)
+
+    if direction == 'next':
+        qs = queryset.order_by(*ordering)
+        if values is not None:
+            qs = qs.filter(_after(ordering, values))
+    else:
+        qs = queryset.order_by(*_reverse(ordering)).filter(_after(_reverse(ordering), values))
+    rows = list(qs[:size + 1])
+    more = len(rows) > size
+    rows = rows[:size]
+    if direction == 'prev':
+        rows.reverse()
+
+    def key(obj):
+        return [_cursor_value(obj, field.lstrip('-')) for field in ordering]
+
+    has_next = more if direction == 'next' else True
+    has_previous = values is not None if direction == 'next' else more
+    return KeysetPage(
+        rows,
+        request,
+        next_values=key(rows[-1]) if rows and has_next else None,
+        prev_values=key(rows[0]) if rows and has_previous else None,
+    )
+
+
+def paginate_ranked(request, ranked_ids, fetch):
+    """Page through an already ranked list of ids (e.g. search results).
+
+    The cursor is a position in the list, so only the ids on the page are
+    fetched from the database with ``fetch(ids)``, which must return a
+    mapping of id to object.
+    """
+    size = get_page_size(request)
+    cursor = request.GET.get('cursor')
+    direction, values = decode_cursor(cursor) if cursor else ('next', [0])
+    try:
+        position = int(values[0])
+    except (IndexError, TypeError, ValueError):
+        raise BadRequest('Invalid cursor.')
+    if position < 0:
+        raise BadRequest('Invalid cursor.')
+    start = position if direction == 'next' else max(position - size, 0)
+    page_ids = ranked_ids[start:start + size]
+    objects = fetch(page_ids)
+    end = start + len(page_ids)
+    return KeysetPage(
+        [objects[pk] for pk in page_ids if pk in objects],
+        request,
+        next_values=[end] if end < len(ranked_ids) else None,
+        prev_values=[start] if start > 0 else None,
+    )
@@ -0,0 +1,256 @@
+import datetime
+import time
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Q
+from django.utils import timezone
+
+from .availability import ACTIVE_STATUSES
+from .facets import FacetIndex
+from .models import Booking, Hotel, Recommendation, RecommendationRun, UserActivity
+
+POPULAR_CACHE_KEY = 'recommendations:popular'
+
+# Score = location match + amenity match + rating + popularity, scaled down
+# for hotels above the user's usual budget or below their usual min rating.
+LOCATION_WEIGHT = 0.45
+AMENITY_WEIGHT = 0.25
+RATING_WEIGHT = 0.2
+POPULARITY_WEIGHT = 0.1
+# A booking says more about a user's taste than a search.
+BOOKING_WEIGHT = 3.0
+BELOW_MIN_RATING_FACTOR = 0.5
+
+
+def recent_booking_counts():
+    """``(hotel_id, bookings)`` over the last RECOMMENDATION_POPULAR_DAYS,
+    for hotels with any."""
+    since = timezone.now().date() - datetime.timedelta(days=settings.RECOMMENDATION_POPULAR_DAYS)
+    return (
+        Booking.objects.filter(status__in=ACTIVE_STATUSES, check_in__gte=since)
+        .order_by().values('room__hotel_id').annotate(n=Count('id')).values_list('room__hotel_id', 'n')
+    )
+
+
+class HotelFeatures:
+    """The catalog as arrays: one column per hotel, in id order."""
+
+    def __init__(self):
+        columns = FacetIndex(version=None)
+        self.ids = columns.ids
+        self.locations = columns.locations
+        self.location_codes = columns.location_codes
+        self.ratings = (columns.ratings / 5).astype(np.float32)
+        # Hotel positions grouped by location: the hotels in location c are
+        # by_location[location_offsets[c]:location_offsets[c + 1]].
+        self.by_location = np.argsort(self.location_codes, kind='stable')
+        self.location_offsets = np.searchsorted(self.location_codes[self.by_location], np.arange(len(self.locations) + 1))
+        with np.errstate(divide='ignore'):
+            self.inverse_prices = np.nan_to_num(1 / columns.min_prices, nan=0, posinf=0).astype(np.float32)
+        self.amenity_matrix = np.zeros((len(self.ids), len(columns.amenities)), dtype=np.float32)
+        self.amenity_matrix[columns.amenity_hotels, columns.amenity_codes] = 1
+        norms = np.linalg.norm(self.amenity_matrix, axis=1, keepdims=True)
+        self.amenity_matrix /= np.where(norms > 0, norms, 1)
+
+        self.popularity = np.zeros(len(self.ids), dtype=np.float32)
+        for hotel_id, count in recent_booking_counts():
+            position = self.position(hotel_id)
+            if position is not None:
+                self.popularity[position] = count
+        if self.popularity.max(initial=0) > 0:
+            self.popularity /= self.popularity.max()
+
+        self.static_scores = (RATING_WEIGHT * self.ratings + POPULARITY_WEIGHT * self.popularity).astype(np.float32)
+
+    def position(self, hotel_id):
+        position = int(np.searchsorted(self.ids, hotel_id))
+        return position if position < len(self.ids) and self.ids[position] == hotel_id else None
+
+    def location_codes_for(self, locations):
+        """Codes of ``locations``, -1 for places no hotel is in."""
+        locations = np.array(locations, dtype=str)
+        if not len(self.locations):
+            return np.full(len(locations), -1)
+        positions = np.searchsorted(self.locations, locations)
+        positions[positions == len(self.locations)] = 0
+        return np.where(self.locations[positions] == locations, positions, -1)
+
+
+class UserProfiles:
+    """Search and booking preferences of a batch of users, as arrays with
+    one row per user."""
+
+    def __init__(self, user_ids, hotels):
+        self.user_ids = list(user_ids)
+        row = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        n = len(self.user_ids)
+        self.locations = np.zeros((n, len(hotels.locations)), dtype=np.float32)
+        self.amenities = np.zeros((n, hotels.amenity_matrix.shape[1]), dtype=np.float32)
+        self.max_prices = np.full(n, np.nan, dtype=np.float32)
+        self.min_ratings = np.full(n, np.nan, dtype=np.float32)
+
+        searches = list(
+            UserActivity.objects.filter(user_id__in=self.user_ids).exclude(location=None)
+            .order_by().values('user_id', 'location').annotate(n=Count('id')).values_list('user_id', 'location', 'n')
+        )
+        if searches:
+            users, locations, counts = zip(*searches)
+            codes = hotels.location_codes_for(locations)
+            known = codes >= 0
+            rows = np.array([row[user_id] for user_id in users])
+            np.add.at(self.locations, (rows[known], codes[known]), np.array(counts, dtype=np.float32)[known])
+        preferences = (
+            UserActivity.objects.filter(user_id__in=self.user_ids)
+            .order_by().values('user_id').annotate(max_price=Avg('max_price'), min_rating=Avg('min_rating'))
+            .values_list('user_id', 'max_price', 'min_rating')
+        )
+        for user_id, max_price, min_rating in preferences:
+            if max_price is not None:
+                self.max_prices[row[user_id]] = max_price
+            if min_rating is not None:
+                self.min_ratings[row[user_id]] = min_rating
+
+        # Bookings belong to customers; like my_bookings, match them to users
+        # by email.
+        users_by_email = {}
+        for user_id, email in User.objects.filter(id__in=self.user_ids).exclude(email='').values_list('id', 'email'):
+            users_by_email.setdefault(email, []).append(user_id)
+        bookings = Booking.objects.filter(
+            customer__email__in=list(users_by_email), status__in=ACTIVE_STATUSES,
+        ).values_list('customer__email', 'room__hotel_id')
+        for email, hotel_id in bookings:
+            position = hotels.position(hotel_id)
+            if position is None:
+                continue
+            for user_id in users_by_email[email]:
+                self.locations[row[user_id], hotels.location_codes[position]] += BOOKING_WEIGHT
+                self.amenities[row[user_id]] += BOOKING_WEIGHT * hotels.amenity_matrix[position]
+
+        # Scale each user's location weights to [0, 1] and amenity taste to a
+        # unit vector, so heavy users don't outscore the rating terms.
+        peaks = self.locations.max(axis=1, initial=0)[:, None]
+        self.locations /= np.where(peaks > 0, peaks, 1)
+        norms = np.linalg.norm(self.amenities, axis=1, keepdims=True)
+        self.amenities /= np.where(norms > 0, norms, 1)
+
+
+def score(profiles, hotels):
+    """users x hotels score matrix."""
+    scores = AMENITY_WEIGHT * (profiles.amenities @ hotels.amenity_matrix.T)
+    scores += hotels.static_scores
+
+    # Each user cares about a handful of locations, so add the location term
+    # only to the hotels in those, rather than gathering a users x hotels
+    # matrix from the users x locations one.
+    users, locations = np.nonzero(profiles.locations)
+    starts = hotels.location_offsets[locations]
+    counts = hotels.location_offsets[locations + 1] - starts
+    ends = np.cumsum(counts)
+    positions = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts - starts, counts)
+    scores[np.repeat(users, counts), hotels.by_location[positions]] += (
+        LOCATION_WEIGHT * np.repeat(profiles.locations[users, locations], counts)
+    )
+
+    # Price fit is budget / cheapest room, capped at 1; without a budget
+    # every price fits. Hotels without rooms can't be booked either way.
+    # (A huge finite budget rather than inf, so that times 0 stays 0.)
+    budgets = np.where(np.isnan(profiles.max_prices), np.finfo(np.float32).max, profiles.max_prices)
+    with np.errstate(over='ignore'):
+        scores *= np.minimum(budgets[:, None] * hotels.inverse_prices, np.float32(1))
+    picky = np.flatnonzero(~np.isnan(profiles.min_ratings))
+    if len(picky):
+        below = hotels.ratings * 5 < profiles.min_ratings[picky, None]
+        scores[picky] *= np.where(below, np.float32(BELOW_MIN_RATING_FACTOR), np.float32(1))
+    return scores
+
+
+def top_hotels(scores, hotels, count):
+    size = scores.shape[1]
+    count = min(count, size)
+    if not count:
+        return [[] for _ in range(scores.shape[0])]
+    top = np.argpartition(scores, size - count, axis=1)[:, size - count:]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    return hotels.ids[top].tolist()
+
+
+def changed_users(since, activity_mark, booking_mark):
+    """Users with searches or bookings newer than the ``since`` run (all
+    users with any when ``since`` is None), up to the given id marks."""
+    activity = UserActivity.objects.filter(id__lte=activity_mark)
+    bookings = Booking.objects.filter(id__lte=booking_mark)
+    if since is not None:
+        activity = activity.filter(id__gt=since.activity_id)
+        bookings = bookings.filter(id__gt=since.booking_id)
+    user_ids = set(activity.order_by().values_list('user_id', flat=True).distinct())
+    emails = bookings.order_by().values_list('customer__email', flat=True).distinct()
+    user_ids.update(User.objects.filter(email__in=emails).exclude(email='').values_list('id', flat=True))
+    return sorted(user_ids)
+
+
+def refresh(full=False, chunk_size=None):
+    """Recompute the stored recommendations and return the ``RecommendationRun``.
+
+    Only users with searches or bookings since the previous run are scored,
+    unless ``full`` is set (or there was no previous run), which rescores
+    everyone; run it after catalog changes such as new hotels or prices.
+    Users are scored ``chunk_size`` at a time against the whole catalog with
+    a few matrix operations, and each chunk is upserted in its own short
+    transaction.
+    """
+    started_at = timezone.now()
+    start = time.perf_counter()
+    chunk_size = chunk_size or settings.RECOMMENDATION_CHUNK_SIZE
+    previous = None if full else RecommendationRun.objects.order_by('-id').first()
+    activity_mark = UserActivity.objects.aggregate(mark=Max('id'))['mark'] or 0
+    booking_mark = Booking.objects.aggregate(mark=Max('id'))['mark'] or 0
+    user_ids = changed_users(previous, activity_mark, booking_mark)
+
+    if user_ids:
+        hotels = HotelFeatures()
+        for i in range(0, len(user_ids), chunk_size):
+            profiles = UserProfiles(user_ids[i:i + chunk_size], hotels)
+            ranked = top_hotels(score(profiles, hotels), hotels, settings.RECOMMENDATION_COUNT)
+            with transaction.atomic():
+                Recommendation.objects.bulk_create(
+                    [Recommendation(user_id=user_id, hotel_ids=ids) for user_id, ids in zip(profiles.user_ids, ranked)],
+                    update_conflicts=True,
+                    unique_fields=['user'],
+                    update_fields=['hotel_ids', 'updated_at'],
+                )
+    cache.delete(POPULAR_CACHE_KEY)
+    return RecommendationRun.objects.create(
+        activity_id=activity_mark,
+        booking_id=booking_mark,
+        full=previous is None,
+        users=len(user_ids),
+        started_at=started_at,
+        duration=time.perf_counter() - start,
+    )
+
+
+def popular_hotel_ids():
+    """Most booked hotels over the last RECOMMENDATION_POPULAR_DAYS, then
+    best rated; cached for RECOMMENDATION_POPULAR_TIMEOUT seconds."""
+    def compute():
+        since = timezone.now().date() - datetime.timedelta(days=settings.RECOMMENDATION_POPULAR_DAYS)
+        recent = Q(rooms__bookings__status__in=ACTIVE_STATUSES, rooms__bookings__check_in__gte=since)
+        hotels = Hotel.objects.annotate(bookings=Count('rooms__bookings', filter=recent))
+        return list(hotels.order_by('-bookings', '-rating', 'id').values_list('id', flat=True)[:settings.RECOMMENDATION_COUNT])
+
+    return cache.get_or_set(POPULAR_CACHE_KEY, compute, settings.RECOMMENDATION_POPULAR_TIMEOUT)
+
+
+def recommended_hotel_ids(user):
+    """Return ``(hotel_ids, source)``: the user's stored recommendations, or
+    the popular hotels for anonymous users and users without any yet."""
+    if user.is_authenticated:
+        hotel_ids = Recommendation.objects.filter(user=user).values_list('hotel_ids', flat=True).first()
+        if hotel_ids:
+            return hotel_ids, 'personal'
+    return popular_hotel_ids(), 'popular'
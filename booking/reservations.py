@@ -0,0 +1,77 @@
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+from .availability import is_room_free
+from .models import Booking, Customer, Room
+
+# Fragments of the lock-timeout / deadlock errors raised by SQLite,
+# PostgreSQL and MySQL; these are worth retrying, anything else is not.
+RETRYABLE_ERRORS = (
+    'database is locked',
+    'database table is locked',
+    'deadlock',
+    'lock wait timeout',
+    'could not obtain lock',
+    'could not serialize',
+)
+
+
+class BookingConflict(Exception):
+    """The room already has an active booking overlapping the stay."""
+
+
+def is_retryable(error):
+    message = str(error).lower()
+    return any(fragment in message for fragment in RETRYABLE_ERRORS)
+
+
+def lock_room(room_id):
+    """Serialize reservations for ``room_id`` until the transaction ends.
+
+    Backends with row locks use ``SELECT ... FOR UPDATE``, so bookings for
+    other rooms proceed in parallel. SQLite has no row locks: a no-op UPDATE
+    as the first statement takes the database write lock up front (like
+    ``BEGIN IMMEDIATE``), so two transactions can never both read a room as
+    free and then race to insert.
+    """
+    if connection.features.has_select_for_update:
+        return Room.objects.select_for_update().get(pk=room_id)
+    Room.objects.filter(pk=room_id).update(id=room_id)
+    return Room.objects.get(pk=room_id)
+
+
+def _backoff(attempt):
+    delay = min(settings.BOOKING_RETRY_MAX_DELAY, settings.BOOKING_RETRY_BASE_DELAY * 2 ** attempt)
+    # Full jitter keeps retrying writers from waking up in lockstep.
+    time.sleep(random.uniform(0, delay))
+
+
+def reserve_room(room_id, check_in, check_out, name, email, phone):
+    """Book ``room_id`` for [check_in, check_out) and return the ``Booking``.
+
+    Raises ``BookingConflict`` if the stay overlaps an active booking and
+    ``Room.DoesNotExist`` if the room is gone. Lock timeouts are retried up
+    to ``settings.BOOKING_MAX_ATTEMPTS`` times with capped exponential
+    backoff.
+    """
+    for attempt in range(settings.BOOKING_MAX_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                room = lock_room(room_id)
+                if not is_room_free(room, check_in, check_out):
+                    raise BookingConflict(f'{room} is already booked between {check_in} and {check_out}.')
+                customer, created = Customer.objects.get_or_create(email=email, defaults={'name': name, 'phone': phone})
+                return Booking.objects.create(
+                    customer=customer,
+                    room=room,
+                    check_in=check_in,
+                    check_out=check_out,
+                    status='confirmed'
+                )
+        except OperationalError as e:
+            if not is_retryable(e) or attempt == settings.BOOKING_MAX_ATTEMPTS - 1:
+                raise
+            _backoff(attempt)
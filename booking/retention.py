@@ -0,0 +1,127 @@
+"""Keeping the booking tables small: past bookings are archived and hotels
+are purged in bounded chunks.
+
+``archive_bookings()`` moves bookings whose stay ended more than
+BOOKING_ARCHIVE_AFTER_DAYS ago, whatever their status, into
+ArchivedBooking, one short transaction per chunk. ``purge_hotel()``
+deletes a hotel's bookings and rooms a chunk at a time instead of through
+Django's cascade, which loads every row into memory (and sends a signal
+for each) inside a single transaction holding the write lock throughout.
+
+Chunks are deleted below the ORM, so the per-row signals don't run: past
+stays don't change the summaries (booking.summaries only counts stays
+from today on), and the hotel's own deletion at the end of a purge sends
+everything its rooms and bookings would have. Both take a ``pause``
+between chunks so other writers get a turn, and report their progress
+through an optional callback.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.utils import timezone
+
+from .models import ArchivedBooking, Booking, Room
+
+# Booking's columns in ArchivedBooking's order.
+ARCHIVED_FIELDS = ['id', 'customer_id', 'room_id', 'room__hotel_id', 'check_in', 'check_out', 'status', 'archived_at']
+
+
+def delete_chunk(queryset, size):
+    """Delete up to ``size`` rows of ``queryset``, without signals or
+    cascades, and return how many went."""
+    # The ids are read first: MySQL rejects a LIMIT in an IN subquery.
+    ids = list(queryset.order_by().values_list('pk', flat=True)[:size])
+    if not ids:
+        return 0
+    chunk = queryset.model._base_manager.filter(pk__in=ids)
+    return chunk._raw_delete(chunk.db)
+
+
+def copy_to_archive(bookings, archived_at):
+    """Copy ``bookings`` into ArchivedBooking with one INSERT ... SELECT."""
+    rows = bookings.annotate(archived_at=models.Value(archived_at, output_field=models.DateTimeField()))
+    sql, params = rows.values_list(*ARCHIVED_FIELDS).query.get_compiler(using=bookings.db).as_sql()
+    connection = connections[bookings.db]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in ArchivedBooking._meta.concrete_fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {quote(ArchivedBooking._meta.db_table)} ({columns}) {sql}', params)
+
+
+def archive_bookings(days=None, batch_size=None, pause=None, progress=None, today=None):
+    """Archive the bookings that checked out more than ``days`` days before
+    ``today`` and return how many were moved. ``progress`` is called with
+    the running total after each chunk.
+
+    The page caches are left alone: the stays did happen, and hotel pages
+    asked about those dates showing them booked stays true.
+    """
+    days = settings.BOOKING_ARCHIVE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    pause = settings.RETENTION_BATCH_PAUSE if pause is None else pause
+    if days < 0:
+        raise ValueError('Only bookings that have ended can be archived.')
+    cutoff = (today or timezone.localdate()) - datetime.timedelta(days=days)
+    # A stay checks in before it checks out, so the check-in index finds
+    # the candidates.
+    ended = Booking.objects.filter(check_in__lt=cutoff, check_out__lt=cutoff).order_by()
+    archived = 0
+    while True:
+        with transaction.atomic():
+            ids = list(ended.select_for_update().values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            moved = Booking.objects.filter(pk__in=ids)
+            copy_to_archive(moved, timezone.now())
+            moved._raw_delete(moved.db)
+        archived += len(ids)
+        if progress:
+            progress(archived)
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    return archived
+
+
+def purge_hotel(hotel, batch_size=None, pause=None, progress=None):
+    """Delete ``hotel`` with its rooms and bookings, ``batch_size`` rows per
+    statement. ``progress`` is called with ``'bookings'`` or ``'rooms'`` and
+    the number deleted so far after each chunk that deleted any. Returns the
+    numbers of bookings and rooms deleted; archived bookings are kept."""
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    pause = settings.RETENTION_BATCH_PAUSE if pause is None else pause
+    deleted = {'bookings': 0, 'rooms': 0}
+
+    def report(label, count):
+        deleted[label] += count
+        if progress and count:
+            progress(label, deleted[label])
+
+    bookings = Booking.objects.filter(room__hotel=hotel)
+    while True:
+        count = delete_chunk(bookings, batch_size)
+        report('bookings', count)
+        if count < batch_size:
+            break
+        time.sleep(pause)
+    while True:
+        with transaction.atomic():
+            # Locked like reserve_room() locks them, so a booking made in
+            # the meantime is deleted with its room rather than left behind.
+            rooms = Room.objects.filter(hotel=hotel).select_for_update()
+            room_ids = list(rooms.values_list('id', flat=True)[:batch_size])
+            if not room_ids:
+                break
+            late = Booking.objects.filter(room_id__in=room_ids)
+            report('bookings', late._raw_delete(late.db))
+            chunk = Room.objects.filter(pk__in=room_ids)
+            report('rooms', chunk._raw_delete(chunk.db))
+        if len(room_ids) < batch_size:
+            break
+        time.sleep(pause)
+    # What's left (amenity rows and the summary) goes through the ORM, so
+    # the hotel's signals drop it from the search indexes and page caches.
+    hotel.delete()
+    return deleted['bookings'], deleted['rooms']
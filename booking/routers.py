@@ -0,0 +1,132 @@
+import contextlib
+import contextvars
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Models whose reads may be served by a replica: the catalog, which is
+# browsed far more often than it changes. Bookings, customers, users and
+# sessions are always read from the primary.
+REPLICA_MODELS = {'booking.hotel', 'booking.room', 'booking.hotelamenity', 'booking.hotelsummary'}
+
+PRIMARY_UNTIL_KEY = 'db:primary-until'
+
+# Replicas are only read from where PrimaryReplicaMiddleware allows it:
+# requests that can't write. Commands, shells and background threads
+# always read the primary.
+_replicas_allowed = contextvars.ContextVar('booking_replicas_allowed', default=False)
+# Until when (time.time()) this process reads from the primary, because a
+# change may not have reached the replicas yet.
+_primary_until = 0.0
+
+
+@contextlib.contextmanager
+def _allow_replicas(allowed):
+    token = _replicas_allowed.set(allowed)
+    try:
+        yield
+    finally:
+        _replicas_allowed.reset(token)
+
+
+def use_replicas():
+    """Let catalog reads inside the block go to a replica."""
+    return _allow_replicas(True)
+
+
+def use_primary():
+    """Read everything from the primary inside the block."""
+    return _allow_replicas(False)
+
+
+def primary_only(view):
+    """Serve a view from the primary alone, e.g. one showing what the user
+    has just written."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with use_primary():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+def changed():
+    """Send reads to the primary for the next DATABASE_REPLICA_LAG seconds,
+    in every process (see PrimaryReplicaMiddleware). Called whenever a
+    cache version is bumped, i.e. after every catalog or booking change."""
+    global _primary_until
+    if not settings.DATABASE_REPLICAS:
+        return
+    until = time.time() + settings.DATABASE_REPLICA_LAG
+    _primary_until = max(_primary_until, until)
+    cache.set(PRIMARY_UNTIL_KEY, until, settings.DATABASE_REPLICA_LAG)
+
+
+def _sync_primary_window():
+    global _primary_until
+    _primary_until = max(_primary_until, cache.get(PRIMARY_UNTIL_KEY, 0))
+
+
+def reading_from_primary():
+    return (
+        not _replicas_allowed.get()
+        or time.time() < _primary_until
+        # A transaction must see its own writes, and one consistent state.
+        or connections[DEFAULT_DB_ALIAS].in_atomic_block
+    )
+
+
+class PrimaryReplicaRouter:
+    """Spread catalog reads over settings.DATABASE_REPLICAS; send every
+    other read, and all writes, to the primary.
+
+    Related objects are read from the database their instance came from,
+    so a booking's room and hotel come from the primary along with it.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if (
+            not settings.DATABASE_REPLICAS
+            or model._meta.label_lower not in REPLICA_MODELS
+            or reading_from_primary()
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema along with the data.
+        return db not in settings.DATABASE_REPLICAS
+
+
+class PrimaryReplicaMiddleware:
+    """Let requests that can't write (GET/HEAD/OPTIONS) read the catalog
+    from replicas, except shortly after a change made by any process, which
+    the replicas may not have yet."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        _sync_primary_window()
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return self.get_response(request)
+        with use_replicas():
+            return self.get_response(request)
@@ -0,0 +1,298 @@
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: only threads are kept apart then
+    fcntl = None
+
+from . import fulltext, metrics
+from .cache import LRUCache, get_catalog_version
+from .models import Hotel
+from .nlp import get_nlp
+from .vectorstore import get_store
+
+# Hotels scoring at or below this cosine similarity are not returned.
+SIMILARITY_THRESHOLD = 0.6
+
+# hotel_list compares lowercased text, get_suggestions compares the raw text.
+# The word vectors are case sensitive, so both variants are indexed.
+VARIANTS = ('lower', 'raw')
+
+
+def hotel_text(hotel, variant='raw'):
+    text = f"{hotel.name} {hotel.description} {hotel.location}"
+    return text.lower() if variant == 'lower' else text
+
+
+def query_text(query, variant='raw'):
+    return query.lower() if variant == 'lower' else query
+
+
+def embed(text):
+    """Return the document vector spaCy uses for ``Doc.similarity``.
+
+    Uses the shared memory-mapped word vectors when they have been exported
+    (see ``export_word_vectors``) and the full spaCy pipeline otherwise.
+    """
+    store = get_store()
+    if store is not None:
+        return store.doc_vector(text)
+    return np.asarray(get_nlp()(text).vector, dtype=np.float32)
+
+
+# Level 1: query text -> vector. Vectors don't depend on the catalog, so
+# entries are only ever evicted, never invalidated.
+query_vectors = LRUCache(settings.SEARCH_QUERY_CACHE_SIZE, name='search_query_vector')
+
+
+def embed_query(query, variant='raw'):
+    text = query_text(query, variant)
+    vector = query_vectors.get(text)
+    if vector is None:
+        vector = embed(text)
+        query_vectors.set(text, vector)
+    return vector
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Zero vectors stay zero so they score 0.0, exactly like Doc.similarity.
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+class HotelVectorIndex:
+    """Unit-normalized hotel document vectors kept in one contiguous matrix
+    per variant, persisted to ``settings.HOTEL_INDEX_PATH``.
+
+    Rows are ordered by hotel id, which is the order ``Hotel.objects.all()``
+    yields on SQLite, so ties rank the same way the per-hotel loop did.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._mtime = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = {variant: np.empty((0, 0), dtype=np.float32) for variant in VARIANTS}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _load(self):
+        with np.load(self.path) as data:
+            self.ids = data['ids']
+            self.vectors = {variant: np.ascontiguousarray(data[variant]) for variant in VARIANTS}
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, ids=self.ids, **self.vectors)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Hold the index against other threads and, through an flock on
+        ``<path>.lock``, other processes, so a read-modify-write of the file
+        always starts from the latest copy. Reentrant."""
+        with self._lock:
+            if self._lock_file is not None or fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(f'{self.path}.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_file = lock_file
+                try:
+                    yield
+                finally:
+                    # Closing the file releases the flock.
+                    self._lock_file = None
+
+    def _refresh(self):
+        """Pick up an index written by another process, building it if missing."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self.rebuild()
+            return
+        if mtime != self._mtime:
+            self._load()
+
+    def rebuild(self, hotels=None):
+        if hotels is None:
+            hotels = Hotel.objects.only('id', 'name', 'description', 'location').order_by('id')
+        hotels = list(hotels)
+        ids = np.array([hotel.id for hotel in hotels], dtype=np.int64)
+        vectors = {
+            variant: _normalize(np.array(
+                [embed(hotel_text(hotel, variant)) for hotel in hotels],
+                dtype=np.float32,
+            )) if hotels else np.empty((0, 0), dtype=np.float32)
+            for variant in VARIANTS
+        }
+        with self._exclusive():
+            self.ids = ids
+            self.vectors = vectors
+            self._save()
+        return len(ids)
+
+    def update(self, hotel):
+        rows = {variant: _normalize(embed(hotel_text(hotel, variant))[np.newaxis, :]) for variant in VARIANTS}
+        with self._exclusive():
+            self._refresh()
+            pos = np.searchsorted(self.ids, hotel.id)
+            if pos < len(self.ids) and self.ids[pos] == hotel.id:
+                for variant in VARIANTS:
+                    self.vectors[variant][pos] = rows[variant][0]
+            else:
+                self.ids = np.insert(self.ids, pos, hotel.id)
+                for variant in VARIANTS:
+                    matrix = self.vectors[variant]
+                    if matrix.size == 0:
+                        matrix = matrix.reshape(0, rows[variant].shape[1])
+                    self.vectors[variant] = np.ascontiguousarray(np.insert(matrix, pos, rows[variant], axis=0))
+            self._save()
+
+    def remove(self, hotel_id):
+        with self._exclusive():
+            self._refresh()
+            pos = np.searchsorted(self.ids, hotel_id)
+            if pos < len(self.ids) and self.ids[pos] == hotel_id:
+                self.ids = np.delete(self.ids, pos)
+                for variant in VARIANTS:
+                    self.vectors[variant] = np.ascontiguousarray(np.delete(self.vectors[variant], pos, axis=0))
+                self._save()
+
+    def search(self, query, variant='raw', threshold=SIMILARITY_THRESHOLD, limit=None):
+        """Return ``(hotel_id, score)`` pairs scoring above ``threshold``,
+        best first, using one embedding and one matrix-vector product."""
+        query_vector = embed_query(query, variant)
+        norm = np.linalg.norm(query_vector)
+        with self._lock:
+            self._refresh()
+            ids, matrix = self.ids, self.vectors[variant]
+        if norm == 0 or not len(ids):
+            return []
+        scores = matrix @ (query_vector / norm)
+        candidates = np.flatnonzero(scores > threshold)
+        if limit is not None and limit < len(candidates):
+            top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+            candidates = np.sort(candidates[top])
+        # Stable sort on -score keeps id order between equal scores.
+        order = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+    def rerank(self, query, matches, variant='raw', weight=None, limit=None):
+        """Rank full-text ``matches``, ``(hotel_id, score)`` pairs, by
+        ``weight`` times their score relative to the best match plus the
+        rest times their similarity to ``query``. Only the matched rows are
+        scored; hotels missing from the index (not embedded yet) get a
+        similarity of 0.
+        """
+        weight = settings.SEARCH_LEXICAL_WEIGHT if weight is None else weight
+        query_vector = embed_query(query, variant)
+        norm = np.linalg.norm(query_vector)
+        with self._lock:
+            self._refresh()
+            ids, matrix = self.ids, self.vectors[variant]
+        hotel_ids = np.array([hotel_id for hotel_id, _ in matches], dtype=np.int64)
+        lexical = np.array([score for _, score in matches], dtype=np.float64)
+        best = lexical.max(initial=0.0)
+        lexical = lexical / best if best > 0 else np.ones(len(matches))
+        similarity = np.zeros(len(matches))
+        if norm > 0 and len(ids):
+            positions = np.minimum(np.searchsorted(ids, hotel_ids), len(ids) - 1)
+            found = ids[positions] == hotel_ids
+            similarity[found] = matrix[positions[found]] @ (query_vector / norm)
+        scores = weight * lexical + (1 - weight) * similarity
+        # Ties keep the full-text order.
+        order = np.argsort(-scores, kind='stable')[:limit]
+        return [(int(hotel_ids[i]), float(scores[i])) for i in order]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = HotelVectorIndex(settings.HOTEL_INDEX_PATH)
+    return _index
+
+
+def reset_index():
+    """Forget the loaded index so the next call reopens settings.HOTEL_INDEX_PATH."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def hybrid_search(query, variant='raw', limit=None):
+    """``(hotel_id, score)`` pairs for ``query``, best first.
+
+    The full-text index (booking.fulltext) finds up to
+    SEARCH_LEXICAL_CANDIDATES hotels sharing a word with the query, the
+    vector search as many scoring above SIMILARITY_THRESHOLD, and the union
+    is scored blending both. A hotel has to score what one sharing no word
+    with the query needs through similarity alone, so matching only a
+    common word ("hotel", "the") isn't enough. Queries with no full-text
+    match, e.g. "somewhere relaxing", or a database without a full-text
+    index, use the vector search alone.
+    """
+    index = get_index()
+    matches = fulltext.search(query, settings.SEARCH_LEXICAL_CANDIDATES)
+    if not matches:
+        return index.search(query, variant=variant, limit=limit)
+    matched = {hotel_id for hotel_id, _ in matches}
+    similar = index.search(query, variant=variant, limit=settings.SEARCH_LEXICAL_CANDIDATES)
+    candidates = matches + [(hotel_id, 0.0) for hotel_id, _ in similar if hotel_id not in matched]
+    floor = (1 - settings.SEARCH_LEXICAL_WEIGHT) * SIMILARITY_THRESHOLD
+    ranked = index.rerank(query, candidates, variant=variant)
+    return [(hotel_id, score) for hotel_id, score in ranked if score > floor][:limit]
+
+
+def results_cache_key(query, variant, limit):
+    digest = hashlib.sha1(query.encode()).hexdigest()
+    return f'search:{get_catalog_version()}:{variant}:{limit}:{digest}'
+
+
+def search_hotel_ids(query, variant='raw', limit=None):
+    """Ranked hotel ids for ``query``.
+
+    Level 2 of the search cache: results are stored in Django's cache under
+    the catalog version, which Hotel save/delete bumps, so a catalog change
+    can never serve stale rankings.
+    """
+    key = results_cache_key(query, variant, limit)
+    ranked = cache.get(key)
+    if ranked is None:
+        metrics.inc('search_results_cache_misses_total')
+        ranked = [hotel_id for hotel_id, _ in hybrid_search(query, variant=variant, limit=limit)]
+        cache.set(key, ranked, settings.SEARCH_RESULTS_CACHE_TIMEOUT)
+    else:
+        metrics.inc('search_results_cache_hits_total')
+    return ranked
+
+
+def search_hotels(query, variant='raw', limit=None):
+    """Return the hotels best matching ``query``, best first."""
+    ranked = search_hotel_ids(query, variant=variant, limit=limit)
+    hotels = Hotel.objects.in_bulk(ranked)
+    return [hotels[hotel_id] for hotel_id in ranked if hotel_id in hotels]
@@ -0,0 +1,182 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .auth import forget_user
+from .cache import CATALOG, HOTELS, ROOMS, TYPEAHEAD, bump_catalog_version, bump_version, hotel_scope
+from .models import Booking, Hotel, HotelAmenity, HotelSummary, Room
+from .images import schedule as schedule_image_variants
+from .search import get_index
+from .summaries import refresh as refresh_summaries, stale_scopes
+from .typeahead import loaded_typeahead
+
+
+@receiver(post_save, sender=Hotel)
+def index_hotel(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    def update():
+        get_index().update(instance)
+        bump_catalog_version()
+
+    transaction.on_commit(update, robust=True)
+
+
+# What the typeahead shows of a hotel; saves changing none of it leave the
+# index (and its version) alone.
+TYPEAHEAD_FIELDS = ('name', 'location', 'rating')
+
+
+@receiver(pre_save, sender=Hotel)
+def check_typeahead_fields(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not set(TYPEAHEAD_FIELDS) & set(update_fields):
+        instance._typeahead_changed = False
+        return
+    saved = Hotel.objects.filter(pk=instance.pk).values_list(*TYPEAHEAD_FIELDS).first()
+    current = tuple(Hotel._meta.get_field(field).to_python(getattr(instance, field)) for field in TYPEAHEAD_FIELDS)
+    instance._typeahead_changed = saved != current
+
+
+@receiver(post_save, sender=Hotel)
+def update_typeahead(sender, instance, created=False, raw=False, **kwargs):
+    if raw or not (created or getattr(instance, '_typeahead_changed', True)):
+        return
+
+    def update():
+        version = bump_version(TYPEAHEAD)
+        index = loaded_typeahead()
+        if index is not None:
+            index.update(instance, version)
+
+    transaction.on_commit(update, robust=True)
+
+
+@receiver(post_delete, sender=Hotel)
+def remove_from_typeahead(sender, instance, **kwargs):
+    hotel_id = instance.pk
+
+    def remove():
+        version = bump_version(TYPEAHEAD)
+        index = loaded_typeahead()
+        if index is not None:
+            index.remove(hotel_id, version)
+
+    transaction.on_commit(remove, robust=True)
+
+
+@receiver(post_save, sender=Hotel)
+def sync_amenities(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    names = set(HotelAmenity.normalize(instance.amenities))
+    existing = set() if created else set(instance.amenity_rows.values_list('name', flat=True))
+    if existing - names:
+        instance.amenity_rows.filter(name__in=existing - names).delete()
+    if names - existing:
+        HotelAmenity.objects.bulk_create([HotelAmenity(hotel=instance, name=name) for name in sorted(names - existing)])
+
+
+@receiver(post_save, sender=Hotel)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image or instance.image_variants.get('name') == instance.image.name:
+        return
+    hotel_id = instance.pk
+    transaction.on_commit(lambda: schedule_image_variants(hotel_id), robust=True)
+
+
+@receiver(post_delete, sender=Hotel)
+def unindex_hotel(sender, instance, **kwargs):
+    hotel_id = instance.pk
+
+    def remove():
+        get_index().remove(hotel_id)
+        bump_catalog_version()
+
+    transaction.on_commit(remove, robust=True)
+
+
+def bump_on_commit(*scopes):
+    def bump():
+        for scope in scopes:
+            bump_version(scope)
+
+    transaction.on_commit(bump, robust=True)
+
+
+@receiver(post_save, sender=Hotel)
+@receiver(post_delete, sender=Hotel)
+def hotel_pages_changed(sender, instance, raw=False, **kwargs):
+    # The room list shows hotel names.
+    if raw:
+        return
+    bump_on_commit(HOTELS, ROOMS, hotel_scope(instance.pk))
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def room_changed(sender, instance, raw=False, **kwargs):
+    # Room prices also feed the price facets, hence the catalog bump.
+    if raw:
+        return
+    bump_on_commit(CATALOG, ROOMS, hotel_scope(instance.hotel_id))
+
+
+def _hotel_of(booking):
+    if Booking.room.is_cached(booking):
+        return booking.room.hotel_id
+    return Room.objects.filter(pk=booking.room_id).values_list('hotel_id', flat=True).first()
+
+
+# Summaries are rewritten in the same transaction as the change, like the
+# amenity rows, so they never disagree with committed rooms and bookings.
+
+@receiver(post_save, sender=Hotel)
+def create_summary(sender, instance, created=False, raw=False, **kwargs):
+    # No rooms yet, so nothing to compute; hotel_pages_changed covers the
+    # hotel list.
+    if created and not raw:
+        HotelSummary.objects.create(hotel=instance, as_of=timezone.localdate())
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def summarize_rooms(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or isinstance(origin, Hotel):
+        return
+    bump_on_commit(*stale_scopes(refresh_summaries([instance.hotel_id])))
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def booking_changed(sender, instance, raw=False, origin=None, **kwargs):
+    # Of the pages, only the hotel page depends on bookings (date-filtered
+    # room lists); the hotel list does through the summary.
+    if raw or isinstance(origin, (Room, Hotel)):
+        # Deleted along with its room, whose post_delete covers both.
+        return
+    hotel_id = _hotel_of(instance)
+    if hotel_id is not None:
+        bump_on_commit(hotel_scope(hotel_id))
+        bump_on_commit(*stale_scopes(refresh_summaries([hotel_id])))
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    # Again once committed, in case another request cached the old row
+    # before then.
+    user_id = instance.pk
+    forget_user(user_id)
+    transaction.on_commit(lambda: forget_user(user_id), robust=True)
+
+
+@receiver(user_logged_out)
+def uncache_user(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
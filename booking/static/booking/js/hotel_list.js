@@ -0,0 +1,14 @@
+// Filters the hotel cards on this page as the visitor types.
+document.getElementById('searchInput').addEventListener('input', function() {
+    const filter = this.value.toLowerCase();
+    const hotelCards = document.querySelectorAll('#hotelContainer .hotel-card');
+    hotelCards.forEach(card => {
+        const name = card.querySelector('.hotel-link').textContent.toLowerCase();
+        const location = card.querySelector('.hotel-location').textContent.toLowerCase();
+        if (name.includes(filter) || location.includes(filter)) {
+            card.style.display = '';
+        } else {
+            card.style.display = 'none';
+        }
+    });
+});
@@ -0,0 +1,124 @@
+"""Upkeep of HotelSummary: each hotel's cheapest and dearest room, how many
+rooms it has, how many are free tonight and when the next one is.
+
+``refresh()`` recomputes a batch of hotels from their rooms and active
+bookings in three reads, and writes only the summaries that changed, so
+the same code serves one hotel after a booking (booking.signals) and the
+whole catalog in chunks (``manage.py repair_hotel_summaries``).
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .availability import ACTIVE_STATUSES
+from .cache import CATALOG, HOTELS, SUMMARIES
+from .models import Booking, Hotel, HotelSummary, Room
+
+FIELDS = ['min_price', 'max_price', 'room_count', 'available_rooms', 'next_free_date', 'as_of']
+
+# Hotels recomputed per transaction by repair().
+CHUNK_SIZE = 1000
+
+
+def next_free_night(stays, today):
+    """First night from ``today`` on that none of ``stays``, a room's
+    active (check_in, check_out) pairs sorted by check_in, covers."""
+    night = today
+    for check_in, check_out in stays:
+        if check_in > night:
+            break
+        night = max(night, check_out)
+    return night
+
+
+def summarize(hotel_id, rooms, stays, today):
+    """HotelSummary of one hotel from its (room_id, price) ``rooms`` and
+    the sorted stays of each room, by room id."""
+    prices = [price for room_id, price in rooms]
+    free_from = [next_free_night(stays.get(room_id, ()), today) for room_id, price in rooms]
+    return HotelSummary(
+        hotel_id=hotel_id,
+        min_price=min(prices, default=None),
+        max_price=max(prices, default=None),
+        room_count=len(rooms),
+        available_rooms=free_from.count(today),
+        next_free_date=min(free_from, default=None),
+        as_of=today,
+    )
+
+
+def refresh(hotel_ids, today=None):
+    """Recompute the summaries of the hotels ``hotel_ids``, which must
+    exist, as of ``today`` (default: the current date). Returns the names
+    of the fields that changed for any of them, plus ``'available'`` if
+    any hotel ran out of free rooms tonight or got one back.
+
+    Runs in the caller's transaction. Where the backend has row locks the
+    old summaries are locked first, so two bookings at one hotel can't
+    each write a summary missing the other.
+    """
+    hotel_ids = sorted(set(hotel_ids))
+    if not hotel_ids:
+        return set()
+    today = today or timezone.localdate()
+    # A range rather than IN (...), so chunks of any size stay two
+    # parameters; hotels in the range but not asked for are ignored.
+    first, last = hotel_ids[0], hotel_ids[-1]
+    with transaction.atomic(savepoint=False):
+        existing = HotelSummary.objects.filter(hotel__gte=first, hotel__lte=last)
+        if connection.features.has_select_for_update:
+            existing = existing.select_for_update()
+        existing = {row[0]: row[1:] for row in existing.values_list('hotel_id', *FIELDS)}
+
+        rooms = defaultdict(list)
+        for hotel_id, room_id, price in Room.objects.filter(hotel__gte=first, hotel__lte=last).values_list('hotel_id', 'id', 'price'):
+            rooms[hotel_id].append((room_id, price))
+        stays = defaultdict(list)
+        bookings = Booking.objects.filter(
+            room__hotel__gte=first, room__hotel__lte=last, status__in=ACTIVE_STATUSES, check_out__gt=today,
+        ).order_by('room_id', 'check_in').values_list('room_id', 'check_in', 'check_out')
+        for room_id, check_in, check_out in bookings:
+            stays[room_id].append((check_in, check_out))
+
+        changed = set()
+        summaries = []
+        for hotel_id in hotel_ids:
+            summary = summarize(hotel_id, rooms.get(hotel_id, []), stays, today)
+            old = existing.get(hotel_id)
+            new = tuple(getattr(summary, field) for field in FIELDS)
+            if old == new:
+                continue
+            changed.update(FIELDS if old is None else (field for field, a, b in zip(FIELDS, old, new) if a != b))
+            if old is None or bool(old[FIELDS.index('available_rooms')]) != bool(summary.available_rooms):
+                changed.add('available')
+            summaries.append(summary)
+        if summaries:
+            HotelSummary.objects.bulk_create(summaries, update_conflicts=True, unique_fields=['hotel'], update_fields=FIELDS)
+    return changed
+
+
+def stale_scopes(changed):
+    """Cache scopes (see booking.cache) showing the summary fields named
+    in ``changed``. The hotel list shows the cheapest room and filters on
+    having free rooms, and the facet index counts prices."""
+    scopes = [SUMMARIES] if changed else []
+    if {'min_price', 'available'} & changed:
+        scopes.append(HOTELS)
+    if 'min_price' in changed:
+        scopes.append(CATALOG)
+    return scopes
+
+
+def repair(chunk_size=None, today=None):
+    """Recompute every hotel's summary, e.g. nightly, when tonight's
+    availability moves on, or after bulk inserts that skipped the signals.
+    Returns the number of hotels and the names of the fields that changed.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    hotel_ids = list(Hotel.objects.order_by('id').values_list('id', flat=True))
+    changed = set()
+    for start in range(0, len(hotel_ids), chunk_size):
+        with transaction.atomic():
+            changed |= refresh(hotel_ids[start:start + chunk_size], today)
+    return len(hotel_ids), changed
@@ -0,0 +1,165 @@
+"""Deterministic synthetic catalog data for load testing (``seed_data --hotels``).
+
+Each kind of row draws from its own ``random.Random`` derived from the seed,
+always in the same order, so the same seed and counts produce the same rows
+whatever the chunk size. The caller asks for rows a chunk at a time, so
+memory stays bounded however big the catalog is.
+"""
+import datetime
+import random
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .models import Booking, Customer, Hotel, HotelAmenity, Room, UserActivity
+
+# (city, price level); earlier cities get more hotels (Zipf-like weights).
+CITIES = [
+    ('New York', 1.6), ('London', 1.5), ('Paris', 1.5), ('Tokyo', 1.4), ('Dubai', 1.4),
+    ('Barcelona', 1.2), ('Rome', 1.2), ('Miami', 1.3), ('Los Angeles', 1.4), ('Singapore', 1.4),
+    ('Bangkok', 0.7), ('Istanbul', 0.8), ('Amsterdam', 1.3), ('Berlin', 1.0), ('Prague', 0.8),
+    ('Vienna', 1.0), ('Lisbon', 0.9), ('Sydney', 1.3), ('Hong Kong', 1.4), ('Chicago', 1.2),
+    ('San Francisco', 1.5), ('Las Vegas', 1.0), ('Mumbai', 0.6), ('Delhi', 0.6), ('Goa', 0.5),
+    ('Bali', 0.6), ('Cancun', 0.9), ('Cape Town', 0.8), ('Rio de Janeiro', 0.8), ('Mexico City', 0.7),
+    ('Toronto', 1.1), ('Vancouver', 1.1), ('Seoul', 1.0), ('Kyoto', 1.2), ('Athens', 0.9),
+    ('Dublin', 1.2), ('Edinburgh', 1.1), ('Venice', 1.4), ('Florence', 1.2), ('Munich', 1.1),
+    ('Zurich', 1.6), ('Copenhagen', 1.3), ('Stockholm', 1.2), ('Oslo', 1.3), ('Marrakech', 0.6),
+    ('Cairo', 0.5), ('Hanoi', 0.5), ('Kuala Lumpur', 0.6), ('Denver', 1.0), ('Boston', 1.3),
+]
+CITY_WEIGHTS = [1 / (rank + 1) ** 0.8 for rank in range(len(CITIES))]
+
+PREFIXES = ['Grand', 'Royal', 'Sea View', 'Mountain', 'City', 'Palm', 'Golden', 'Blue Lagoon', 'Park',
+            'Harbor', 'Garden', 'Riverside', 'Sunset', 'Central', 'Old Town', 'Lakeside', 'Skyline', 'Coral']
+KINDS = [('Hotel', 1.0), ('Inn', 0.8), ('Resort', 1.3), ('Suites', 1.1), ('Lodge', 0.9),
+         ('Plaza', 1.2), ('Retreat', 1.2), ('Boutique Hotel', 1.1), ('Palace', 1.5), ('Hostel', 0.4)]
+ADJECTIVES = ['Charming', 'Modern', 'Luxurious', 'Cosy', 'Elegant', 'Family-friendly', 'Quiet', 'Stylish',
+              'Historic', 'Affordable']
+AMENITIES = ['wifi', 'parking', 'breakfast', 'pool', 'gym', 'spa', 'bar', 'restaurant', 'beach',
+             'airport shuttle', 'pets', 'sauna', 'room service', 'kids club', 'ski storage']
+AMENITY_ODDS = [0.95, 0.5, 0.55, 0.35, 0.4, 0.2, 0.45, 0.5, 0.12, 0.2, 0.15, 0.1, 0.3, 0.08, 0.05]
+ROOM_TYPES = [('Single', 0.7), ('Double', 1.0), ('Twin', 1.0), ('Deluxe', 1.5), ('Family', 1.6), ('Suite', 2.5)]
+FIRST_NAMES = ['Ada', 'Alan', 'Grace', 'Linus', 'Maya', 'Omar', 'Priya', 'Chen', 'Sofia', 'Lucas', 'Amara',
+               'Kenji', 'Elena', 'Mateo', 'Fatima', 'Noah', 'Zara', 'Ivan', 'Leila', 'Tom']
+LAST_NAMES = ['Lovelace', 'Turing', 'Hopper', 'Torvalds', 'Patel', 'Garcia', 'Kim', 'Nguyen', 'Silva',
+              'Muller', 'Rossi', 'Okafor', 'Tanaka', 'Novak', 'Haddad', 'Smith', 'Jensen', 'Cohen']
+
+BASE_PRICE = 90
+# Bookings fall within this many days either side of today.
+BOOKING_WINDOW_DAYS = 365
+
+
+def chunked(total, size):
+    """(start, stop) ranges covering ``range(total)`` in ``size`` steps."""
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+
+class SyntheticData:
+    STREAMS = ['hotels', 'rooms', 'customers', 'bookings', 'activities']
+
+    def __init__(self, seed=42, today=None):
+        self.rngs = {name: random.Random(f'{seed}:{name}') for name in self.STREAMS}
+        self.today = today or datetime.date.today()
+
+    def hotels(self, start, stop):
+        """Hotels number ``start`` to ``stop - 1``."""
+        rng = self.rngs['hotels']
+        hotels = []
+        for i in range(start, stop):
+            city, _ = rng.choices(CITIES, weights=CITY_WEIGHTS)[0]
+            kind, kind_level = rng.choice(KINDS)
+            amenities = [name for name, odds in zip(AMENITIES, AMENITY_ODDS) if rng.random() < odds]
+            rating = min(5.0, max(1.0, rng.gauss(3.2 + 0.6 * kind_level, 0.5)))
+            hotels.append(Hotel(
+                name=f'{rng.choice(PREFIXES)} {kind} {city} {i + 1}',
+                location=city,
+                rating=Decimal(f'{rating:.2f}'),
+                description=(
+                    f'{rng.choice(ADJECTIVES)} {kind.lower()} in {city}'
+                    + (f" with {', '.join(amenities[:3])}." if amenities else '.')
+                ),
+                amenities=amenities,
+            ))
+        return hotels
+
+    def amenities(self, hotels):
+        # bulk_create() skips the signal that keeps these in sync.
+        return [
+            HotelAmenity(hotel_id=hotel.pk, name=name) for hotel in hotels for name in HotelAmenity.normalize(hotel.amenities)
+        ]
+
+    def rooms(self, hotels, per_hotel):
+        rng = self.rngs['rooms']
+        levels = dict(CITIES)
+        rooms = []
+        for hotel in hotels:
+            base = BASE_PRICE * levels[hotel.location] * (0.6 + float(hotel.rating) / 5)
+            for _ in range(per_hotel):
+                room_type, factor = rng.choice(ROOM_TYPES)
+                price = base * factor * rng.uniform(0.85, 1.15)
+                rooms.append(Room(hotel_id=hotel.pk, room_type=room_type, price=Decimal(f'{price:.2f}')))
+        return rooms
+
+    def customers(self, start, stop):
+        rng = self.rngs['customers']
+        customers = []
+        for i in range(start, stop):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            customers.append(Customer(
+                name=f'{first} {last}',
+                email=customer_email(i),
+                phone=f'+1555{rng.randrange(10 ** 7):07d}',
+            ))
+        return customers
+
+    def bookings(self, rooms, counts, customer_ids):
+        """``counts[i]`` bookings for ``rooms[i]``, laid end to end with
+        random gaps so no two stays of a room overlap."""
+        rng = self.rngs['bookings']
+        first_day = self.today - datetime.timedelta(days=BOOKING_WINDOW_DAYS)
+        window = 2 * BOOKING_WINDOW_DAYS
+        bookings = []
+        for room, count in zip(rooms, counts):
+            if not count:
+                continue
+            # Leave room for `count` stays of up to a week plus gaps.
+            slack = max(window - 7 * count, count)
+            day = rng.randrange(max(slack // count, 1))
+            for _ in range(count):
+                nights = rng.randint(1, 7)
+                check_in = first_day + datetime.timedelta(days=day)
+                check_out = check_in + datetime.timedelta(days=nights)
+                bookings.append(Booking(
+                    customer_id=customer_ids[rng.randrange(len(customer_ids))],
+                    room_id=room.pk,
+                    check_in=check_in,
+                    check_out=check_out,
+                    status=self.status(check_in),
+                ))
+                day += nights + rng.randrange(max(2 * slack // count, 1))
+        return bookings
+
+    def status(self, check_in):
+        roll = self.rngs['bookings'].random()
+        if check_in < self.today:
+            return 'cancelled' if roll < 0.12 else 'confirmed'
+        return 'cancelled' if roll < 0.08 else 'pending' if roll < 0.3 else 'confirmed'
+
+    def activities(self, user_ids, count):
+        rng = self.rngs['activities']
+        now = timezone.now()
+        activities = []
+        for _ in range(count):
+            city, _ = rng.choices(CITIES, weights=CITY_WEIGHTS)[0]
+            activities.append(UserActivity(
+                user_id=user_ids[rng.randrange(len(user_ids))],
+                location=city if rng.random() < 0.8 else None,
+                min_rating=Decimal(rng.choice(['3.00', '3.50', '4.00', '4.50'])) if rng.random() < 0.4 else None,
+                max_price=Decimal(rng.choice([100, 150, 200, 300, 500])) if rng.random() < 0.6 else None,
+                timestamp=now - datetime.timedelta(seconds=rng.randrange(90 * 24 * 3600)),
+            ))
+        return activities
+
+
+def customer_email(i):
+    return f'guest{i + 1}@example.com'
@@ -0,0 +1,35 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from booking.images import THUMBNAIL, srcset, variant_name
+
+register = template.Library()
+
+
+@register.simple_tag
+def hotel_image(hotel, sizes='100vw', **attrs):
+    """``<picture>`` for ``hotel.image``: WebP variants via ``srcset`` with
+    the original as the fallback, or just the original until the
+    variants have been built."""
+    if not hotel.image:
+        return ''
+    img = format_html('<img src="{}"{}>', hotel.image.url, flatatt(attrs))
+    variants = srcset(hotel.image.name, hotel.image_variants)
+    if not variants:
+        return img
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">{}</picture>',
+        variants, sizes, img,
+    )
+
+
+@register.simple_tag
+def hotel_thumbnail_url(hotel):
+    """URL of the hotel's thumbnail, or the original image until it exists."""
+    if not hotel.image:
+        return ''
+    if hotel.image_variants.get('name') != hotel.image.name:
+        return hotel.image.url
+    return default_storage.url(variant_name(hotel.image.name, THUMBNAIL))
@@ -1,3 +1,2075 @@
-from django.test import TestCase
+import atexit
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import socketserver
+import tempfile
+import threading
+import time
+import zlib
+from decimal import Decimal
+from pathlib import Path
 
-# Create your tests here.
+import numpy as np
+import spacy
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import BadRequest
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+
+from .models import (
+    ArchivedBooking, Booking, Customer, Hotel, HotelAmenity, HotelSummary, OutgoingEmail, Recommendation,
+    RecommendationRun, Room, UserActivity,
+)
+from . import (
+    activity, assets, auth, availability, benchmarks, facets, fulltext, images, mailqueue, metrics, nlp, pagination,
+    recommendations, reservations, retention, routers, search, summaries, typeahead, vectorstore,
+)
+from .cache import (
+    HOTELS as HOTELS_SCOPE, TYPEAHEAD as TYPEAHEAD_SCOPE, LRUCache, bump_version, get_catalog_version, get_version,
+    get_versions, hotel_scope,
+)
+from .instrumentation import QueryBudgetAssertionsMixin, QueryPlanAssertionsMixin, collect
+
+# QueryInstrumentationMiddleware logs one line per request with DEBUG off.
+logging.getLogger('booking.perf').setLevel(logging.WARNING)
+
+# A flush thread would write through its own connection and block on the
+# test transaction, so views record activity in the foreground here.
+foreground_activity = override_settings(ACTIVITY_FLUSH_IN_BACKGROUND=False, ACTIVITY_SPOOL_PATH=None)
+
+
+HOTELS = [
+    ('Grand Plaza', 'New York', 'A luxurious hotel in the heart of New York.'),
+    ('Sea View Resort', 'Miami', 'Enjoy the beautiful sea view and sandy beaches.'),
+    ('Mountain Lodge', 'Denver', 'A cosy wooden lodge close to the ski slopes.'),
+    ('City Inn', 'Chicago', 'Affordable rooms near downtown offices and shopping.'),
+    ('Palm Spa Retreat', 'Los Angeles', 'Relaxing spa treatments, pool and sunny beach views.'),
+]
+
+QUERIES = ['beach', 'New York', 'spa and pool', 'luxury hotel', 'ski', 'cheap rooms downtown']
+
+
+def build_vectors_model(path, texts, dims=50):
+    """Write a small English pipeline with word vectors for every token in
+    ``texts`` (and its lowercase form), so the tests don't need
+    en_core_web_md installed. Words are grouped into a few topics so some
+    similarities clear the search threshold."""
+    model = spacy.blank('en')
+    rng = np.random.default_rng(42)
+    topics = rng.normal(size=(8, dims)).astype(np.float32)
+    words = sorted({form for text in texts for token in model(text) for form in (token.text, token.lower_)})
+    for word in words:
+        if word in ('the', 'and', '.'):
+            continue  # leave a few tokens without vectors, like real OOV words
+        topic = topics[zlib.crc32(word.lower().encode()) % len(topics)]
+        model.vocab.set_vector(word, topic + 0.3 * rng.normal(size=dims).astype(np.float32))
+    model.to_disk(path)
+
+
+class VectorsModelMixin:
+    @classmethod
+    def setUpClass(cls):
+        cls._model_dir = tempfile.TemporaryDirectory()
+        texts = [' '.join(hotel) for hotel in HOTELS] + QUERIES + [
+            'Beach House Malibu Right on the beach.',
+            'Desert Oasis Phoenix Quiet desert resort.',
+        ]
+        build_vectors_model(cls._model_dir.name, texts)
+        cls._model_settings = override_settings(
+            SPACY_MODEL=cls._model_dir.name,
+            HOTEL_INDEX_PATH=Path(cls._model_dir.name) / 'index' / 'hotels.npz',
+            WORD_VECTORS_DIR=Path(cls._model_dir.name) / 'vectors',
+        )
+        cls._model_settings.enable()
+        nlp.reset()
+        search.reset_index()
+        vectorstore.reset_store()
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        search.query_vectors.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._model_settings.disable()
+        nlp.reset()
+        search.reset_index()
+        vectorstore.reset_store()
+        cls._model_dir.cleanup()
+
+
+class HotelVectorIndexTests(VectorsModelMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name, location, description in HOTELS:
+            Hotel.objects.create(name=name, location=location, description=description)
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.index = search.HotelVectorIndex(Path(tmp.name) / 'hotels.npz')
+        self.index.rebuild()
+
+    def similarity_loop(self, query, variant):
+        """The per-hotel ``Doc.similarity`` loop the views used to run."""
+        model = nlp.get_nlp()
+        query_doc = model(search.query_text(query, variant))
+        scored = []
+        for hotel in Hotel.objects.all():
+            sim = query_doc.similarity(model(search.hotel_text(hotel, variant)))
+            if sim > search.SIMILARITY_THRESHOLD:
+                scored.append((sim, hotel.id))
+        scored.sort(reverse=True, key=lambda x: x[0])
+        return scored
+
+    def test_rankings_match_doc_similarity(self):
+        for variant in search.VARIANTS:
+            for query in QUERIES:
+                with self.subTest(variant=variant, query=query):
+                    expected = self.similarity_loop(query, variant)
+                    ranked = self.index.search(query, variant=variant)
+                    self.assertEqual([hotel_id for hotel_id, _ in ranked], [hotel_id for _, hotel_id in expected])
+                    for (_, score), (sim, _) in zip(ranked, expected):
+                        self.assertAlmostEqual(score, sim, places=5)
+
+    def test_update_and_remove(self):
+        hotel = Hotel.objects.create(name='Beach House', location='Malibu', description='Right on the beach.')
+        self.index.update(hotel)
+        self.assertIn(hotel.id, self.index.ids)
+        self.assertEqual(self.index.vectors['raw'].shape[0], len(self.index))
+
+        self.index.remove(hotel.id)
+        self.assertNotIn(hotel.id, self.index.ids)
+        self.assertEqual(self.index.vectors['lower'].shape[0], len(self.index))
+
+    def test_reloads_index_written_by_another_process(self):
+        other = search.HotelVectorIndex(self.index.path)
+        hotel = Hotel.objects.create(name='Desert Oasis', location='Phoenix', description='Quiet desert resort.')
+        other.update(hotel)
+        self.index._refresh()
+        self.assertIn(hotel.id, self.index.ids)
+
+    def test_concurrent_writers_keep_each_others_changes(self):
+        other = search.HotelVectorIndex(self.index.path)
+        first = Hotel.objects.create(name='Desert Oasis', location='Phoenix', description='Quiet desert resort.')
+        second = Hotel.objects.create(name='Beach House', location='Malibu', description='Right on the beach.')
+        with self.index._exclusive():
+            writer = threading.Thread(target=other.update, args=[second])
+            writer.start()
+            writer.join(0.3)
+            # Waits for the file, then applies its change to our copy.
+            self.assertTrue(writer.is_alive())
+            self.index.update(first)
+        writer.join()
+        self.index._refresh()
+        self.assertIn(first.id, self.index.ids)
+        self.assertIn(second.id, self.index.ids)
+
+
+class ModelProviderTests(VectorsModelMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        nlp.reset()
+
+    def test_not_loaded_until_search(self):
+        self.client.get('/hotels/')
+        self.assertFalse(nlp.is_loaded())
+        self.client.get('/hotels/', {'query': 'beach'})
+        self.assertTrue(nlp.is_loaded())
+
+    def test_concurrent_first_use_loads_once(self):
+        loaded = []
+        barrier = threading.Barrier(8)
+
+        def load():
+            barrier.wait()
+            loaded.append(nlp.get_nlp())
+
+        threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(model) for model in loaded}), 1)
+
+    def test_pipeline_components_excluded(self):
+        self.assertEqual(nlp.get_nlp().pipe_names, [])
+
+
+class WordVectorStoreTests(VectorsModelMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = Path(tmp.name) / 'vectors'
+        call_command('export_word_vectors', output=str(self.directory), stdout=open(os.devnull, 'w'))
+        self.store = vectorstore.WordVectorStore(self.directory)
+
+    def test_vectors_are_memory_mapped(self):
+        self.assertIsInstance(self.store.vectors, np.memmap)
+        self.assertIsInstance(self.store.keys, np.memmap)
+
+    def test_doc_vectors_match_spacy(self):
+        model = nlp.get_nlp()
+        texts = QUERIES + [' '.join(hotel) for hotel in HOTELS] + ['', 'zzz unknown words']
+        for variant in search.VARIANTS:
+            for text in texts:
+                text = search.query_text(text, variant)
+                with self.subTest(text=text):
+                    np.testing.assert_allclose(self.store.doc_vector(text), model(text).vector, atol=1e-6)
+
+    def test_search_uses_store_without_loading_pipeline(self):
+        for name, location, description in HOTELS:
+            Hotel.objects.create(name=name, location=location, description=description)
+        expected = search.get_index().search('cheap rooms downtown')
+        self.assertTrue(expected)
+        nlp.reset()
+        search.reset_index()
+        with override_settings(WORD_VECTORS_DIR=self.directory):
+            vectorstore.reset_store()
+            ranked = search.get_index().search('cheap rooms downtown')
+            vectorstore.reset_store()
+        self.assertFalse(nlp.is_loaded())
+        self.assertEqual([hotel_id for hotel_id, _ in ranked], [hotel_id for hotel_id, _ in expected])
+
+
+class SearchCacheTests(VectorsModelMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name, location, description in HOTELS:
+            Hotel.objects.create(name=name, location=location, description=description)
+
+    def test_lru_evicts_least_recently_used(self):
+        lru = LRUCache(2, name='test_lru')
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(len(lru), 2)
+
+    def test_repeated_query_hits_both_levels(self):
+        before = metrics.snapshot()
+        first = search.search_hotel_ids('cheap rooms downtown')
+        second = search.search_hotel_ids('cheap rooms downtown')
+        after = metrics.snapshot()
+
+        def delta(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        self.assertEqual(first, second)
+        self.assertEqual(delta('search_results_cache_misses_total'), 1)
+        self.assertEqual(delta('search_results_cache_hits_total'), 1)
+        self.assertEqual(delta('search_query_vector_cache_misses_total'), 1)
+
+    def test_hotel_change_bumps_catalog_version(self):
+        search.search_hotel_ids('beach', variant='lower')
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            hotel = Hotel.objects.create(name='Beach House', location='Malibu', description='Right on the beach.')
+        self.assertGreater(get_catalog_version(), version)
+        self.assertIn(hotel.id, search.get_index().ids)
+
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            hotel.delete()
+        self.assertGreater(get_catalog_version(), version)
+
+    def test_metrics_endpoint(self):
+        search.search_hotel_ids('beach')
+        response = self.client.get('/metrics/', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'search_results_cache_misses_total', response.content)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.9').status_code, 403)
+
+
+class HybridSearchTests(VectorsModelMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hotels = {
+            name: Hotel.objects.create(name=name, location=location, description=description, amenities=['wifi'])
+            for name, location, description in HOTELS
+        }
+
+    def matches(self, query):
+        return [hotel_id for hotel_id, _ in fulltext.search(query, 10)]
+
+    def test_index_follows_the_hotel_table(self):
+        plaza = self.hotels['Grand Plaza']
+        self.assertEqual(self.matches('plaza'), [plaza.id])
+        # Stemmed, and amenities are indexed.
+        self.assertEqual(self.matches('skiing'), [self.hotels['Mountain Lodge'].id])
+        self.assertEqual(len(self.matches('wifi')), len(HOTELS))
+        plaza.name = 'Grand Palace'
+        plaza.amenities = ['rooftop bar']
+        plaza.save()
+        self.assertEqual(self.matches('plaza'), [])
+        self.assertEqual(self.matches('rooftop'), [plaza.id])
+        # Triggers, not signals, so bulk writes are covered too.
+        Hotel.objects.bulk_create([Hotel(name='Harbour Hostel', location='Sydney', description='Bunk beds.')])
+        self.assertEqual(len(self.matches('hostel')), 1)
+        Hotel.objects.filter(name='Harbour Hostel').delete()
+        self.assertEqual(self.matches('hostel'), [])
+
+    def test_query_syntax_is_searched_as_words(self):
+        self.assertEqual(fulltext.terms('Spa" OR name:* -pool (NEAR'), ['spa', 'or', 'name', 'pool', 'near'])
+        # 'near' matches City Inn's description, below the spa and pool.
+        self.assertEqual(self.matches('Spa" OR name:* -pool (NEAR'),
+                         [self.hotels['Palm Spa Retreat'].id, self.hotels['City Inn'].id])
+        self.assertEqual(fulltext.search('"*:(', 10), [])
+
+    def test_exact_words_rank_first(self):
+        self.assertEqual(search.search_hotel_ids('Mountain Lodge')[0], self.hotels['Mountain Lodge'].id)
+        self.assertEqual(search.search_hotel_ids('chicago', variant='lower')[0], self.hotels['City Inn'].id)
+        ranked = search.hybrid_search('sandy beaches', variant='lower')
+        self.assertEqual({hotel_id for hotel_id, _ in ranked},
+                         {self.hotels['Sea View Resort'].id, self.hotels['Palm Spa Retreat'].id})
+        self.assertTrue(all(-1 <= score <= 1 for _, score in ranked))
+
+    def test_queries_without_a_text_match_use_the_vectors(self):
+        # 'quiet' is in no hotel's text, but near Mountain Lodge's words.
+        self.assertEqual(fulltext.search('quiet', 10), [])
+        expected = search.get_index().search('quiet', variant='lower')
+        self.assertEqual([hotel_id for hotel_id, _ in expected], [self.hotels['Mountain Lodge'].id])
+        self.assertEqual(search.hybrid_search('quiet', variant='lower'), expected)
+
+    def test_common_words_alone_are_not_enough(self):
+        # Sea View Resort and Mountain Lodge only share 'the'.
+        self.assertEqual(len(self.matches('the hotel')), 3)
+        self.assertEqual(search.search_hotel_ids('the hotel', variant='lower'), [self.hotels['Grand Plaza'].id])
+
+    def test_similar_hotels_join_the_text_matches(self):
+        # 'city' is only in City Inn's text, but near Mountain Lodge's words.
+        self.assertEqual(self.matches('city'), [self.hotels['City Inn'].id])
+        self.assertEqual(search.search_hotel_ids('city', variant='lower'),
+                         [self.hotels['City Inn'].id, self.hotels['Mountain Lodge'].id])
+
+    def test_hotels_not_embedded_yet_are_found(self):
+        hostel, = Hotel.objects.bulk_create([Hotel(name='Harbour Hostel', location='Sydney', description='Bunk beds.')])
+        self.assertNotIn(hostel.id, search.get_index().ids)
+        self.assertEqual(search.hybrid_search('harbour hostel'), [(hostel.id, settings.SEARCH_LEXICAL_WEIGHT)])
+
+
+class AvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hotel = Hotel.objects.create(name='Grand Plaza', location='New York', description='Luxury.')
+        cls.single = Room.objects.create(hotel=cls.hotel, room_type='Single', price=120)
+        cls.double = Room.objects.create(hotel=cls.hotel, room_type='Double', price=180)
+        cls.customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='123')
+        Booking.objects.create(customer=cls.customer, room=cls.single, status='confirmed',
+                               check_in=datetime.date(2030, 1, 10), check_out=datetime.date(2030, 1, 15))
+        Booking.objects.create(customer=cls.customer, room=cls.double, status='cancelled',
+                               check_in=datetime.date(2030, 1, 10), check_out=datetime.date(2030, 1, 15))
+
+    def setUp(self):
+        # Pages are cached against versions only bumped on commit.
+        cache.clear()
+
+    def free(self, check_in, check_out, hotel=None):
+        return set(availability.free_rooms(check_in, check_out, hotel=hotel).values_list('room_type', flat=True))
+
+    def test_overlapping_stay_is_not_free(self):
+        self.assertEqual(self.free(datetime.date(2030, 1, 12), datetime.date(2030, 1, 20)), {'Double'})
+        self.assertEqual(self.free(datetime.date(2030, 1, 5), datetime.date(2030, 1, 11), hotel=self.hotel), {'Double'})
+
+    def test_back_to_back_stays_are_free(self):
+        self.assertEqual(self.free(datetime.date(2030, 1, 15), datetime.date(2030, 1, 18)), {'Single', 'Double'})
+        self.assertEqual(self.free(datetime.date(2030, 1, 5), datetime.date(2030, 1, 10)), {'Single', 'Double'})
+
+    def test_parse_stay_rejects_bad_ranges(self):
+        with self.assertRaises(ValueError):
+            availability.parse_stay('2030-01-10', '2030-01-10')
+        with self.assertRaises(ValueError):
+            availability.parse_stay('tomorrow', '2030-01-10')
+
+    def test_calendar(self):
+        response = self.client.get(f'/hotel/{self.hotel.id}/availability/', {'start': '2030-01-08', 'end': '2030-01-12'})
+        self.assertEqual(response.status_code, 200)
+        calendar = response.json()
+        self.assertEqual(calendar['dates'], ['2030-01-08', '2030-01-09', '2030-01-10', '2030-01-11'])
+        self.assertEqual(calendar['free_rooms'], [2, 2, 1, 1])
+        self.assertEqual(calendar['rooms'][str(self.single.id)], [True, True, False, False])
+
+    def test_book_room_rejects_overlap_and_accepts_other_dates(self):
+        data = {'name': 'Bob', 'email': 'bob@example.com', 'phone': '456'}
+        response = self.client.post(f'/book/{self.single.id}/', {**data, 'check_in': '2030-01-14', 'check_out': '2030-01-16'})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(f'/book/{self.single.id}/', {**data, 'check_in': '2030-01-15', 'check_out': '2030-01-16'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.single.bookings.count(), 2)
+
+    def test_hotel_detail_filters_by_dates(self):
+        response = self.client.get(f'/hotel/{self.hotel.id}/', {'check_in': '2030-01-11', 'check_out': '2030-01-12'})
+        self.assertEqual([room.room_type for room in response.context['rooms']], ['Double'])
+        response = self.client.get(f'/hotel/{self.hotel.id}/')
+        self.assertEqual(len(response.context['rooms']), 2)
+
+
+class ReservationStressTests(VectorsModelMixin, TransactionTestCase):
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 25
+
+    def setUp(self):
+        hotel = Hotel.objects.create(name='Grand Plaza', location='New York', description='Luxury.')
+        self.rooms = [Room.objects.create(hotel=hotel, room_type=f'Room {i}', price=100) for i in range(3)]
+
+    def test_concurrent_bookings_never_overlap(self):
+        outcomes = {'booked': 0, 'conflict': 0}
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.THREADS)
+        start_date = datetime.date(2030, 1, 1)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            barrier.wait()
+            try:
+                for _ in range(self.ATTEMPTS_PER_THREAD):
+                    room = rng.choice(self.rooms)
+                    check_in = start_date + datetime.timedelta(days=rng.randrange(30))
+                    check_out = check_in + datetime.timedelta(days=rng.randint(1, 4))
+                    try:
+                        reservations.reserve_room(room.id, check_in, check_out, name='Guest',
+                                                  email=f'guest{seed}@example.com', phone='1')
+                        outcome = 'booked'
+                    except reservations.BookingConflict:
+                        outcome = 'conflict'
+                    with lock:
+                        outcomes[outcome] += 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.THREADS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sum(outcomes.values()), self.THREADS * self.ATTEMPTS_PER_THREAD)
+        self.assertEqual(Booking.objects.count(), outcomes['booked'])
+        self.assertGreater(outcomes['conflict'], 0)
+        for room in self.rooms:
+            stays = sorted(room.bookings.values_list('check_in', 'check_out'))
+            for (_, previous_out), (next_in, _) in zip(stays, stays[1:]):
+                self.assertLessEqual(previous_out, next_in, f'double booking in {room}')
+        logging.getLogger(__name__).info(
+            '%d threads: %d booked, %d conflicts, %.0f reservations/s',
+            self.THREADS, outcomes['booked'], outcomes['conflict'], sum(outcomes.values()) / elapsed,
+        )
+
+
+@override_settings(PAGE_SIZE=3)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        hotel = Hotel.objects.create(name='Grand Plaza', location='New York', description='Luxury.')
+        cls.rooms = [Room.objects.create(hotel=hotel, room_type=f'Room {i}', price=100 + i) for i in range(8)]
+        customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='1')
+        # Several bookings share a check-in date to exercise the id tie-breaker.
+        for i, room in enumerate(cls.rooms):
+            Booking.objects.create(customer=customer, room=room, status='confirmed',
+                                   check_in=datetime.date(2030, 1, 1 + i // 3), check_out=datetime.date(2030, 2, 1))
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'pw')
+
+    def setUp(self):
+        # Pages are cached against versions only bumped on commit.
+        cache.clear()
+
+    def walk(self, url, key):
+        pages, params = [], {}
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page']
+            pages.append([key(obj) for obj in page])
+            if not page.has_next:
+                return pages, page
+            params = {'cursor': page.next_cursor}
+
+    def test_walks_every_room_once_in_order(self):
+        pages, last = self.walk('/list_rooms/', lambda room: room.id)
+        self.assertEqual([len(p) for p in pages], [3, 3, 2])
+        self.assertEqual(sum(pages, []), [room.id for room in self.rooms])
+
+        response = self.client.get('/list_rooms/', {'cursor': last.previous_cursor})
+        self.assertEqual([room.id for room in response.context['page']], pages[1])
+
+    def test_multi_column_ordering(self):
+        self.client.force_login(self.user)
+        pages, _ = self.walk('/my_bookings/', lambda booking: (booking.check_in, booking.id))
+        flat = sum(pages, [])
+        self.assertEqual(len(flat), 8)
+        self.assertEqual(flat, sorted(flat, reverse=True))
+
+    def test_deep_pages_cost_the_same_queries(self):
+        first = self.client.get('/list_rooms/')
+        with self.assertNumQueries(1):
+            self.client.get('/list_rooms/', {'cursor': first.context['page'].next_cursor})
+
+    def test_page_size_is_clamped_and_bad_cursor_rejected(self):
+        response = self.client.get('/list_rooms/', {'page_size': 1000})
+        self.assertEqual(len(response.context['page']), 8)
+        self.assertEqual(self.client.get('/list_rooms/', {'cursor': 'not-a-cursor'}).status_code, 400)
+
+    def test_malformed_cursor_values_are_rejected(self):
+        for url, params, values in [
+            ('/list_rooms/', {}, ['next', ['abc']]),
+            ('/list_rooms/', {}, ['next', [1, 2]]),
+            ('/hotels/', {}, ['next', [None]]),
+            ('/hotels/', {}, ['prev', [{}]]),
+            ('/hotels/', {'sort': 'price'}, ['next', ['x', 1]]),
+            ('/hotels/', {'sort': 'price'}, ['next', ['NaN', 1]]),
+            ('/hotels/search/', {}, ['next', ['x', 'y']]),
+            ('/my_bookings/', {}, ['next', ['2030-02-30', 1]]),
+        ]:
+            with self.subTest(url=url, cursor=values):
+                self.client.force_login(self.user)
+                cursor = pagination.encode_cursor(*values)
+                self.assertEqual(self.client.get(url, {**params, 'cursor': cursor}).status_code, 400)
+
+    def test_ranked_cursor_positions(self):
+        ranked = list(range(1, 11))
+
+        def page(*values):
+            request = RequestFactory().get('/', {'cursor': pagination.encode_cursor(*values), 'page_size': 3})
+            return list(pagination.paginate_ranked(request, ranked, lambda ids: {pk: pk for pk in ids}))
+
+        self.assertEqual(page('next', [3]), [4, 5, 6])
+        self.assertEqual(page('prev', [3]), [1, 2, 3])
+        for values in [['next', [-5]], ['prev', [-1]], ['next', ['x']]]:
+            with self.subTest(cursor=values), self.assertRaises(BadRequest):
+                page(*values)
+
+
+@foreground_activity
+class QueryBudgetTests(QueryBudgetAssertionsMixin, VectorsModelMixin, TestCase):
+    # add_room and add_customer render templates that don't exist yet.
+    NOT_EXERCISED = {'booking:add_room', 'booking:add_customer'}
+
+    def setUp(self):
+        super().setUp()
+        activity.reset_recorder()
+        self.addCleanup(activity.reset_recorder)
+        typeahead.reset_typeahead()
+        self.addCleanup(typeahead.reset_typeahead)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hotel = Hotel.objects.create(name='Grand Plaza', location='New York', description='Luxury hotel.')
+        cls.rooms = [Room.objects.create(hotel=cls.hotel, room_type=f'Room {i}', price=100 + i) for i in range(5)]
+        customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='1')
+        cls.bookings = [
+            Booking.objects.create(customer=customer, room=room, status='confirmed',
+                                   check_in=datetime.date(2030, 1, 1), check_out=datetime.date(2030, 1, 4))
+            for room in cls.rooms
+        ]
+        cls.staff = User.objects.create_user('staff', 'ada@example.com', 'pw', is_staff=True)
+
+    def requests(self):
+        hotel, room, booking = self.hotel, self.rooms[0], self.bookings[0]
+        stay = {'check_in': '2030-02-01', 'check_out': '2030-02-03'}
+        guest = {'name': 'Bob', 'email': 'bob@example.com', 'phone': '2'}
+        return [
+            # (url name, args, method, data, staff login)
+            ('welcome', [], 'get', {}, False),
+            ('hotel_list', [], 'get', {}, False),
+            ('hotel_list', [], 'get', {'query': 'luxury hotel'}, False),
+            ('hotel_list', [], 'get', {'sort': 'price', 'available': '1'}, False),
+            ('hotel_search', [], 'get', {'query': 'luxury hotel', 'max_price': '150', 'amenity': 'wifi'}, True),
+            ('hotel_search', [], 'get', {'sort': 'price', 'available': '1'}, False),
+            ('hotel_detail', [hotel.id], 'get', stay, False),
+            ('hotel_availability', [hotel.id], 'get', {'start': '2030-01-01', 'end': '2030-01-31'}, False),
+            ('book_room', [room.id], 'get', {}, False),
+            ('book_room', [room.id], 'post', {**guest, **stay}, False),
+            ('booking_confirmation', [booking.id], 'get', {}, False),
+            ('list_rooms', [], 'get', {}, False),
+            ('contact_us', [], 'get', {}, False),
+            ('recommend_hotels', [], 'get', {}, False),
+            ('get_suggestions', [], 'get', {'query': 'luxury hotel'}, False),
+            ('typeahead', [], 'get', {'query': 'gran'}, False),
+            ('metrics', [], 'get', {}, True),
+            ('management_view', [], 'get', {}, True),
+            ('my_bookings', [], 'get', {}, True),
+            ('add_hotel', [], 'get', {}, True),
+            ('add_hotel', [], 'post', {'name': 'New', 'location': 'Paris', 'description': 'x', 'rating': 4, 'amenities': '[]'}, True),
+            ('delete_booking', [self.bookings[1].id], 'post', {}, True),
+            ('api_hotels', [], 'get', {'fields': 'name,min_price', 'max_price': '150'}, False),
+            ('api_hotels', [], 'get', {'ids': f'{hotel.id}'}, False),
+            ('api_hotel', [hotel.id], 'get', {}, False),
+            ('api_rooms', [], 'get', {'hotel': hotel.id, 'fields': 'hotel_name,price'}, False),
+            ('api_room', [room.id], 'get', {}, False),
+            ('delete_hotel', [hotel.id], 'post', {}, True),
+        ]
+
+    def test_views_stay_within_query_budgets(self):
+        for name, args, method, data, staff in self.requests():
+            with self.subTest(view=name, method=method):
+                self.client.logout()
+                if staff:
+                    self.client.force_login(self.staff)
+                response = getattr(self.client, method)(reverse(f'booking:{name}', args=args), data)
+                self.assertLess(response.status_code, 400)
+                self.assertWithinQueryBudget(response)
+
+    def test_every_booking_url_has_a_budget(self):
+        names = {f'booking:{pattern.name}' for pattern in get_resolver('booking.urls').url_patterns}
+        self.assertEqual(names - set(settings.QUERY_BUDGETS), set())
+        exercised = {f'booking:{name}' for name, *_ in self.requests()}
+        self.assertEqual(names - exercised, self.NOT_EXERCISED)
+
+    def test_budget_failure_lists_queries(self):
+        with override_settings(QUERY_BUDGETS={**settings.QUERY_BUDGETS, 'booking:hotel_detail': 1}):
+            with self.assertLogs('booking.perf', 'WARNING'):
+                response = self.client.get(reverse('booking:hotel_detail', args=[self.hotel.id]))
+            with self.assertRaisesMessage(AssertionError, 'over its budget of 1'):
+                self.assertWithinQueryBudget(response)
+
+    @override_settings(DEBUG=True)
+    def test_debug_headers(self):
+        response = self.client.get(reverse('booking:list_rooms'))
+        self.assertEqual(response['X-Query-Count'], '1')
+        self.assertEqual(response['X-Query-Duplicates'], '0')
+        self.assertIn('X-Template-Time-Ms', response)
+
+    def test_production_log_line(self):
+        with self.assertLogs('booking.perf', 'INFO') as logs:
+            self.client.get(reverse('booking:list_rooms'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'booking:list_rooms')
+        self.assertEqual(record['queries'], 1)
+        self.assertGreater(record['template_ms'], 0)
+
+
+class QueryPlanTests(QueryPlanAssertionsMixin, TestCase):
+    """The hot lookups stay on indexes however large the tables grow."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hotel = Hotel.objects.create(name='Grand Plaza', location='New York', description='Luxury.', rating=4.5,
+                                         amenities=['Pool'])
+        cls.room = Room.objects.create(hotel=cls.hotel, room_type='Single', price=120)
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'pw')
+        cls.customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='1')
+        Booking.objects.create(customer=cls.customer, room=cls.room, status='confirmed',
+                               check_in=datetime.date(2030, 1, 10), check_out=datetime.date(2030, 1, 15))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unindexed_lookup_fails(self):
+        with self.assertRaisesMessage(AssertionError, 'Full scan of booking_customer'):
+            self.assertNoFullScans(Customer.objects.filter(phone='1'))
+        self.assertNoFullScans(Customer.objects.filter(phone='1'), allow=['booking_customer'])
+        with self.assertRaisesMessage(AssertionError, 'Full scan of booking_customer'):
+            with self.assertSelectsIndexed():
+                Customer.objects.filter(phone='1').exists()
+
+    def test_customer_lookups(self):
+        self.assertNoFullScans(
+            Customer.objects.filter(email='ada@example.com'),
+            Booking.objects.filter(customer__email='ada@example.com').order_by('-check_in', '-id'),
+            Booking.objects.filter(customer=self.customer),
+        )
+
+    def test_my_bookings(self):
+        self.client.force_login(self.user)
+        with self.assertSelectsIndexed():
+            response = self.client.get('/my_bookings/')
+        self.assertEqual(len(response.context['bookings']), 1)
+
+    def test_book_room(self):
+        data = {'name': 'Bob', 'email': 'bob@example.com', 'phone': '2', 'check_in': '2030-02-01', 'check_out': '2030-02-03'}
+        with self.assertSelectsIndexed():
+            response = self.client.post(f'/book/{self.room.id}/', data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_availability(self):
+        check_in, check_out = datetime.date(2030, 1, 12), datetime.date(2030, 1, 20)
+        with self.assertSelectsIndexed():
+            self.assertFalse(availability.is_room_free(self.room, check_in, check_out))
+            self.assertEqual(list(availability.free_rooms(check_in, check_out, hotel=self.hotel)), [])
+            availability.availability_calendar(self.hotel, check_in, check_out)
+
+    def test_recommendation_inputs(self):
+        hotels = recommendations.HotelFeatures()
+        with self.assertSelectsIndexed():
+            self.assertEqual(list(recommendations.recent_booking_counts()), [(self.hotel.id, 1)])
+            recommendations.UserProfiles([self.user.id], hotels)
+
+    def test_hotel_filters(self):
+        # An amenity alone matches a good share of the catalog; it is
+        # checked per hotel against HotelAmenity(name, hotel).
+        for params in ['location=New+York', 'min_rating=4', 'max_price=150', 'location=New+York&amenity=Pool']:
+            with self.subTest(params):
+                filters = facets.parse_filters(QueryDict(params))
+                self.assertNoFullScans(facets.filter_hotels(Hotel.objects.all(), filters))
+
+
+class FacetedSearchTests(VectorsModelMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def hotel(name, location, rating, amenities, prices):
+            created = Hotel.objects.create(name=name, location=location, description=name, rating=rating, amenities=amenities)
+            for price in prices:
+                Room.objects.create(hotel=created, room_type='Room', price=price)
+            return created
+
+        cls.plaza = hotel('Grand Plaza', 'New York', 4.5, ['wifi', 'Pool', 'gym'], [120, 180])
+        cls.inn = hotel('City Inn', 'New York', 3.0, ['wifi'], [80])
+        cls.resort = hotel('Sea View Resort', 'Miami', 4.0, ['wifi', 'beach', 'spa'], [250, 320])
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'pw')
+
+    def search(self, **params):
+        response = self.client.get('/hotels/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_amenities_are_mirrored_into_rows(self):
+        self.assertEqual(sorted(self.plaza.amenity_rows.values_list('name', flat=True)), ['gym', 'pool', 'wifi'])
+        self.plaza.amenities = ['wifi', 'spa']
+        self.plaza.save()
+        self.assertEqual(sorted(self.plaza.amenity_rows.values_list('name', flat=True)), ['spa', 'wifi'])
+        self.plaza.delete()
+        self.assertFalse(HotelAmenity.objects.filter(hotel_id=self.plaza.id).exists())
+
+    def test_unfiltered_facets(self):
+        data = self.search()
+        self.assertEqual([hotel['name'] for hotel in data['results']], ['Grand Plaza', 'Sea View Resort', 'City Inn'])
+        self.assertEqual(data['facets']['total'], 3)
+        self.assertEqual(data['facets']['location'], {'New York': 2, 'Miami': 1})
+        self.assertEqual(data['facets']['amenity']['wifi'], 3)
+        self.assertEqual(data['facets']['amenity']['pool'], 1)
+        self.assertEqual(data['facets']['price'], {'under_100': 1, '100_200': 1, '200_300': 1, '300_plus': 0})
+
+    def test_filters_combine(self):
+        data = self.search(location='New York', amenity='WiFi', max_price='100')
+        self.assertEqual([hotel['name'] for hotel in data['results']], ['City Inn'])
+        data = self.search(min_rating='4', amenity=['wifi', 'spa'])
+        self.assertEqual([hotel['name'] for hotel in data['results']], ['Sea View Resort'])
+        self.assertEqual(data['facets']['location'], {'Miami': 1})
+
+    def test_text_query_is_filtered(self):
+        ranked = search.search_hotel_ids('luxury hotel', variant='lower', limit=None)
+        data = self.search(query='luxury hotel', location='Miami')
+        expected = [hotel_id for hotel_id in ranked if hotel_id == self.resort.id]
+        self.assertEqual([hotel['id'] for hotel in data['results']], expected)
+
+    def test_room_changes_refresh_facets(self):
+        self.assertEqual(self.search()['facets']['price']['300_plus'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Room.objects.filter(hotel=self.inn).update(price=90)
+            Room.objects.create(hotel=self.inn, room_type='Suite', price=400)
+            Room.objects.get(hotel=self.resort, price=250).delete()
+        data = self.search()
+        self.assertEqual(data['facets']['price'], {'under_100': 1, '100_200': 1, '200_300': 0, '300_plus': 1})
+
+    def test_invalid_filter(self):
+        self.assertEqual(self.client.get('/hotels/search/', {'max_price': 'cheap'}).status_code, 400)
+        for params in [{'max_price': 'nan'}, {'min_rating': 'inf'}, {'max_price': '-Infinity'}]:
+            with self.subTest(params):
+                response = self.client.get('/hotels/search/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('must be a number', response.json()['error'])
+
+    def test_rows_of_hotels_outside_the_snapshot_are_skipped(self):
+        # Rows left behind by a hotel deleted under the ORM, as if they
+        # belonged to one created after the hotels were read.
+        gone = Hotel.objects.filter(pk=self.resort.pk)
+        gone._raw_delete(gone.db)
+        index = facets.FacetIndex(version=0)
+        self.assertEqual(list(index.ids), [self.plaza.id, self.inn.id])
+        self.assertEqual(list(index.min_prices), [120.0, 80.0])
+        self.assertEqual(list(index.amenities), ['gym', 'pool', 'wifi'])
+        counts = index.counts(facets.parse_filters(QueryDict()))
+        self.assertEqual(counts['amenity'], {'wifi': 2, 'gym': 1, 'pool': 1})
+        for model in (HotelAmenity, HotelSummary, Room):
+            orphans = model.objects.filter(hotel_id=self.resort.pk)
+            orphans._raw_delete(orphans.db)
+
+
+class HotelSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.localdate()
+        cls.plaza = Hotel.objects.create(name='Grand Plaza', location='New York', description='x', rating=4.5)
+        cls.inn = Hotel.objects.create(name='City Inn', location='New York', description='x', rating=3.0)
+        cls.empty = Hotel.objects.create(name='New Lodge', location='Denver', description='x', rating=5.0)
+        cls.single = Room.objects.create(hotel=cls.plaza, room_type='Single', price=120)
+        cls.suite = Room.objects.create(hotel=cls.plaza, room_type='Suite', price=300)
+        cls.cheap = Room.objects.create(hotel=cls.inn, room_type='Single', price=80)
+        cls.customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='1')
+
+    def summary(self, hotel):
+        row = HotelSummary.objects.get(hotel=hotel)
+        return row.min_price, row.max_price, row.room_count, row.available_rooms, row.next_free_date
+
+    def book(self, room, start, nights, status='confirmed'):
+        check_in = self.today + datetime.timedelta(days=start)
+        return Booking.objects.create(customer=self.customer, room=room, status=status, check_in=check_in,
+                                      check_out=check_in + datetime.timedelta(days=nights))
+
+    def day(self, offset):
+        return self.today + datetime.timedelta(days=offset)
+
+    def test_next_free_night(self):
+        day = self.day
+        self.assertEqual(summaries.next_free_night([], day(0)), day(0))
+        self.assertEqual(summaries.next_free_night([(day(-2), day(1)), (day(1), day(3)), (day(4), day(6))], day(0)), day(3))
+        self.assertEqual(summaries.next_free_night([(day(2), day(3))], day(0)), day(0))
+
+    def test_kept_up_to_date_by_room_and_booking_changes(self):
+        self.assertEqual(self.summary(self.empty), (None, None, 0, 0, None))
+        self.assertEqual(self.summary(self.plaza), (120, 300, 2, 2, self.today))
+        tonight = self.book(self.single, 0, 2)
+        self.book(self.suite, -1, 1)  # Already checked out.
+        self.assertEqual(self.summary(self.plaza), (120, 300, 2, 1, self.today))
+        self.book(self.suite, 0, 3)
+        self.book(self.suite, 3, 2)
+        self.assertEqual(self.summary(self.plaza)[3:], (0, self.day(2)))
+        tonight.status = 'cancelled'
+        tonight.save()
+        self.assertEqual(self.summary(self.plaza)[3:], (1, self.today))
+        self.single.delete()
+        self.assertEqual(self.summary(self.plaza), (300, 300, 1, 0, self.day(5)))
+        Room.objects.create(hotel=self.plaza, room_type='Double', price=200)
+        self.assertEqual(self.summary(self.plaza), (200, 300, 2, 1, self.today))
+        self.plaza.delete()
+        self.assertFalse(HotelSummary.objects.filter(hotel_id=self.plaza.id).exists())
+
+    def test_invalidates_what_shows_the_summary(self):
+        versions = lambda: get_versions(['summaries', 'hotels', 'catalog'])
+        before = versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(self.single, 0, 1)
+        after = versions()
+        # The suite is still free, so the hotel list and facets still hold.
+        self.assertNotEqual(after['summaries'], before['summaries'])
+        self.assertEqual([after['hotels'], after['catalog']], [before['hotels'], before['catalog']])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(self.cheap, 0, 1)
+        self.assertNotEqual(versions()['hotels'], after['hotels'])
+
+    def test_repair_command(self):
+        HotelSummary.objects.filter(hotel=self.plaza).update(min_price=1, available_rooms=0)
+        HotelSummary.objects.filter(hotel=self.inn).delete()
+        self.book(self.cheap, 1, 1)
+        out = io.StringIO()
+        call_command('repair_hotel_summaries', stdout=out, chunk_size=2)
+        self.assertIn('Summarized 3 hotels', out.getvalue())
+        self.assertEqual(self.summary(self.plaza), (120, 300, 2, 2, self.today))
+        self.assertEqual(self.summary(self.inn), (80, 80, 1, 1, self.today))
+        # Tomorrow the inn's only room is taken.
+        self.assertEqual(summaries.repair(today=self.day(1)), (3, {'as_of', 'available_rooms', 'next_free_date', 'available'}))
+        self.assertEqual(self.summary(self.inn)[3:], (0, self.day(2)))
+
+    def test_listings_sort_and_filter_on_the_summary(self):
+        self.book(self.cheap, 0, 1)
+        data = self.client.get('/hotels/search/', {'sort': 'price'}).json()
+        self.assertEqual([(hotel['name'], hotel['min_price']) for hotel in data['results']],
+                         [('City Inn', 80.0), ('Grand Plaza', 120.0)])
+        data = self.client.get('/hotels/search/', {'available': '1'}).json()
+        self.assertEqual([hotel['name'] for hotel in data['results']], ['Grand Plaza'])
+        self.assertEqual(data['facets']['total'], 1)
+        data = self.client.get('/hotels/search/', {'max_price': '100'}).json()
+        self.assertEqual([hotel['name'] for hotel in data['results']], ['City Inn'])
+
+        response = self.client.get('/hotels/', {'sort': 'price', 'page_size': 1})
+        self.assertEqual([hotel.name for hotel in response.context['hotels']], ['City Inn'])
+        self.assertContains(response, 'From $80.00 a night')
+        response = self.client.get('/hotels/?' + response.context['page'].next_query)
+        self.assertEqual([hotel.name for hotel in response.context['hotels']], ['Grand Plaza'])
+        self.assertFalse(response.context['page'].has_next)
+        response = self.client.get('/hotels/', {'available': '1'})
+        self.assertEqual([hotel.name for hotel in response.context['hotels']], ['Grand Plaza'])
+
+        data = json.loads(b''.join(self.client.get('/api/hotels/', {
+            'fields': 'min_price,max_price,available_rooms,next_free_date', 'ids': f'{self.inn.id}',
+        }).streaming_content))
+        self.assertEqual(data['results'], [{
+            'id': self.inn.id, 'min_price': 80.0, 'max_price': 80.0, 'available_rooms': 0,
+            'next_free_date': self.day(1).isoformat(),
+        }])
+
+
+@foreground_activity
+class ActivityRecorderTests(VectorsModelMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Hotel.objects.create(name='Sea View Resort', location='Miami', description='Beach resort.')
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'pw')
+
+    def setUp(self):
+        super().setUp()
+        activity.reset_recorder()
+        self.addCleanup(activity.reset_recorder)
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        self.spool_path = os.path.join(spool_dir.name, 'activity.spool')
+
+    def recorder(self, **kwargs):
+        options = {'max_buffer': 100, 'batch_size': 10, 'flush_interval': 60, 'spool_path': self.spool_path, 'background': False}
+        recorder = activity.ActivityRecorder(**{**options, **kwargs})
+        self.addCleanup(atexit.unregister, recorder.shutdown)
+        return recorder
+
+    def test_search_activity_is_buffered(self):
+        self.client.force_login(self.user)
+        self.client.get('/hotels/search/', {'location': 'Miami', 'max_price': '300'})
+        self.client.get('/hotels/search/', {'query': 'beach'})
+        self.assertFalse(UserActivity.objects.exists())
+        flushed = metrics.value('activity_events_flushed_total')
+        self.assertEqual(activity.get_recorder().flush(), 1)
+        self.assertEqual(metrics.value('activity_events_flushed_total'), flushed + 1)
+        row = UserActivity.objects.get()
+        self.assertEqual((row.user, row.location, row.max_price, row.min_rating), (self.user, 'Miami', 300, None))
+
+    def test_batch_size_triggers_flush(self):
+        recorder = self.recorder(batch_size=3)
+        for location in ('Miami', 'Denver'):
+            recorder.record(self.user, location=location)
+        self.assertFalse(UserActivity.objects.exists())
+        recorder.record(self.user, location='Chicago')
+        self.assertEqual(UserActivity.objects.count(), 3)
+        self.assertEqual(len(recorder), 0)
+
+    def test_full_buffer_drops_events(self):
+        recorder = self.recorder(max_buffer=2)
+        dropped = metrics.value('activity_events_dropped_total')
+        self.assertEqual([recorder.record(self.user) for _ in range(3)], [True, True, False])
+        self.assertEqual(metrics.value('activity_events_dropped_total'), dropped + 1)
+
+    def test_event_time_is_kept(self):
+        recorder = self.recorder()
+        searched_at = datetime.datetime(2030, 1, 1, 12, tzinfo=datetime.timezone.utc)
+        recorder.record(self.user, min_rating=Decimal('4.50'), timestamp=searched_at)
+        recorder.flush()
+        row = UserActivity.objects.get()
+        self.assertEqual((row.timestamp, row.min_rating), (searched_at, Decimal('4.50')))
+
+    def test_shutdown_flushes_buffer(self):
+        recorder = self.recorder()
+        recorder.record(self.user, location='Miami')
+        recorder.shutdown()
+        self.assertEqual(UserActivity.objects.count(), 1)
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    def test_rejected_events_are_dropped_alone(self):
+        recorder = self.recorder()
+        recorder.record(self.user, location='Miami')
+        recorder.record(self.user, location='Nowhere', max_price=Decimal('NaN'))
+        recorder.record(self.user, location='Denver')
+        dropped = metrics.value('activity_events_dropped_total')
+        with self.assertLogs('booking.activity', 'ERROR'):
+            self.assertEqual(recorder.flush(), 2)
+        self.assertEqual(metrics.value('activity_events_dropped_total'), dropped + 1)
+        self.assertEqual(sorted(UserActivity.objects.values_list('location', flat=True)), ['Denver', 'Miami'])
+        self.assertEqual(len(recorder), 0)
+
+    def test_spooled_events_are_replayed(self):
+        recorder = self.recorder()
+        recorder.record(self.user, location='Miami')
+        recorder.record(self.user, location='Denver')
+        self.assertEqual(recorder.spool(), 2)
+        self.assertFalse(UserActivity.objects.exists())
+
+        replacement = self.recorder()
+        replacement.record(self.user, location='Chicago')
+        self.assertFalse(os.path.exists(self.spool_path))
+        self.assertEqual(replacement.flush(), 3)
+        self.assertEqual(sorted(UserActivity.objects.values_list('location', flat=True)), ['Chicago', 'Denver', 'Miami'])
+
+
+class BackgroundActivityFlushTests(TransactionTestCase):
+    def test_flush_thread_writes_batches(self):
+        user = User.objects.create_user('ada', 'ada@example.com', 'pw')
+        recorder = activity.ActivityRecorder(max_buffer=1000, batch_size=50, flush_interval=0.05)
+        self.addCleanup(atexit.unregister, recorder.shutdown)
+        for i in range(120):
+            recorder.record(user, location=f'City {i}')
+        deadline = time.monotonic() + 10
+        while UserActivity.objects.count() < 120 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        recorder.shutdown()
+        self.assertEqual(UserActivity.objects.count(), 120)
+
+    def test_bad_events_do_not_stop_the_flush_thread(self):
+        user = User.objects.create_user('ada', 'ada@example.com', 'pw')
+        gone = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        recorder = activity.ActivityRecorder(max_buffer=1000, batch_size=5, flush_interval=0.05)
+        self.addCleanup(atexit.unregister, recorder.shutdown)
+        with self.assertLogs('booking.activity', 'ERROR'):
+            recorder.record(gone, location='Gone')
+            gone.delete()
+            recorder.record(user, location='Nowhere', max_price=Decimal('NaN'))
+            for i in range(10):
+                recorder.record(user, location=f'City {i}')
+            deadline = time.monotonic() + 10
+            while UserActivity.objects.count() < 10 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            recorder.shutdown()
+        self.assertEqual(UserActivity.objects.count(), 10)
+        self.assertEqual(len(recorder), 0)
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def hotel(name, location, rating, amenities, price):
+            created = Hotel.objects.create(name=name, location=location, description=name, rating=rating, amenities=amenities)
+            return created, Room.objects.create(hotel=created, room_type='Room', price=price)
+
+        cls.plaza, _ = hotel('Grand Plaza', 'New York', 4.5, ['wifi', 'pool'], 120)
+        cls.inn, _ = hotel('City Inn', 'New York', 3.0, ['wifi'], 80)
+        cls.resort, resort_room = hotel('Sea View Resort', 'Miami', 4.0, ['beach', 'spa'], 250)
+        cls.cove, _ = hotel('Coral Cove', 'Key West', 3.5, ['beach', 'spa'], 200)
+        cls.lodge, _ = hotel('Mountain Lodge', 'Denver', 4.8, ['ski'], 150)
+
+        cls.ada = User.objects.create_user('ada', 'ada@example.com', 'pw')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        UserActivity.objects.create(user=cls.ada, location='New York', max_price=100)
+        UserActivity.objects.create(user=cls.ada, location='New York')
+        soon = datetime.date.today() + datetime.timedelta(days=7)
+        for email in ('bob@example.com', 'eve@example.com'):
+            customer = Customer.objects.create(name=email, email=email, phone='1')
+            Booking.objects.create(customer=customer, room=resort_room, status='confirmed',
+                                   check_in=soon, check_out=soon + datetime.timedelta(days=2))
+
+    def setUp(self):
+        cache.clear()
+
+    def recommended(self, user=None):
+        if user is not None:
+            self.client.force_login(user)
+        data = self.client.get(reverse('booking:recommend_hotels')).json()
+        return data['source'], [hotel['name'] for hotel in data['recommendations']]
+
+    def test_anonymous_users_get_popular_hotels(self):
+        source, names = self.recommended()
+        self.assertEqual(source, 'popular')
+        self.assertEqual(names, ['Sea View Resort', 'Mountain Lodge', 'Grand Plaza', 'Coral Cove', 'City Inn'])
+
+    def test_recommendations_follow_searches_and_bookings(self):
+        run = recommendations.refresh()
+        self.assertEqual((run.full, run.users), (True, 2))
+        # Ada searches New York under 100; Bob booked a beach and spa resort.
+        self.assertEqual(self.recommended(self.ada)[1][:2], ['City Inn', 'Grand Plaza'])
+        self.assertEqual(self.recommended(self.bob)[1][:2], ['Sea View Resort', 'Coral Cove'])
+        self.assertEqual(self.recommended(self.carol)[0], 'popular')
+
+    def test_response_lists_hotel_details(self):
+        recommendations.refresh()
+        self.client.force_login(self.ada)
+        data = self.client.get(reverse('booking:recommend_hotels')).json()
+        self.assertEqual(data['recommendations'][0], {
+            'id': self.inn.id,
+            'name': 'City Inn',
+            'location': 'New York',
+            'price_range': '$80 - $80',
+            'rating': 3.0,
+            'amenities': ['wifi'],
+            'url': reverse('booking:hotel_detail', args=[self.inn.id]),
+        })
+
+    def test_refresh_is_incremental(self):
+        recommendations.refresh()
+        ada_updated = Recommendation.objects.get(user=self.ada).updated_at
+        UserActivity.objects.create(user=self.carol, location='Denver')
+        run = recommendations.refresh()
+        self.assertEqual((run.full, run.users), (False, 1))
+        source, names = self.recommended(self.carol)
+        self.assertEqual((source, names[0]), ('personal', 'Mountain Lodge'))
+        self.assertEqual(Recommendation.objects.get(user=self.ada).updated_at, ada_updated)
+
+        self.assertEqual(recommendations.refresh().users, 0)
+        self.assertEqual(recommendations.refresh(full=True).users, 3)
+        self.assertEqual(RecommendationRun.objects.count(), 4)
+
+    def test_deleted_hotels_are_skipped(self):
+        recommendations.refresh()
+        self.inn.delete()
+        self.assertNotIn('City Inn', self.recommended(self.ada)[1])
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plaza = Hotel.objects.create(name='Grand Plaza', location='New York', description='Luxury hotel.')
+        cls.inn = Hotel.objects.create(name='City Inn', location='Chicago', description='Budget rooms.')
+        cls.suite = Room.objects.create(hotel=cls.plaza, room_type='Suite', price=300)
+        Room.objects.create(hotel=cls.inn, room_type='Single', price=80)
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'pw')
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers=headers)
+
+    def assertCached(self, url):
+        response = self.get(url)
+        self.assertEqual(response.query_stats.query_count, 0, f'{url} was not served from the cache')
+        return response
+
+    def assertRendered(self, url):
+        response = self.get(url)
+        self.assertGreater(response.query_stats.query_count, 0, f'{url} was served from the cache')
+        return response
+
+    def test_anonymous_pages_are_cached(self):
+        for url in ('/hotels/', f'/hotel/{self.plaza.id}/', reverse('booking:list_rooms')):
+            with self.subTest(url=url):
+                first = self.assertRendered(url)
+                second = self.assertCached(url)
+                self.assertEqual(first.content, second.content)
+                self.assertEqual(first['ETag'], second['ETag'])
+                self.assertIn('Cookie', second['Vary'])
+
+    def test_conditional_get(self):
+        first = self.get('/hotels/')
+        self.assertEqual(self.get('/hotels/', if_none_match=first['ETag']).status_code, 304)
+        self.assertEqual(self.get('/hotels/', if_modified_since=first['Last-Modified']).status_code, 304)
+        self.assertEqual(self.get('/hotels/', if_none_match='"stale"').status_code, 200)
+
+    def test_query_strings_are_cached_separately(self):
+        self.assertRendered(f'/hotel/{self.plaza.id}/')
+        self.assertRendered(f'/hotel/{self.plaza.id}/?check_in=2030-01-01&check_out=2030-01-03')
+
+    def test_hotel_change_invalidates_its_pages_only(self):
+        for url in ('/hotels/', f'/hotel/{self.plaza.id}/', f'/hotel/{self.inn.id}/', reverse('booking:list_rooms')):
+            self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plaza.name = 'Grand Plaza Deluxe'
+            self.plaza.save()
+        self.assertContains(self.assertRendered('/hotels/'), 'Grand Plaza Deluxe')
+        self.assertContains(self.assertRendered(f'/hotel/{self.plaza.id}/'), 'Grand Plaza Deluxe')
+        self.assertContains(self.assertRendered(reverse('booking:list_rooms')), 'Grand Plaza Deluxe')
+        self.assertCached(f'/hotel/{self.inn.id}/')
+
+    def test_room_change_invalidates_room_pages(self):
+        for url in ('/hotels/', f'/hotel/{self.plaza.id}/', f'/hotel/{self.inn.id}/'):
+            self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Room.objects.create(hotel=self.plaza, room_type='Penthouse', price=900)
+        self.assertContains(self.assertRendered(f'/hotel/{self.plaza.id}/'), 'Penthouse')
+        self.assertCached(f'/hotel/{self.inn.id}/')
+        self.assertCached('/hotels/')
+
+    def test_booking_invalidates_hotel_page(self):
+        url = f'/hotel/{self.plaza.id}/?check_in=2030-01-01&check_out=2030-01-03'
+        self.assertContains(self.get(url), 'Suite')
+        self.get(f'/hotel/{self.inn.id}/')
+        customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='1')
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.create(customer=customer, room=self.suite, status='confirmed',
+                                   check_in=datetime.date(2030, 1, 2), check_out=datetime.date(2030, 1, 5))
+        self.assertNotContains(self.assertRendered(url), 'Suite')
+        self.assertCached(f'/hotel/{self.inn.id}/')
+
+    def test_logged_in_users_get_their_own_page(self):
+        self.get('/hotels/')
+        self.client.force_login(self.user)
+        response = self.get('/hotels/')
+        self.assertContains(response, 'Logout')
+        self.assertNotIn('ETag', response)
+        self.client.logout()
+        self.assertNotContains(self.assertCached('/hotels/'), 'Logout')
+
+    def test_logged_in_users_share_fragments(self):
+        self.client.force_login(self.user)
+        url = f'/hotel/{self.plaza.id}/'
+        first = self.get(url)
+        second = self.get(url)
+        # The rooms table comes from the fragment cache, and the user from
+        # the user cache, skipping their queries.
+        self.assertEqual(second.query_stats.query_count, first.query_stats.query_count - 2)
+        self.assertEqual(first.content, second.content)
+
+
+class AuthCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ada', 'ada@example.com', 'pw')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def auth_queries(self, response):
+        return [sql for sql, _ in response.query_stats.queries if 'django_session' in sql or 'auth_user' in sql]
+
+    def test_sessions_and_users_come_from_the_cache(self):
+        url = reverse('booking:my_bookings')
+        self.assertEqual(len(self.auth_queries(self.client.get(url))), 1)  # the user, once
+        self.assertEqual(self.auth_queries(self.client.get(url)), [])
+        # Written through to the database.
+        self.assertTrue(Session.objects.filter(session_key=self.client.session.session_key).exists())
+
+    def test_changes_to_the_user_are_seen(self):
+        url = reverse('booking:management_view')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_password_change_and_deletion_log_the_user_out(self):
+        url = reverse('booking:my_bookings')
+        self.client.get(url)
+        self.user.set_password('new')
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.user)
+        self.client.get(url)
+        self.user.delete()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_logout_forgets_the_user(self):
+        self.client.get(reverse('booking:my_bookings'))
+        self.assertIsNotNone(cache.get(auth.user_key(self.user.pk)))
+        self.client.logout()
+        self.assertIsNone(cache.get(auth.user_key(self.user.pk)))
+
+
+def jpeg_upload(name, size):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class StaticAssetTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        settings_override = override_settings(STATIC_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(self.root / 'staticfiles.json') as f:
+            self.css = json.load(f)['paths']['booking/css/booking.css']
+
+    def get(self, path, **headers):
+        return self.client.get(f'{settings.STATIC_URL}{path}', headers=headers)
+
+    def test_pages_link_hashed_files_without_inline_css(self):
+        self.assertRegex(self.css, r'^booking/css/booking\.[0-9a-f]{12}\.css$')
+        response = self.client.get(reverse('booking:welcome'))
+        self.assertContains(response, f'{settings.STATIC_URL}{self.css}')
+        self.assertNotContains(response, '<style>')
+        for template in Path(__file__).parent.glob('templates/**/*.html'):
+            with self.subTest(template=template.name):
+                self.assertNotIn('cdn.', template.read_text())
+
+    @override_settings(DEBUG=False)
+    def test_pages_render_from_the_manifest(self):
+        missing = assets.check_vendored_assets(None)
+        if missing:
+            self.skipTest(missing[0].msg)
+        hotel = Hotel.objects.create(name='Grand Plaza', location='New York', description='x', rating=4)
+        room = Room.objects.create(hotel=hotel, room_type='Single', price=100)
+        pages = [
+            reverse('booking:welcome'), reverse('booking:hotel_list'), reverse('booking:list_rooms'),
+            reverse('booking:hotel_detail', args=[hotel.id]), reverse('booking:book_room', args=[room.id]),
+        ]
+        for url in pages:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_compressed_variant_is_served_when_accepted(self):
+        original = (self.root / self.css).read_bytes()
+        self.assertEqual(gzip.decompress((self.root / f'{self.css}.gz').read_bytes()), original)
+
+        response = self.get(self.css, accept_encoding='br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), original)
+
+        plain = self.get(self.css)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(b''.join(plain.streaming_content), original)
+        self.assertEqual(self.get(self.css, if_none_match=plain['ETag']).status_code, 304)
+
+    def test_unhashed_names_are_revalidated(self):
+        response = self.get('booking/css/booking.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.get('../staticfiles.json').status_code, 404)
+        self.assertEqual(self.get('booking/css/missing.css').status_code, 404)
+
+
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hotels = [
+            Hotel.objects.create(name=f'Hotel {i}', location='Paris' if i % 2 else 'Rome', description='x',
+                                 rating=Decimal(i) / 2, amenities=['wifi'])
+            for i in range(1, 8)
+        ]
+        cls.rooms = [
+            Room.objects.create(hotel=hotel, room_type=kind, price=100 + i * 10 + j)
+            for i, hotel in enumerate(cls.hotels) for j, kind in enumerate(['Single', 'Double'])
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, name, *args, headers=None, **params):
+        response = self.client.get(reverse(f'booking:{name}', args=args), params, headers=headers or {})
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, json.loads(content) if content else None
+
+    def test_fields_select_only_requested_columns(self):
+        response, data = self.get('api_hotels', fields='name,min_price', page_size=2)
+        self.assertEqual(data['results'], [
+            {'id': self.hotels[0].id, 'name': 'Hotel 1', 'min_price': 100.0},
+            {'id': self.hotels[1].id, 'name': 'Hotel 2', 'min_price': 110.0},
+        ])
+        ((sql, params),) = response.query_stats.queries
+        self.assertNotIn('description', sql)
+
+    def test_unknown_field_is_rejected(self):
+        response, data = self.get('api_rooms', fields='price,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', data['error'])
+
+    def test_invalid_filter_is_rejected(self):
+        for params in [{'max_price': 'nan'}, {'min_rating': 'inf'}, {'max_price': 'cheap'}]:
+            with self.subTest(params):
+                response, data = self.get('api_hotels', **params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('must be a number', data['error'])
+
+    def test_malformed_cursor_is_rejected(self):
+        cursor = pagination.encode_cursor('next', ['x', 1])
+        response, data = self.get('api_hotels', ordering='-rating', cursor=cursor)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['error'], 'Invalid cursor.')
+
+    def test_pages_follow_the_cursor(self):
+        seen, cursor = [], None
+        while True:
+            params = {'ordering': '-rating', 'location': 'Paris', 'page_size': 2, 'fields': 'rating'}
+            if cursor:
+                params['cursor'] = cursor
+            response, data = self.get('api_hotels', **params)
+            seen += [row['rating'] for row in data['results']]
+            cursor = data['next']
+            if cursor is None:
+                break
+        self.assertEqual(seen, [3.5, 2.5, 1.5, 0.5])
+
+    def test_bulk_fetch_keeps_request_order(self):
+        ids = [self.rooms[5].id, self.rooms[0].id, 999999, self.rooms[3].id]
+        response, data = self.get('api_rooms', ids=','.join(map(str, ids)), fields='hotel_name,price')
+        self.assertEqual([row['id'] for row in data['results']], [ids[0], ids[1], ids[3]])
+        self.assertEqual(data['results'][0], {'id': ids[0], 'hotel_name': 'Hotel 3', 'price': 121.0})
+        self.assertEqual(data['missing'], [999999])
+        self.assertEqual(response.query_stats.query_count, 1)
+
+        response, _ = self.get('api_rooms', ids='1,x')
+        self.assertEqual(response.status_code, 400)
+        with override_settings(API_MAX_IDS=2):
+            response, _ = self.get('api_rooms', ids='1,2,3')
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail(self):
+        hotel = self.hotels[0]
+        _, data = self.get('api_hotel', hotel.id)
+        self.assertEqual(data, {
+            'id': hotel.id, 'name': 'Hotel 1', 'location': 'Paris', 'rating': 0.5, 'amenities': ['wifi'],
+            'image': None, 'url': reverse('booking:hotel_detail', args=[hotel.id]),
+        })
+        response, data = self.get('api_room', 999999)
+        self.assertEqual(response.status_code, 404)
+
+    def test_etag_revalidates_without_queries(self):
+        room = self.rooms[0]
+        first, _ = self.get('api_room', room.id)
+        second, body = self.get('api_room', room.id, headers={'if_none_match': first['ETag']})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.query_stats.query_count, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            room.price = 99
+            room.save()
+        third, data = self.get('api_room', room.id, headers={'if_none_match': first['ETag']})
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third['ETag'], first['ETag'])
+        self.assertEqual(data['price'], 99.0)
+
+    def test_detail_etag_changes_with_the_summary(self):
+        hotel = self.hotels[0]
+        first, data = self.get('api_hotel', hotel.id, fields='available_rooms')
+        self.assertEqual(data['available_rooms'], 2)
+        customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='1')
+        today = timezone.localdate()
+        # Bulk inserts skip the signals; the nightly repair catches up.
+        Booking.objects.bulk_create([Booking(customer=customer, room=self.rooms[0], check_in=today,
+                                             check_out=today + datetime.timedelta(days=1), status='confirmed')])
+        call_command('repair_hotel_summaries', stdout=io.StringIO())
+        response, data = self.get('api_hotel', hotel.id, fields='available_rooms',
+                                  headers={'if_none_match': first['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['available_rooms'], 1)
+
+    def test_list_etag_changes_with_the_catalog(self):
+        first, _ = self.get('api_hotels', fields='min_price')
+        self.assertEqual(self.get('api_hotels', fields='min_price', headers={'if_none_match': first['ETag']})[0].status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Room.objects.create(hotel=self.hotels[0], room_type='Cheap', price=10)
+        response, data = self.get('api_hotels', fields='min_price', headers={'if_none_match': first['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['results'][0]['min_price'], 10.0)
+
+
+@override_settings(TYPEAHEAD_REBUILD_IN_BACKGROUND=False)
+class TypeaheadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.plaza = Hotel.objects.create(name='Grand Plaza', location='New York', description='x', rating=4)
+        cls.palace = Hotel.objects.create(name='Grand Palace', location='Paris', description='x', rating=5)
+        cls.lodge = Hotel.objects.create(name='Granite Lodge', location='Zürich', description='x', rating=3)
+        cls.inn = Hotel.objects.create(name='City Inn', location='Paris', description='x', rating=2)
+
+    def setUp(self):
+        cache.clear()
+        typeahead.reset_typeahead()
+        self.addCleanup(typeahead.reset_typeahead)
+
+    def names(self, query, limit=8):
+        return [hotel['name'] for hotel in typeahead.suggest(query, limit)['hotels']]
+
+    def test_prefixes_rank_by_rating(self):
+        self.assertEqual(self.names('gra'), ['Grand Palace', 'Grand Plaza', 'Granite Lodge'])
+        self.assertEqual(self.names('grand p'), ['Grand Palace', 'Grand Plaza'])
+        self.assertEqual(self.names('g', limit=1), ['Grand Palace'])
+        self.assertEqual(self.names('inn paris'), ['City Inn'])
+        self.assertEqual(self.names('zz'), [])
+
+    def test_locations_ignore_case_and_accents(self):
+        self.assertEqual(typeahead.suggest('ZURI')['locations'], [{'name': 'Zürich'}])
+        self.assertEqual(self.names('zurich'), ['Granite Lodge'])
+
+    def test_typos(self):
+        self.assertEqual(self.names('grnad plaza'), ['Grand Plaza'])
+        self.assertEqual(self.names('plazza'), ['Grand Plaza'])
+        self.assertEqual(typeahead.suggest('prais')['locations'], [{'name': 'Paris'}])
+        self.assertEqual(typeahead.prefix_distance('lodeg', 'lodge', 1), 1)
+        self.assertEqual(typeahead.prefix_distance('lgoe', 'lodge', 1), 2)
+
+    def test_recent_bookings_rank_higher(self):
+        customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='1')
+        room = Room.objects.create(hotel=self.plaza, room_type='Single', price=100)
+        check_in = datetime.date.today()
+        Booking.objects.create(customer=customer, room=room, check_in=check_in,
+                               check_out=check_in + datetime.timedelta(days=2), status='confirmed')
+        self.assertEqual(self.names('grand'), ['Grand Plaza', 'Grand Palace'])
+
+    def test_hotel_changes_apply_without_a_rebuild(self):
+        index = typeahead.get_typeahead()
+        with self.captureOnCommitCallbacks(execute=True):
+            Hotel.objects.create(name='Harbour View', location='Oslo', description='x', rating=1)
+            self.plaza.name = 'Grand Central'
+            self.plaza.save()
+            self.inn.delete()
+        with self.assertNumQueries(0):
+            results = index.suggest('grand', 8)['hotels']
+            self.assertEqual([hotel['name'] for hotel in results], ['Grand Palace', 'Grand Central'])
+            self.assertEqual(index.suggest('harbor', 8)['hotels'][0]['name'], 'Harbour View')
+            self.assertEqual(index.suggest('osl', 8)['locations'], [{'name': 'Oslo'}])
+            self.assertEqual(index.suggest('city', 8)['hotels'], [])
+
+    def test_rebuilt_after_changes_elsewhere(self):
+        index = typeahead.get_typeahead()
+        self.assertIs(typeahead.get_typeahead(), index)
+        Hotel.objects.filter(pk=self.lodge.pk).update(name='Granite Chalet')
+        bump_version(TYPEAHEAD_SCOPE)
+        rebuilt = typeahead.get_typeahead()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(self.names('chalet'), ['Granite Chalet'])
+        self.assertGreater(metrics.value('typeahead_index_bytes'), 0)
+
+    def test_local_changes_keep_the_index_current(self):
+        index = typeahead.get_typeahead()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plaza.rating = 5
+            self.plaza.save()
+            self.inn.delete()
+        self.assertEqual(index.version, get_version(TYPEAHEAD_SCOPE))
+        self.assertIs(typeahead.get_typeahead(), index)
+
+    def test_unrelated_changes_keep_the_index(self):
+        index = typeahead.get_typeahead()
+        version = get_version(TYPEAHEAD_SCOPE)
+        customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='1')
+        today = datetime.date.today()
+        with self.captureOnCommitCallbacks(execute=True):
+            room = Room.objects.create(hotel=self.plaza, room_type='Single', price=100)
+            Booking.objects.create(customer=customer, room=room, check_in=today,
+                                   check_out=today + datetime.timedelta(days=1), status='confirmed')
+            self.palace.description = 'Refurbished.'
+            self.palace.save()
+            self.lodge.rating = 3.0
+            self.lodge.save()
+        self.assertEqual(get_version(TYPEAHEAD_SCOPE), version)
+        self.assertIs(typeahead.get_typeahead(), index)
+
+    def test_view(self):
+        response = self.client.get(reverse('booking:typeahead'), {'query': 'grand pa', 'limit': 1})
+        self.assertEqual(response.json(), {
+            'query': 'grand pa',
+            'locations': [],
+            'hotels': [{
+                'id': self.palace.id, 'name': 'Grand Palace', 'location': 'Paris', 'rating': 5.0,
+                'url': reverse('booking:hotel_detail', args=[self.palace.id]),
+            }],
+        })
+        response = self.client.get(reverse('booking:typeahead'), {'query': 'grand', 'limit': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+# Outside a transaction, so the router is free to pick a replica; none of
+# these tests query one.
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        routers._primary_until = 0.0
+        cache.delete(routers.PRIMARY_UNTIL_KEY)
+        self.router = routers.PrimaryReplicaRouter()
+
+    def read_db(self, model=Hotel):
+        return self.router.db_for_read(model)
+
+    def through_middleware(self, method):
+        request = getattr(RequestFactory(), method)('/')
+        return routers.PrimaryReplicaMiddleware(lambda request: self.read_db())(request)
+
+    def test_catalog_reads_use_replicas_only_where_allowed(self):
+        self.assertEqual(self.read_db(), 'default')
+        with routers.use_replicas():
+            self.assertEqual(self.read_db(), 'replica1')
+            self.assertEqual(self.read_db(HotelAmenity), 'replica1')
+            self.assertEqual(self.read_db(Booking), 'default')
+            self.assertEqual(self.read_db(Customer), 'default')
+            with routers.use_primary():
+                self.assertEqual(self.read_db(), 'default')
+        self.assertEqual(self.router.db_for_write(Hotel), 'default')
+
+    def test_related_objects_come_from_the_instance_database(self):
+        booking = Booking()
+        booking._state.db = 'default'
+        with routers.use_replicas():
+            self.assertEqual(self.router.db_for_read(Room, instance=booking), 'default')
+
+    def test_middleware_serves_only_safe_methods_from_replicas(self):
+        self.assertEqual(self.through_middleware('get'), 'replica1')
+        self.assertEqual(self.through_middleware('head'), 'replica1')
+        self.assertEqual(self.through_middleware('post'), 'default')
+
+    def test_reads_stay_on_the_primary_while_replicas_catch_up(self):
+        bump_version(HOTELS_SCOPE)
+        self.assertEqual(self.through_middleware('get'), 'default')
+        # Another process learns of the change through the cache.
+        routers._primary_until = 0.0
+        self.assertEqual(self.through_middleware('get'), 'default')
+        cache.delete(routers.PRIMARY_UNTIL_KEY)
+        routers._primary_until = time.time() - 1
+        self.assertEqual(self.through_middleware('get'), 'replica1')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'booking'))
+        self.assertTrue(self.router.allow_migrate('default', 'booking'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        with routers.use_replicas():
+            self.assertEqual(self.read_db(), 'default')
+        bump_version(HOTELS_SCOPE)
+        self.assertIsNone(cache.get(routers.PRIMARY_UNTIL_KEY))
+        with self.assertRaisesMessage(CommandError, 'No replicas configured'):
+            call_command('sync_replicas', stdout=io.StringIO())
+
+
+class ImageVariantTestMixin:
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def create_hotel(self, size=(2000, 1000)):
+        return Hotel.objects.create(name='Grand Plaza', location='New York', description='Luxury.',
+                                    image=jpeg_upload('plaza.jpg', size))
+
+
+@override_settings(IMAGE_VARIANTS_IN_BACKGROUND=False)
+class ImageVariantTests(ImageVariantTestMixin, TestCase):
+    def test_variants_are_built_after_save(self):
+        from PIL import Image
+
+        with self.captureOnCommitCallbacks(execute=True):
+            hotel = self.create_hotel()
+        hotel.refresh_from_db()
+        self.assertEqual(hotel.image_variants, {'name': hotel.image.name, 'widths': [320, 640, 1024, 1600]})
+        with default_storage.open(images.variant_name(hotel.image.name, '640w')) as f:
+            variant = Image.open(f)
+            self.assertEqual((variant.format, variant.size), ('WEBP', (640, 320)))
+        with default_storage.open(images.variant_name(hotel.image.name, images.THUMBNAIL)) as f:
+            self.assertEqual(Image.open(f).size, (160, 120))
+
+    def test_small_images_are_not_upscaled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            hotel = self.create_hotel(size=(300, 200))
+        hotel.refresh_from_db()
+        self.assertEqual(hotel.image_variants['widths'], [300])
+
+    def test_pages_fall_back_to_the_original(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            hotel = self.create_hotel()
+        response = self.client.get(f'/hotel/{hotel.id}/')
+        self.assertContains(response, f'src="{hotel.image.url}"')
+        self.assertNotContains(response, 'srcset')
+
+        self.assertTrue(images.generate_variants(hotel.id))
+        for url in (f'/hotel/{hotel.id}/', '/hotels/'):
+            response = self.client.get(url)
+            self.assertContains(response, '<source type="image/webp"')
+            self.assertContains(response, images.variant_name(hotel.image.name, '320w') + ' 320w')
+            self.assertContains(response, f'src="{hotel.image.url}"')
+
+    def test_replaced_image_waits_for_new_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            hotel = self.create_hotel()
+        hotel.refresh_from_db()
+        hotel.image = jpeg_upload('plaza-new.jpg', (800, 600))
+        with self.captureOnCommitCallbacks(execute=False):
+            hotel.save()
+        self.assertEqual(images.srcset(hotel.image.name, hotel.image_variants), '')
+        self.assertTrue(images.generate_variants(hotel.id))
+        hotel.refresh_from_db()
+        self.assertEqual(hotel.image_variants, {'name': hotel.image.name, 'widths': [320, 640]})
+
+    def test_backfill_command(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            hotel = self.create_hotel()
+            Hotel.objects.create(name='No Image', location='Nowhere', description='')
+        out = io.StringIO()
+        call_command('build_image_variants', stdout=out)
+        self.assertIn('ready for 1 hotels', out.getvalue())
+        hotel.refresh_from_db()
+        self.assertEqual(hotel.image_variants['widths'], [320, 640, 1024, 1600])
+
+    def test_unreadable_image_is_reported(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            hotel = Hotel.objects.create(name='Broken', location='Nowhere', description='',
+                                         image=SimpleUploadedFile('broken.jpg', b'not an image'))
+        errors = metrics.value('image_variant_errors_total')
+        with self.assertLogs('booking.images', 'ERROR'):
+            self.assertFalse(images.generate_variants(hotel.id))
+        self.assertEqual(metrics.value('image_variant_errors_total'), errors + 1)
+
+
+class BackgroundImageVariantTests(ImageVariantTestMixin, TransactionTestCase):
+    def test_worker_builds_variants(self):
+        with override_settings(IMAGE_VARIANTS_IN_BACKGROUND=True):
+            hotel = self.create_hotel(size=(700, 400))
+            images.schedule(hotel.id).result(timeout=30)
+        hotel.refresh_from_db()
+        self.assertEqual(hotel.image_variants['widths'], [320, 640])
+
+
+class RetentionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        cls.hotel = Hotel.objects.create(name='Grand Plaza', location='New York', description='Luxury.', amenities=['Pool'])
+        cls.other = Hotel.objects.create(name='City Inn', location='Chicago', description='Central.')
+        cls.rooms = [Room.objects.create(hotel=cls.hotel, room_type=f'Room {i}', price=100) for i in range(3)]
+        cls.other_room = Room.objects.create(hotel=cls.other, room_type='Single', price=80)
+        cls.customer = Customer.objects.create(name='Ada', email='ada@example.com', phone='1')
+
+        def stay(room, ended_days_ago, status='confirmed'):
+            check_out = today - datetime.timedelta(days=ended_days_ago)
+            return Booking.objects.create(customer=cls.customer, room=room, status=status,
+                                          check_in=check_out - datetime.timedelta(days=2), check_out=check_out)
+
+        cls.old = [stay(cls.rooms[0], 400), stay(cls.rooms[1], 500, 'cancelled'), stay(cls.other_room, 800)]
+        cls.recent = [stay(cls.rooms[0], 10), stay(cls.rooms[2], -5, 'pending'), stay(cls.other_room, -20)]
+
+    def test_archive_moves_ended_stays(self):
+        progress = []
+        archived = retention.archive_bookings(days=365, batch_size=2, pause=0, progress=progress.append)
+        self.assertEqual(archived, 3)
+        self.assertEqual(progress, [2, 3])
+        self.assertEqual(set(Booking.objects.values_list('id', flat=True)), {booking.id for booking in self.recent})
+        cancelled = ArchivedBooking.objects.get(pk=self.old[1].pk)
+        self.assertEqual((cancelled.customer, cancelled.room_id, cancelled.hotel_id, cancelled.status),
+                         (self.customer, self.rooms[1].id, self.hotel.id, 'cancelled'))
+        self.assertEqual(cancelled.check_out, self.old[1].check_out)
+        # Nothing left to do the second time.
+        self.assertEqual(retention.archive_bookings(days=365, pause=0), 0)
+
+    def test_archive_only_takes_ended_stays(self):
+        with self.assertRaises(ValueError):
+            retention.archive_bookings(days=-1)
+        retention.archive_bookings(days=0, pause=0)
+        self.assertEqual(list(Booking.objects.filter(check_out__lt=timezone.localdate())), [])
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_purge_hotel(self):
+        retention.archive_bookings(days=365, pause=0)
+        hotel_id = self.hotel.pk
+        versions = get_versions([HOTELS_SCOPE, hotel_scope(hotel_id)])
+        progress = []
+        with self.captureOnCommitCallbacks(execute=True), collect() as stats:
+            deleted = retention.purge_hotel(self.hotel, batch_size=2, pause=0,
+                                            progress=lambda label, done: progress.append((label, done)))
+        self.assertEqual(deleted, (2, 3))
+        # Chunks are deleted by id list, not a LIMIT subquery (which MySQL rejects).
+        deletes = [sql for sql, _ in stats.queries if sql.startswith('DELETE')]
+        self.assertTrue(deletes)
+        self.assertFalse([sql for sql in deletes if 'LIMIT' in sql])
+        self.assertEqual(progress, [('bookings', 2), ('rooms', 2), ('rooms', 3)])
+        self.assertFalse(Hotel.objects.filter(pk=hotel_id).exists())
+        self.assertFalse(Room.objects.filter(hotel_id=hotel_id).exists())
+        self.assertFalse(HotelAmenity.objects.filter(hotel_id=hotel_id).exists())
+        self.assertFalse(HotelSummary.objects.filter(hotel_id=hotel_id).exists())
+        # Other hotels and the archive are left alone.
+        self.assertEqual(list(Booking.objects.values_list('room', flat=True)), [self.other_room.id])
+        self.assertEqual(ArchivedBooking.objects.filter(hotel_id=hotel_id).count(), 2)
+        self.assertNotEqual(get_versions([HOTELS_SCOPE, hotel_scope(hotel_id)]), versions)
+
+    def test_commands(self):
+        out = io.StringIO()
+        call_command('archive_bookings', days=365, pause=0, stdout=out)
+        self.assertIn('3 bookings archived', out.getvalue())
+        self.assertIn('Archived 3 bookings that ended over 365 days ago', out.getvalue())
+
+        out = io.StringIO()
+        hotel_id = self.other.pk
+        call_command('purge_hotels', hotel_id, 999999, batch_size=1, pause=0, stdout=out)
+        self.assertIn('No hotel 999999.', out.getvalue())
+        self.assertIn(f'Purged hotel {hotel_id}: 1 rooms and 1 bookings', out.getvalue())
+        self.assertFalse(Hotel.objects.filter(pk=hotel_id).exists())
+
+
+class SeedDataScaleTests(TestCase):
+    options = dict(hotels=6, rooms_per_hotel=3, bookings=40, customers=8, users=3, activities=12, seed=7, chunk_size=4)
+
+    def seed(self, **options):
+        call_command('seed_data', stdout=io.StringIO(), **{**self.options, **options})
+
+    def snapshot(self):
+        return (
+            list(Hotel.objects.order_by('id').values_list('name', 'location', 'rating', 'amenities')),
+            list(Room.objects.order_by('id').values_list('hotel__name', 'room_type', 'price')),
+            list(Booking.objects.order_by('id').values_list('customer__email', 'room__hotel__name', 'check_in', 'check_out', 'status')),
+            list(UserActivity.objects.order_by('id').values_list('user__username', 'location', 'max_price')),
+        )
+
+    def test_generates_every_model(self):
+        self.seed()
+        self.assertEqual(Hotel.objects.count(), 6)
+        self.assertEqual(Room.objects.count(), 18)
+        self.assertEqual(Booking.objects.count(), 40)
+        self.assertEqual(Customer.objects.count(), 8)
+        self.assertEqual(UserActivity.objects.count(), 12)
+        # Synthetic users can see their customer's bookings.
+        emails = set(Customer.objects.values_list('email', flat=True))
+        self.assertTrue(set(User.objects.filter(username__startswith='guest').values_list('email', flat=True)) <= emails)
+        for hotel in Hotel.objects.all():
+            self.assertEqual(sorted(hotel.amenity_rows.values_list('name', flat=True)), HotelAmenity.normalize(hotel.amenities))
+
+    def test_bookings_of_a_room_never_overlap(self):
+        self.seed(bookings=300)
+        for room in Room.objects.all():
+            stays = list(room.bookings.order_by('check_in').values_list('check_in', 'check_out'))
+            self.assertTrue(all(check_out <= next_in for (_, check_out), (next_in, _) in zip(stays, stays[1:])))
+            self.assertTrue(all(check_in < check_out for check_in, check_out in stays))
+
+    def test_same_seed_gives_same_data(self):
+        self.seed()
+        first = self.snapshot()
+        self.seed(flush=True, chunk_size=5)
+        self.assertEqual(self.snapshot(), first)
+        self.seed(flush=True, seed=8)
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_flush_removes_archived_bookings(self):
+        self.seed()
+        self.assertGreater(retention.archive_bookings(days=0, pause=0), 0)
+        self.seed(flush=True)
+        self.assertEqual(ArchivedBooking.objects.count(), 0)
+        self.assertEqual(Booking.objects.count(), 40)
+        connection.check_constraints()
+
+    def test_refuses_to_mix_with_existing_data(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class BenchmarkTests(VectorsModelMixin, TestCase):
+    def result(self, p95_ms=10.0, queries_max=3, errors=0):
+        return {'p95_ms': p95_ms, 'queries_max': queries_max, 'errors': errors}
+
+    def test_compare_flags_slower_p95_more_queries_and_errors(self):
+        baseline = {'results': {'small': {'a': self.result(), 'b': self.result(), 'c': self.result(), 'd': self.result()}}}
+        current = {'results': {'small': {
+            'a': self.result(p95_ms=12.0),  # within the threshold
+            'b': self.result(p95_ms=20.0),
+            'c': self.result(queries_max=4),
+            'd': self.result(errors=1),
+            'new': self.result(),
+        }}}
+        regressions = benchmarks.compare(baseline, current, threshold=0.25)
+        self.assertEqual([line.split(':')[0] for line in regressions], ['small/b', 'small/c', 'small/d'])
+        # Tiny absolute slowdowns are noise.
+        fast = {'results': {'small': {'a': self.result(p95_ms=0.5)}}}
+        self.assertEqual(benchmarks.compare(fast, {'results': {'small': {'a': self.result(p95_ms=1.2)}}}), [])
+
+    def test_command_writes_results_and_checks_baseline(self):
+        scenarios = ['hotel_search', 'hotel_detail', 'book_room', 'delete_booking', 'my_bookings', 'delete_hotel']
+        options = {'requests': 3, 'warmup': 1, 'scenario': scenarios, 'stdout': io.StringIO()}
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('benchmark', output=output, **options)
+            with open(output) as f:
+                results = json.load(f)
+            self.assertEqual(results['meta']['scales'], {'small': benchmarks.SCALES['small']})
+            small = results['results']['small']
+            self.assertEqual(sorted(small), sorted(scenarios))
+            for name, result in small.items():
+                self.assertEqual(result['errors'], 0, name)
+                self.assertEqual(result['requests'], 3)
+                self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+
+            small['book_room']['queries_max'] = 0
+            with open(output, 'w') as f:
+                json.dump(results, f)
+            # Only the query count is deterministic enough to test on.
+            with self.assertRaisesMessage(CommandError, '1 regressions'):
+                call_command('benchmark', baseline=output, threshold=1000, **options)
+
+        # The seeded catalog is rolled back.
+        self.assertFalse(Hotel.objects.exists())
+
+
+class SessionBenchmarkTests(TransactionTestCase):
+    def test_cached_sessions_and_users_save_their_queries(self):
+        out = io.StringIO()
+        call_command('benchmark_sessions', users=2, threads=2, requests=3, warmup=1, route=['hotel_list'], stdout=out)
+        self.assertIn('save 2.00 queries per request', out.getvalue())
+        # Its users and their sessions are removed.
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Session.objects.exists())
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """Just enough of an SMTP server to count connections and collect
+    messages; mail to an address in ``rejected`` is refused."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPStubHandler)
+        self.connections = 0
+        self.messages = []
+        self.rejected = set()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 stub')
+        recipients = []
+        for line in self.rfile:
+            verb = line[:4].upper()
+            if verb == b'RCPT':
+                address = line.split(b':', 1)[1].strip().strip(b'<>').decode()
+                if address in self.server.rejected:
+                    self.reply('550 No such user')
+                    continue
+                recipients.append(address)
+            elif verb == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                body = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                self.server.messages.append((recipients, body))
+                recipients = []
+            elif verb == b'QUIT':
+                self.reply('221 Bye')
+                return
+            self.reply('250 OK')
+
+
+@override_settings(MAIL_IN_BACKGROUND=False, MAIL_RETRY_DELAY=60, MAIL_MAX_ATTEMPTS=3)
+class MailQueueTests(TestCase):
+    def setUp(self):
+        mailqueue.reset_sender()
+        self.addCleanup(mailqueue.reset_sender)
+
+    def smtp(self):
+        stub = SMTPStub()
+        self.addCleanup(stub.stop)
+        smtp_settings = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1', EMAIL_PORT=stub.port,
+        )
+        smtp_settings.enable()
+        self.addCleanup(smtp_settings.disable)
+        return stub
+
+    def test_contact_form_is_queued_and_sent_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('booking:contact_us'), {
+                'name': 'Ada', 'email': 'ada@example.com', 'message': 'Do you allow pets?',
+            })
+        self.assertTrue(response.context['success'])
+        queued = OutgoingEmail.objects.get()
+        self.assertEqual((queued.status, queued.to), ('pending', [settings.DEFAULT_FROM_EMAIL]))
+        self.assertEqual(mail.outbox, [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Contact Us Message from Ada')
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.lease), ('sent', 1, ''))
+        self.assertIsNotNone(queued.sent_at)
+
+    def test_booking_confirmation_goes_through_the_queue(self):
+        hotel = Hotel.objects.create(name='Grand Plaza', location='New York', description='Luxury.')
+        room = Room.objects.create(hotel=hotel, room_type='Suite', price=250)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('booking:book_room', args=[room.id]), {
+                'name': 'Ada', 'email': 'ada@example.com', 'phone': '1',
+                'check_in': '2031-05-01', 'check_out': '2031-05-03',
+            })
+        booking = Booking.objects.get()
+        self.assertRedirects(response, reverse('booking:booking_confirmation', args=[booking.id]))
+        message = mail.outbox[0]
+        self.assertEqual((message.subject, message.to), (f'Booking confirmation #{booking.id}', ['ada@example.com']))
+        self.assertIn('Grand Plaza, New York', message.body)
+        self.assertIn('Thursday, 1 May 2031', message.body)
+        self.assertIn(f'http://testserver/booking/confirmation/{booking.id}/', message.body)
+
+    def test_batch_is_sent_over_one_connection(self):
+        stub = self.smtp()
+        for i in range(5):
+            mailqueue.enqueue(f'Message {i}', 'Hello', [f'guest{i}@example.com'])
+        self.assertEqual(mailqueue.get_sender().send_due(), 5)
+        self.assertEqual(stub.connections, 1)
+        self.assertEqual([recipients for recipients, _ in stub.messages], [[f'guest{i}@example.com'] for i in range(5)])
+        self.assertFalse(OutgoingEmail.objects.exclude(status='sent').exists())
+
+    def test_failed_message_is_retried_with_backoff_then_given_up(self):
+        stub = self.smtp()
+        stub.rejected.add('nobody@example.com')
+        bad = mailqueue.enqueue('Bounce', 'Hello', ['nobody@example.com'])
+        good = mailqueue.enqueue('Hello', 'Hello', ['ada@example.com'])
+        sender = mailqueue.get_sender()
+        with self.assertLogs('booking.mailqueue', 'WARNING'):
+            self.assertEqual(sender.send_due(), 1)
+        self.assertEqual(len(stub.messages), 1)
+        bad.refresh_from_db()
+        self.assertEqual((bad.status, bad.attempts), ('pending', 1))
+        self.assertIn('SMTPRecipientsRefused', bad.last_error)
+        self.assertAlmostEqual((bad.next_attempt_at - timezone.now()).total_seconds(), 60, delta=5)
+        # Not due yet.
+        self.assertEqual(sender.send_due(), 0)
+
+        for delay in (120, None):
+            OutgoingEmail.objects.filter(pk=bad.pk).update(next_attempt_at=timezone.now())
+            with self.assertLogs('booking.mailqueue', 'WARNING' if delay else 'ERROR'):
+                sender.send_due()
+            bad.refresh_from_db()
+            if delay:
+                self.assertAlmostEqual((bad.next_attempt_at - timezone.now()).total_seconds(), delay, delta=5)
+        self.assertEqual((bad.status, bad.attempts), ('failed', 3))
+        self.assertEqual(OutgoingEmail.objects.get(pk=good.pk).status, 'sent')
+
+    def test_unreachable_server_keeps_messages_queued(self):
+        stub = self.smtp()
+        stub.stop()
+        mailqueue.enqueue('Hello', 'Hello', ['ada@example.com'])
+        mailqueue.enqueue('Hello again', 'Hello', ['ada@example.com'])
+        with self.assertLogs('booking.mailqueue', 'WARNING') as logs:
+            self.assertEqual(mailqueue.get_sender().send_due(), 0)
+        self.assertIn('Connection refused', logs.output[0])
+        self.assertEqual(list(OutgoingEmail.objects.values_list('status', 'attempts')), [('pending', 1)] * 2)
+
+    def test_claimed_messages_are_leased_to_one_worker(self):
+        mailqueue.enqueue('Hello', 'Hello', ['ada@example.com'])
+        first = mailqueue.claim(10)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(mailqueue.claim(10), [])
+        # A worker that died mid-send gives the message back once its lease ends.
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual([message.pk for message in mailqueue.claim(10)], [first[0].pk])
+
+    def test_command_sends_due_mail(self):
+        mailqueue.enqueue('Hello', 'Hello', ['ada@example.com'])
+        out = io.StringIO()
+        call_command('send_queued_mail', stdout=out)
+        self.assertIn('Sent 1 emails.', out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class BackgroundMailTests(TransactionTestCase):
+    def test_worker_sends_queued_mail(self):
+        sender = mailqueue.MailSender(batch_size=10, poll_interval=60)
+        self.addCleanup(atexit.unregister, sender.shutdown)
+        self.addCleanup(sender.shutdown)
+        for i in range(15):
+            OutgoingEmail.objects.create(subject=f'Message {i}', body='Hello', from_email='hotel@example.com', to=['ada@example.com'])
+        sender.wake()
+        deadline = time.monotonic() + 10
+        while OutgoingEmail.objects.filter(status='sent').count() < 15 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(OutgoingEmail.objects.filter(status='sent').count(), 15)
+        self.assertEqual(len(mail.outbox), 15)
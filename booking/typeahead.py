@@ -0,0 +1,454 @@
+"""Typeahead for the search box: hotels and locations by the start of their
+words, tolerating typos.
+
+get_suggestions ranks every hotel by spaCy similarity, which is far too slow
+to run on each keystroke. This index is held in memory instead: the words of
+every hotel name and location, each with the (sorted) positions of the
+entries it appears in. Entries are ordered best first (rating and recent
+bookings), so a lookup builds one boolean mask over them per word typed,
+combines the masks and takes the first few set positions, with no sorting
+at request time.
+
+The index is built when a worker boots (TYPEAHEAD_WARMUP) or on first use,
+and tagged with the TYPEAHEAD cache version, which only moves when a hotel
+is created, deleted, renamed, moved or rerated (price and availability
+changes leave it alone). Those changes in this process are applied to the
+index at once through model signals, along with the version they bumped;
+other processes see the version change and rebuild in the background,
+answering from their previous snapshot until it is ready.
+"""
+import functools
+import logging
+import re
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.urls import get_script_prefix, reverse
+
+from . import metrics
+from .cache import TYPEAHEAD, get_version
+from .models import Hotel
+from .recommendations import recent_booking_counts
+
+logger = logging.getLogger(__name__)
+
+# Prefixes up to this long have their entries precomputed; longer ones
+# combine the postings of the (few) words they start.
+SHORT_PREFIX = 3
+# Words typed this long or longer are also matched with typos: one, or two
+# from LONG_WORD characters on.
+FUZZY_MIN_LENGTH = 3
+LONG_WORD = 7
+# Words compared letter by letter for a typo, at most.
+FUZZY_CANDIDATES = 64
+# Only this much of a word counts for typo matching.
+FUZZY_PREFIX = 12
+# Masks are scanned for matches this many entries at a time.
+SCAN_CHUNK = 4096
+
+RATING_WEIGHT = 0.5
+POPULARITY_WEIGHT = 0.5
+
+EMPTY = np.empty(0, dtype=np.int32)
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lowercase without accents, so 'Zürich' is typed as 'zurich'."""
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def words(text):
+    return WORD_RE.findall(normalize(text))
+
+
+def _grams(word):
+    marked = '^' + word[:FUZZY_PREFIX]
+    return [marked[i:i + 2] for i in range(len(marked) - 1)]
+
+
+def prefix_distance(typed, word, limit):
+    """Fewest edits (insertions, deletions, substitutions or swaps of
+    adjacent letters) that turn ``typed`` into a prefix of ``word``, or
+    ``limit + 1`` if that takes more than ``limit``."""
+    columns = min(len(word), len(typed) + limit)
+    before, previous = None, list(range(columns + 1))
+    for i in range(1, len(typed) + 1):
+        current = [i] + [0] * columns
+        for j in range(1, columns + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (typed[i - 1] != word[j - 1]),
+            )
+            if i > 1 and j > 1 and typed[i - 1] == word[j - 2] and typed[i - 2] == word[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(min(previous), limit + 1)
+
+
+def _typos(word):
+    return 1 if len(word) < LONG_WORD else 2
+
+
+def _first(mask, count):
+    """Positions of the first ``count`` set entries of ``mask``, without
+    scanning all of it when they come early (the best entries do)."""
+    found, total = [], 0
+    for start in range(0, len(mask), SCAN_CHUNK):
+        if total >= count:
+            break
+        hits = np.flatnonzero(mask[start:start + SCAN_CHUNK])[:count - total]
+        if len(hits):
+            found.append(hits + start)
+            total += len(hits)
+    return np.concatenate(found) if found else EMPTY
+
+
+@functools.lru_cache(maxsize=None)
+def _hotel_url_format(script_prefix):
+    # reverse() costs more than a whole lookup, so it is done once.
+    return reverse('booking:hotel_detail', args=[999999999]).replace('999999999', '{}')
+
+
+class TermIndex:
+    """Entries by the words in them.
+
+    ``entries`` holds the words of each entry, best entry first. Lookups
+    return boolean masks over the entries, so the words of a query are
+    combined with ``&`` and the best matches are the first set positions.
+    """
+
+    def __init__(self, entries):
+        self.size = len(entries)
+        postings = defaultdict(list)
+        for position, entry_words in enumerate(entries):
+            for word in set(entry_words):
+                postings[word].append(position)
+        self.terms = sorted(postings)
+        self.postings = [np.array(postings[term], dtype=np.int32) for term in self.terms]
+
+        short, grams = defaultdict(list), defaultdict(list)
+        for i, term in enumerate(self.terms):
+            for length in range(1, min(len(term), SHORT_PREFIX) + 1):
+                short[term[:length]].append(i)
+            for gram in set(_grams(term)):
+                grams[gram].append(i)
+        self.short = {
+            prefix: np.unique(np.concatenate([self.postings[i] for i in ids]))
+            for prefix, ids in short.items()
+        }
+        self.grams = {gram: np.array(ids, dtype=np.int32) for gram, ids in grams.items()}
+
+    def _mask(self, term_ids):
+        mask = np.zeros(self.size, dtype=bool)
+        for i in term_ids:
+            mask[self.postings[i]] = True
+        return mask
+
+    def prefix_mask(self, word):
+        """Entries with a word starting with ``word``."""
+        if len(word) <= SHORT_PREFIX:
+            mask = np.zeros(self.size, dtype=bool)
+            mask[self.short.get(word, EMPTY)] = True
+            return mask
+        start = bisect_left(self.terms, word)
+        end = bisect_left(self.terms, word + '\U0010ffff', start)
+        return self._mask(range(start, end))
+
+    def similar_terms(self, word):
+        """Words that ``word`` is a prefix of, give or take a typo or two."""
+        typos = _typos(word)
+        grams = _grams(word)
+        found = [self.grams[gram] for gram in grams if gram in self.grams]
+        if not found:
+            return []
+        shared = np.bincount(np.concatenate(found), minlength=len(self.terms))
+        # An edit changes at most three of the letter pairs (a swap).
+        candidates = np.flatnonzero(shared >= max(1, len(grams) - 3 * typos))
+        if len(candidates) > FUZZY_CANDIDATES:
+            best = np.argpartition(-shared[candidates], FUZZY_CANDIDATES - 1)[:FUZZY_CANDIDATES]
+            candidates = candidates[best]
+        return [i for i in candidates if prefix_distance(word, self.terms[i], typos) <= typos]
+
+    def fuzzy_mask(self, word):
+        return self._mask(self.similar_terms(word))
+
+    def search(self, typed, limit, alive=None):
+        """Positions of the best ``limit`` entries matching every typed word
+        as a prefix, as ``(exact, fuzzy)``. Only when there are none are
+        typos looked for: in the words nothing starts with, or else in the
+        last word, the one being typed.
+        """
+        masks = [self.prefix_mask(word) for word in typed]
+        exact = np.logical_and.reduce(masks)
+        if alive is not None:
+            exact &= alive
+        found = _first(exact, limit)
+        if len(found):
+            return found, EMPTY
+        misspelt = [i for i, mask in enumerate(masks) if not mask.any()] or [len(typed) - 1]
+        misspelt = [i for i in misspelt if len(typed[i]) >= FUZZY_MIN_LENGTH]
+        if not misspelt:
+            return found, EMPTY
+        fuzzy = np.ones(self.size, dtype=bool) if alive is None else alive.copy()
+        for i, mask in enumerate(masks):
+            fuzzy &= mask | self.fuzzy_mask(typed[i]) if i in misspelt else mask
+        return found, _first(fuzzy, limit)
+
+    def memory_bytes(self):
+        arrays = [*self.postings, *self.short.values(), *self.grams.values()]
+        return (
+            sum(array.nbytes + sys.getsizeof(array) for array in arrays)
+            + sum(map(sys.getsizeof, self.terms)) + sys.getsizeof(self.terms) + sys.getsizeof(self.postings)
+            + sum(map(sys.getsizeof, self.short)) + sys.getsizeof(self.short)
+            + sum(map(sys.getsizeof, self.grams)) + sys.getsizeof(self.grams)
+        )
+
+
+def _matches(typed, entry_words):
+    """0 for an exact prefix match of every typed word, 1 with typos, None
+    otherwise. For the few entries changed since the index was built."""
+    exact = True
+    for word in typed:
+        if any(term.startswith(word) for term in entry_words):
+            continue
+        if len(word) < FUZZY_MIN_LENGTH:
+            return None
+        typos = _typos(word)
+        if not any(prefix_distance(word, term, typos) <= typos for term in entry_words):
+            return None
+        exact = False
+    return 0 if exact else 1
+
+
+class TypeaheadIndex:
+    def __init__(self, version):
+        start = time.perf_counter()
+        self.version = version
+        self.built_at = time.monotonic()
+        rows = list(Hotel.objects.values_list('id', 'name', 'location', Cast('rating', FloatField())))
+        booked = dict(recent_booking_counts())
+        most = max(booked.values(), default=0) or 1
+
+        scores = np.array(
+            [RATING_WEIGHT * (rating or 0) / 5 + POPULARITY_WEIGHT * booked.get(pk, 0) / most for pk, _, _, rating in rows],
+            dtype=np.float64,
+        )
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        order = np.lexsort((ids, -scores)) if rows else np.empty(0, dtype=np.int64)
+        rows = [rows[i] for i in order]
+        self.ids = ids[order]
+        self.names = [row[1] for row in rows]
+        self.locations = [row[2] for row in rows]
+        self.ratings = np.array([row[3] or 0 for row in rows], dtype=np.float32)
+        self.scores = scores[order].astype(np.float32)
+        self.by_id = np.argsort(self.ids)
+        self.hotel_terms = TermIndex([words(f'{row[1]} {row[2]}') for row in rows])
+
+        # Locations rank by recent bookings, then by number of hotels.
+        location_stats = defaultdict(lambda: [0, 0])
+        for pk, _, location, _ in rows:
+            location_stats[location][0] += booked.get(pk, 0)
+            location_stats[location][1] += 1
+        self.location_names = sorted(location_stats, key=lambda name: (-location_stats[name][0], -location_stats[name][1], name))
+        self.location_terms = TermIndex([words(name) for name in self.location_names])
+        self._known_locations = set(self.location_names)
+
+        # Hotels saved or deleted since the build: dead positions, and the
+        # current version of saved ones, searched one by one.
+        self._lock = threading.Lock()
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.changed = {}
+        self.new_locations = {}
+
+        self.build_seconds = time.perf_counter() - start
+        self.size_bytes = self.memory_bytes()
+        metrics.set_gauge('typeahead_index_bytes', self.size_bytes)
+        metrics.set_gauge('typeahead_index_hotels', len(self.ids))
+        logger.info('Built the typeahead index: %d hotels, %d locations, %.1f MB in %.2fs',
+                    len(self.ids), len(self.location_names), self.size_bytes / 2 ** 20, self.build_seconds)
+
+    def __len__(self):
+        return int(self.alive.sum()) + len(self.changed)
+
+    def age(self):
+        return time.monotonic() - self.built_at
+
+    def _position(self, hotel_id):
+        i = int(np.searchsorted(self.ids, hotel_id, sorter=self.by_id))
+        if i < len(self.ids) and self.ids[self.by_id[i]] == hotel_id:
+            return int(self.by_id[i])
+        return None
+
+    def _advance(self, version):
+        # Our own change bumped the version from the one we have; anything
+        # else bumped in between still needs a rebuild.
+        if version is not None and self.version == version - 1:
+            self.version = version
+
+    def update(self, hotel, version=None):
+        """Apply a saved ``hotel``; ``version`` is the TYPEAHEAD version
+        the save bumped."""
+        rating = float(hotel.rating or 0)
+        score = RATING_WEIGHT * rating / 5
+        with self._lock:
+            position = self._position(hotel.pk)
+            if position is not None:
+                self.alive[position] = False
+                # Keep the popularity it was built with.
+                score = float(self.scores[position]) - RATING_WEIGHT * float(self.ratings[position]) / 5 + score
+            self.changed[hotel.pk] = (words(f'{hotel.name} {hotel.location}'), hotel.name, hotel.location, rating, score)
+            if hotel.location not in self._known_locations:
+                self.new_locations[hotel.location] = words(hotel.location)
+            self._advance(version)
+
+    def remove(self, hotel_id, version=None):
+        with self._lock:
+            position = self._position(hotel_id)
+            if position is not None:
+                self.alive[position] = False
+            self.changed.pop(hotel_id, None)
+            self._advance(version)
+
+    def suggest(self, query, limit):
+        """``{'locations': [...], 'hotels': [...]}`` for what has been typed
+        so far, at most ``limit`` of each."""
+        typed = words(query)
+        if not typed or limit < 1:
+            return {'locations': [], 'hotels': []}
+        with self._lock:
+            changed = list(self.changed.items())
+            new_locations = list(self.new_locations.items())
+
+        exact, fuzzy = self.location_terms.search(typed, limit)
+        locations = [(0, i, self.location_names[i]) for i in exact] + [(1, i, self.location_names[i]) for i in fuzzy]
+        for name, location_words in new_locations:
+            match = _matches(typed, location_words)
+            if match is not None:
+                locations.append((match, len(self.location_names), name))
+
+        exact, fuzzy = self.hotel_terms.search(typed, limit, self.alive)
+        hotels = [
+            (match, -float(self.scores[i]), int(self.ids[i]), self.names[i], self.locations[i], float(self.ratings[i]))
+            for match, positions in ((0, exact), (1, fuzzy)) for i in positions
+        ]
+        for hotel_id, (hotel_words, name, location, rating, score) in changed:
+            match = _matches(typed, hotel_words)
+            if match is not None:
+                hotels.append((match, -score, hotel_id, name, location, rating))
+
+        url = _hotel_url_format(get_script_prefix())
+        return {
+            'locations': [{'name': name} for _, _, name in sorted(locations)[:limit]],
+            'hotels': [
+                {
+                    'id': hotel_id,
+                    'name': name,
+                    'location': location,
+                    'rating': round(rating, 2),
+                    'url': url.format(hotel_id),
+                }
+                for _, _, hotel_id, name, location, rating in sorted(hotels)[:limit]
+            ],
+        }
+
+    def memory_bytes(self):
+        return (
+            self.ids.nbytes + self.ratings.nbytes + self.scores.nbytes + self.by_id.nbytes
+            + sum(map(sys.getsizeof, self.names)) + sys.getsizeof(self.names)
+            + sum(map(sys.getsizeof, self.locations)) + sys.getsizeof(self.locations)
+            + sum(map(sys.getsizeof, self.location_names)) + sys.getsizeof(self.location_names)
+            + self.hotel_terms.memory_bytes() + self.location_terms.memory_bytes()
+        )
+
+
+_typeahead = None
+_typeahead_lock = threading.Lock()
+_rebuilding = threading.Event()
+
+
+def _rebuild():
+    global _typeahead
+    try:
+        index = TypeaheadIndex(get_version(TYPEAHEAD))
+        with _typeahead_lock:
+            _typeahead = index
+    except DatabaseError:
+        logger.exception('Could not rebuild the typeahead index')
+    finally:
+        _rebuilding.clear()
+
+
+def _rebuild_in_background():
+    try:
+        _rebuild()
+    finally:
+        close_old_connections()
+
+
+def schedule_rebuild():
+    """Rebuild the index on a background thread (or inline with
+    ``TYPEAHEAD_REBUILD_IN_BACKGROUND = False``), unless one is running."""
+    if _rebuilding.is_set():
+        return
+    _rebuilding.set()
+    if not settings.TYPEAHEAD_REBUILD_IN_BACKGROUND:
+        _rebuild()
+        return
+    threading.Thread(target=_rebuild_in_background, name='typeahead-rebuild', daemon=True).start()
+
+
+def get_typeahead():
+    """The index, built on first use; when hotels have changed in another
+    process, or the index is older than TYPEAHEAD_MAX_AGE (for popularity),
+    a rebuild is started and the current one returned."""
+    global _typeahead
+    index = _typeahead
+    if index is None:
+        with _typeahead_lock:
+            if _typeahead is None:
+                _typeahead = TypeaheadIndex(get_version(TYPEAHEAD))
+            return _typeahead
+    if index.version != get_version(TYPEAHEAD) or index.age() > settings.TYPEAHEAD_MAX_AGE:
+        schedule_rebuild()
+        index = _typeahead
+    return index
+
+
+def loaded_typeahead():
+    """The index if this process has built one, for the signal handlers."""
+    return _typeahead
+
+
+def reset_typeahead():
+    global _typeahead
+    with _typeahead_lock:
+        _typeahead = None
+
+
+def warm_up():
+    """Build the index ahead of the first request, e.g. at worker boot."""
+    try:
+        get_typeahead()
+    except DatabaseError:
+        logger.exception('Could not build the typeahead index')
+
+
+def suggest(query, limit=None):
+    limit = min(limit or settings.TYPEAHEAD_LIMIT, settings.TYPEAHEAD_MAX_LIMIT)
+    return get_typeahead().suggest(query, limit)
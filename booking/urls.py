@@ -1,6 +1,7 @@
 from django.urls import path
 from django.shortcuts import render
-from . import views
+from . import api, views
+from .metrics import metrics_view
 
 app_name = 'booking'
 
@@ -8,7 +9,9 @@ urlpatterns = [
     path('', lambda request: render(request, 'booking/base.html'), name='welcome'),
     path('hotels/', views.hotel_list, name='hotel_list'),
     path('hotels/add/', views.add_hotel, name='add_hotel'),
+    path('hotels/search/', views.hotel_search, name='hotel_search'),
     path('hotel/<int:hotel_id>/', views.hotel_detail, name='hotel_detail'),
+    path('hotel/<int:hotel_id>/availability/', views.hotel_availability, name='hotel_availability'),
     path('book/<int:room_id>/', views.book_room, name='book_room'),
     path('booking/confirmation/<int:booking_id>/', views.booking_confirmation, name='booking_confirmation'),
     path('management/', views.management_view, name='management_view'),
@@ -22,4 +25,10 @@ urlpatterns = [
     path('add-customer/', views.add_customer, name='add_customer'),
     path('delete-hotel/<int:hotel_id>/', views.delete_hotel, name='delete_hotel'),
     path('suggestions/', views.get_suggestions, name='get_suggestions'),
+    path('suggestions/typeahead/', views.typeahead, name='typeahead'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('api/hotels/', api.hotels, name='api_hotels'),
+    path('api/hotels/<int:hotel_id>/', api.hotel, name='api_hotel'),
+    path('api/rooms/', api.rooms, name='api_rooms'),
+    path('api/rooms/<int:room_id>/', api.room, name='api_room'),
 ]
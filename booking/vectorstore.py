@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+FILES = ('vectors.npy', 'keys.npy', 'rows.npy', 'tokenizer', 'meta.json')
+
+
+def export(nlp, directory):
+    """Write the word vectors of ``nlp`` to ``directory`` as plain ``.npy``
+    files plus the tokenizer, so worker processes can memory-map them
+    instead of each loading the whole pipeline."""
+    from spacy.attrs import LOWER, ORTH
+
+    vectors = nlp.vocab.vectors
+    if vectors.mode != 'default':
+        raise ValueError(f"Only default-mode vectors can be exported, not {vectors.mode!r}.")
+    attr = getattr(vectors, 'attr', ORTH)
+    if attr not in (ORTH, LOWER):
+        raise ValueError('Vectors must be keyed by ORTH or LOWER.')
+
+    keys = np.fromiter(vectors.key2row.keys(), dtype=np.uint64, count=len(vectors.key2row))
+    rows = np.fromiter(vectors.key2row.values(), dtype=np.int64, count=len(vectors.key2row))
+    order = np.argsort(keys)
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'vectors.npy'), np.ascontiguousarray(vectors.data, dtype=np.float32))
+    np.save(os.path.join(directory, 'keys.npy'), keys[order])
+    np.save(os.path.join(directory, 'rows.npy'), rows[order])
+    # Token hashes don't need the string store, so leave the vocab out.
+    nlp.tokenizer.to_disk(os.path.join(directory, 'tokenizer'), exclude=['vocab'])
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({
+            'lang': nlp.lang,
+            'attr': 'lower' if attr == LOWER else 'orth',
+            'shape': list(vectors.data.shape),
+            'n_keys': len(keys),
+        }, f)
+    return len(keys)
+
+
+def is_exported(directory):
+    return all(os.path.exists(os.path.join(directory, name)) for name in FILES)
+
+
+class WordVectorStore:
+    """Read-only word vectors memory-mapped from an :func:`export` directory.
+
+    The arrays are opened with ``mmap_mode='r'``, so every worker shares the
+    same page-cache pages. Only a blank tokenizer is loaded per process.
+    """
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        with open(os.path.join(self.directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(os.path.join(self.directory, 'vectors.npy'), mmap_mode='r')
+        self.keys = np.load(os.path.join(self.directory, 'keys.npy'), mmap_mode='r')
+        self.rows = np.load(os.path.join(self.directory, 'rows.npy'), mmap_mode='r')
+        self.lowercase_keys = self.meta['attr'] == 'lower'
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    @property
+    def dims(self):
+        return self.vectors.shape[1]
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    import spacy
+
+                    tokenizer = spacy.blank(self.meta['lang']).tokenizer
+                    tokenizer.from_disk(os.path.join(self.directory, 'tokenizer'), exclude=['vocab'])
+                    self._tokenizer = tokenizer
+        return self._tokenizer
+
+    def doc_vector(self, text):
+        """Average of the token vectors, matching spaCy's ``Doc.vector``
+        (tokens without a vector count as zeros)."""
+        tokens = self.tokenizer(text)
+        if not len(tokens):
+            return np.zeros(self.dims, dtype=np.float32)
+        attr = 'lower' if self.lowercase_keys else 'orth'
+        token_keys = np.array([getattr(token, attr) for token in tokens], dtype=np.uint64)
+        pos = np.searchsorted(self.keys, token_keys)
+        pos[pos == len(self.keys)] = 0
+        found = self.keys[pos] == token_keys
+        total = self.vectors[self.rows[pos[found]]].sum(axis=0, dtype=np.float32)
+        return total / np.float32(len(tokens))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the shared store, or ``None`` if no vectors have been exported
+    to ``settings.WORD_VECTORS_DIR``."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None and is_exported(settings.WORD_VECTORS_DIR):
+                _store = WordVectorStore(settings.WORD_VECTORS_DIR)
+    return _store
+
+
+def reset_store():
+    global _store
+    with _store_lock:
+        _store = None
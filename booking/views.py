@@ -1,12 +1,10 @@
-import spacy
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Hotel, Room, Customer, Booking
+from .models import Hotel, Room, Booking
 from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db import transaction
-from django.http import HttpResponse
-from django.db.models import Q
+from django.http import Http404, HttpResponse
+from django.db.models import Max, Min, Q
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from .models import UserActivity
@@ -14,90 +12,206 @@ from django.views.decorators.http import require_POST
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.core.mail import send_mail
+from django.template.loader import render_to_string
 from django.conf import settings
 from django.shortcuts import render
 from django.http import JsonResponse
 from .forms import HotelForm, RoomForm, CustomerForm
+from .availability import availability_calendar, free_rooms, parse_stay
+from .reservations import BookingConflict, reserve_room
+from .retention import purge_hotel
+from .search import search_hotel_ids
+from .pagination import keyset_paginate, paginate_ranked
+from .facets import PRICE_ORDERING, facet_counts, filter_hotels, parse_filters, rank_matching, with_min_price
+from .activity import record_search
+from .recommendations import recommended_hotel_ids
+from .cache import HOTELS, ROOMS, get_version, hotel_scope
+from .pagecache import cache_page_for_anonymous
+from .mailqueue import enqueue as queue_mail
+from .typeahead import suggest
+from .routers import primary_only
 
-# Load spaCy NLP model
-nlp = spacy.load("en_core_web_md")
-
+@cache_page_for_anonymous(HOTELS)
 def hotel_list(request):
     query = request.GET.get('query', '')
-    hotels = Hotel.objects.all()
+    sort = request.GET.get('sort', '')
+    available = request.GET.get('available') == '1'
+    hotels = with_min_price(Hotel.objects.defer('amenities'))
+    if available:
+        hotels = hotels.filter(summary__available_rooms__gt=0)
 
-    if query:
-        query_doc = nlp(query.lower())
-        scored = []
+    if query and (sort or available):
+        ranked = search_hotel_ids(query, variant='lower', limit=settings.SEARCH_MAX_RESULTS)
+        page = paginate_ranked(request, rank_matching(hotels, ranked, sort), hotels.in_bulk)
+    elif query:
+        page = paginate_ranked(request, search_hotel_ids(query, variant='lower'), hotels.in_bulk)
+    elif sort == 'price':
+        page = keyset_paginate(request, hotels.filter(min_price__isnull=False), PRICE_ORDERING)
+    else:
+        page = keyset_paginate(request, hotels, ['id'])
 
-        for hotel in hotels:
-            text = f"{hotel.name} {hotel.description} {hotel.location}".lower()
-            sim = query_doc.similarity(nlp(text))
-            if sim > 0.6:
-                scored.append((sim, hotel))
+    return render(request, 'booking/hotel_list.html', {
+        'hotels': page,
+        'page': page,
+        'query': query,
+        'sort': sort,
+        'available': available,
+        'cache_version': get_version(HOTELS),
+    })
 
-        scored.sort(reverse=True, key=lambda x: x[0])
-        hotels = [h[1] for h in scored]
+def hotel_search(request):
+    """JSON faceted search: text query plus location, rating, price,
+    amenity and availability filters, with facet counts for the matching
+    hotels. Ordered by relevance, or rating without a query, or with
+    ``?sort=price`` by the cheapest room."""
+    query = request.GET.get('query', '')
+    sort = request.GET.get('sort', '')
+    try:
+        filters = parse_filters(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-    return render(request, 'booking/hotel_list.html', {
-        'hotels': hotels,
-        'query': query
+    if request.user.is_authenticated and (filters['location'] or filters['min_rating'] is not None or filters['max_price'] is not None):
+        record_search(
+            request.user,
+            location=filters['location'],
+            min_rating=filters['min_rating'],
+            max_price=filters['max_price'],
+        )
+
+    hotels = with_min_price(filter_hotels(Hotel.objects.all(), filters))
+    ranked = None
+    fields = ('id', 'name', 'location', 'rating', 'amenities')
+    if query:
+        ranked = search_hotel_ids(query, variant='lower', limit=settings.SEARCH_MAX_RESULTS)
+        page = paginate_ranked(request, rank_matching(hotels, ranked, sort), hotels.only(*fields).in_bulk)
+    elif sort == 'price':
+        page = keyset_paginate(request, hotels.only(*fields).filter(min_price__isnull=False), PRICE_ORDERING)
+    else:
+        # Descending on both keys so the walk runs backwards over the
+        # rating index instead of sorting.
+        page = keyset_paginate(request, hotels.only(*fields), ['-rating', '-id'])
+
+    return JsonResponse({
+        'results': [
+            {
+                'id': hotel.id,
+                'name': hotel.name,
+                'location': hotel.location,
+                'rating': float(hotel.rating),
+                'amenities': hotel.amenities,
+                'min_price': None if hotel.min_price is None else float(hotel.min_price),
+                'url': reverse('booking:hotel_detail', args=[hotel.id]),
+            }
+            for hotel in page
+        ],
+        'facets': facet_counts(filters, ranked),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
     })
+
+@cache_page_for_anonymous('hotel:{hotel_id}')
 def hotel_detail(request, hotel_id):
     hotel = get_object_or_404(Hotel, pk=hotel_id)
-    rooms = hotel.rooms.filter(availability=True)
-    return render(request, 'booking/hotel_detail.html', {'hotel': hotel, 'rooms': rooms})
+    check_in, check_out, error = None, None, None
+    if request.GET.get('check_in') or request.GET.get('check_out'):
+        try:
+            check_in, check_out = parse_stay(request.GET.get('check_in'), request.GET.get('check_out'))
+        except ValueError as e:
+            error = str(e)
+    if check_in:
+        rooms = free_rooms(check_in, check_out, hotel=hotel)
+    else:
+        rooms = hotel.rooms.all()
+    return render(request, 'booking/hotel_detail.html', {
+        'hotel': hotel,
+        'rooms': rooms,
+        'check_in': check_in,
+        'check_out': check_out,
+        'error': error,
+        'cache_version': get_version(hotel_scope(hotel.id)),
+    })
+
+def hotel_availability(request, hotel_id):
+    hotel = get_object_or_404(Hotel, pk=hotel_id)
+    try:
+        start, end = parse_stay(request.GET.get('start'), request.GET.get('end'))
+        calendar = availability_calendar(hotel, start, end)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(calendar)
 
 @require_http_methods(["GET", "POST"])
-@transaction.atomic
 def book_room(request, room_id):
-    room = get_object_or_404(Room, pk=room_id, availability=True)
+    room = get_object_or_404(Room.objects.select_related('hotel'), pk=room_id)
     if request.method == 'POST':
         name = request.POST.get('name')
         email = request.POST.get('email')
         phone = request.POST.get('phone')
-        check_in = request.POST.get('check_in')
-        check_out = request.POST.get('check_out')
-        if not all([name, email, phone, check_in, check_out]):
+        if not all([name, email, phone, request.POST.get('check_in'), request.POST.get('check_out')]):
             return HttpResponse("All fields are required.", status=400)
-        customer, created = Customer.objects.get_or_create(email=email, defaults={'name': name, 'phone': phone})
-        booking = Booking.objects.create(
-            customer=customer,
-            room=room,
-            check_in=check_in,
-            check_out=check_out,
-            status='confirmed'
+        try:
+            check_in, check_out = parse_stay(request.POST.get('check_in'), request.POST.get('check_out'))
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+        try:
+            booking = reserve_room(room.id, check_in, check_out, name=name, email=email, phone=phone)
+        except BookingConflict:
+            return HttpResponse("This room is already booked for the selected dates.", status=409)
+        except Room.DoesNotExist:
+            raise Http404("Room not found.")
+        confirmation_url = reverse('booking:booking_confirmation', args=[booking.id])
+        queue_mail(
+            f'Booking confirmation #{booking.id}',
+            render_to_string('booking/emails/booking_confirmation.txt', {
+                'booking': booking,
+                'room': room,
+                'name': name,
+                'url': request.build_absolute_uri(confirmation_url),
+            }),
+            [email],
         )
-        room.availability = False
-        room.save()
-        return redirect(reverse('booking:booking_confirmation', args=[booking.id]))
-    return render(request, 'booking/book_room.html', {'room': room})
+        return redirect(confirmation_url)
+    return render(request, 'booking/book_room.html', {
+        'room': room,
+        'check_in': request.GET.get('check_in', ''),
+        'check_out': request.GET.get('check_out', ''),
+    })
 
+@primary_only
 def booking_confirmation(request, booking_id):
-    booking = get_object_or_404(Booking, pk=booking_id)
+    booking = get_object_or_404(Booking.objects.select_related('customer', 'room__hotel'), pk=booking_id)
     return render(request, 'booking/booking_confirmation.html', {'booking': booking})
 
 @staff_member_required
 def management_view(request):
-    bookings = Booking.objects.select_related('customer', 'room', 'room__hotel').all()
-    return render(request, 'booking/management_view.html', {'bookings': bookings})
+    bookings = Booking.objects.select_related('customer', 'room', 'room__hotel').only(
+        'id', 'check_in', 'check_out', 'status', 'customer__name', 'room__room_type', 'room__hotel__name',
+    )
+    page = keyset_paginate(request, bookings, ['-id'])
+    return render(request, 'booking/management_view.html', {'bookings': page, 'page': page})
 
 @staff_member_required
 @require_POST
 def delete_booking(request, booking_id):
-    booking = get_object_or_404(Booking, pk=booking_id)
+    booking = get_object_or_404(Booking.objects.select_related('room'), pk=booking_id)
     booking.delete()
     return HttpResponseRedirect(reverse('booking:management_view'))
 
+@cache_page_for_anonymous(ROOMS)
 def list_rooms(request):
-    rooms = Room.objects.all()
-    return render(request, 'booking/list_rooms.html', {'rooms': rooms})
+    rooms = Room.objects.select_related('hotel').only('id', 'room_type', 'price', 'hotel__name')
+    page = keyset_paginate(request, rooms, ['id'])
+    return render(request, 'booking/list_rooms.html', {'rooms': page, 'page': page, 'cache_version': get_version(ROOMS)})
 
 @login_required
+@primary_only
 def my_bookings(request):
-    bookings = Booking.objects.filter(customer__email=request.user.email).select_related('room', 'room__hotel')
-    return render(request, 'booking/my_bookings.html', {'bookings': bookings})
+    bookings = Booking.objects.filter(customer__email=request.user.email).select_related('room', 'room__hotel').only(
+        'id', 'check_in', 'check_out', 'status', 'room__room_type', 'room__hotel__name',
+    )
+    page = keyset_paginate(request, bookings, ['-check_in', '-id'])
+    return render(request, 'booking/my_bookings.html', {'bookings': page, 'page': page})
 
 def contact_us(request):
     if request.method == 'POST':
@@ -105,36 +219,37 @@ def contact_us(request):
         email = request.POST.get('email')
         message = request.POST.get('message')
         if name and email and message:
-            send_mail(
-                f'Contact Us Message from {name}',
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [settings.DEFAULT_FROM_EMAIL],
-                fail_silently=False,
-            )
+            queue_mail(f'Contact Us Message from {name}', message, [settings.DEFAULT_FROM_EMAIL])
             return render(request, 'booking/contact_us.html', {'success': True})
         else:
             return render(request, 'booking/contact_us.html', {'error': 'All fields are required.'})
     return render(request, 'booking/contact_us.html')
 
 def recommend_hotels(request):
-    recommendations = [
-        {
-            "name": "Grand Plaza",
-            "location": "New York",
-            "price_range": "$120 - $180",
-            "rating": 4.5,
-            "amenities": ["wifi", "pool", "gym"]
-        },
-        {
-            "name": "Sea View Resort",
-            "location": "Miami",
-            "price_range": "$200 - $250",
-            "rating": 4.0,
-            "amenities": ["wifi", "beach", "spa"]
-        }
-    ]
-    return JsonResponse({"recommendations": recommendations})
+    """Precomputed per-user recommendations, or popular hotels for anonymous
+    users and users without any yet. See booking.recommendations."""
+    hotel_ids, source = recommended_hotel_ids(request.user)
+    hotels = (
+        Hotel.objects.filter(id__in=hotel_ids)
+        .annotate(min_price=Min('rooms__price'), max_price=Max('rooms__price'))
+        .only('id', 'name', 'location', 'rating', 'amenities')
+        .in_bulk()
+    )
+    recommendations = []
+    for hotel_id in hotel_ids:
+        hotel = hotels.get(hotel_id)
+        if hotel is None:
+            continue
+        recommendations.append({
+            "id": hotel.id,
+            "name": hotel.name,
+            "location": hotel.location,
+            "price_range": f"${hotel.min_price:.0f} - ${hotel.max_price:.0f}" if hotel.min_price is not None else None,
+            "rating": float(hotel.rating),
+            "amenities": hotel.amenities,
+            "url": reverse('booking:hotel_detail', args=[hotel.id]),
+        })
+    return JsonResponse({"source": source, "recommendations": recommendations})
 
 @staff_member_required
 def add_hotel(request):
@@ -172,24 +287,11 @@ def add_customer(request):
 
 def get_suggestions(request):
     query = request.GET.get('query', '')
-    results = []
 
     if query:
-        query_doc = nlp(query)
-        all_hotels = Hotel.objects.all()
-
-        for hotel in all_hotels:
-            hotel_text = f"{hotel.name} {hotel.description} {hotel.location}"
-            hotel_doc = nlp(hotel_text)
-
-            similarity = query_doc.similarity(hotel_doc)
-            if similarity > 0.6:  # Threshold can be adjusted
-                results.append((similarity, hotel))
-
-        # Sort by similarity
-        results = sorted(results, key=lambda x: x[0], reverse=True)
-        suggestions = [hotel for _, hotel in results]
-
+        ranked = search_hotel_ids(query, limit=settings.MAX_PAGE_SIZE)
+        hotels = Hotel.objects.only('id', 'name', 'description', 'location').in_bulk(ranked)
+        suggestions = [hotels[hotel_id] for hotel_id in ranked if hotel_id in hotels]
     else:
         suggestions = []
 
@@ -198,9 +300,20 @@ def get_suggestions(request):
         'query': query
     })
 
-from django.shortcuts import get_object_or_404
+def typeahead(request):
+    """JSON autocomplete for the search box: locations and hotels with
+    words starting with what has been typed, tolerating typos."""
+    try:
+        limit = int(request.GET.get('limit', settings.TYPEAHEAD_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer.'}, status=400)
+    return JsonResponse({'query': request.GET.get('query', ''), **suggest(request.GET.get('query', ''), limit)})
 
+@staff_member_required
+@require_POST
 def delete_hotel(request, hotel_id):
     hotel = get_object_or_404(Hotel, id=hotel_id)
-    hotel.delete()
+    # Chunked rather than one cascade, so other requests can write between
+    # chunks of a large hotel.
+    purge_hotel(hotel, pause=0)
     return redirect('booking:hotel_list')  # Use namespace if defined
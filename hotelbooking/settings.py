@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'booking.instrumentation.QueryInstrumentationMiddleware',
+    'booking.routers.PrimaryReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +58,8 @@ ROOT_URLCONF = 'hotelbooking.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The stock Django backend, plus render timing for the query middleware
+        'BACKEND': 'booking.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,13 +78,196 @@ WSGI_APPLICATION = 'hotelbooking.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuning, applied to every connection. In WAL mode readers don't
+# block the writer (or each other), so catalog pages keep loading while a
+# booking holds the write lock; synchronous=NORMAL only risks the last
+# transactions on power loss in WAL mode. SQLITE_TIMEOUT is how long a
+# connection waits for a lock, in seconds, and SQLITE_TRANSACTION_MODE the
+# BEGIN used by atomic() (None for DEFERRED).
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_SYNCHRONOUS = 'NORMAL'
+SQLITE_TIMEOUT = 20
+SQLITE_TRANSACTION_MODE = None
+SQLITE_PRAGMAS = {
+    'cache_size': -64 * 1024,  # KiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+# Seconds a worker keeps its database connections open between requests
+# (0 closes them after every request, None never), with a liveness check
+# before reusing one.
+DATABASE_CONN_MAX_AGE = 60
+
+
+def sqlite_database(name, replica=False, **extra):
+    pragmas = dict(SQLITE_PRAGMAS)
+    if replica:
+        # Replicas are written by replication (see sync_replicas), never by
+        # Django, and keep the journal mode they were copied with.
+        pragmas['query_only'] = 'ON'
+    else:
+        pragmas['journal_mode'] = SQLITE_JOURNAL_MODE
+        pragmas['synchronous'] = SQLITE_SYNCHRONOUS
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_TIMEOUT,
+            'transaction_mode': SQLITE_TRANSACTION_MODE,
+            'init_command': ';'.join(f'PRAGMA {pragma}={value}' for pragma, value in pragmas.items()),
+        },
+        **extra,
+    }
+
+
 DATABASES = {
+    # A file rather than the default shared-cache in-memory database, whose
+    # table locks fail immediately instead of honouring the busy timeout,
+    # so concurrent booking tests behave like production.
+    'default': sqlite_database(BASE_DIR / 'db.sqlite3', TEST={'NAME': BASE_DIR / 'test_db.sqlite3'}),
+}
+
+# Read replicas of the primary ('default'), e.g. copies kept current by
+# `manage.py sync_replicas` or by streaming replication. Catalog reads
+# (hotels, rooms, amenities) are spread over them by
+# booking.routers.PrimaryReplicaRouter; everything else, and every write,
+# stays on the primary. Set DATABASE_REPLICA_PATHS in the environment
+# (separated like PATH) to try it with local SQLite files.
+DATABASE_REPLICA_PATHS = [path for path in os.environ.get('DATABASE_REPLICA_PATHS', '').split(os.pathsep) if path]
+for number, path in enumerate(DATABASE_REPLICA_PATHS, 1):
+    DATABASES[f'replica{number}'] = sqlite_database(path, replica=True, TEST={'MIRROR': 'default'})
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['booking.routers.PrimaryReplicaRouter']
+# How far a replica may trail the primary, in seconds. For this long after
+# a catalog or booking change (anything that bumps a cache version) reads
+# go to the primary, so pages cached for the new version, and the user who
+# made the change, never see the old data.
+DATABASE_REPLICA_LAG = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a shared backend (Redis/Memcached) when running several workers, so a
+# catalog version bump in one worker invalidates cached results in all.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Sessions are read from the cache and written through to the database, and
+# the signed-in user is cached too (booking.auth), so a signed-in request
+# needs no queries for either. Cached users are invalidated when saved,
+# deleted or logged out, and otherwise expire after AUTH_USER_CACHE_TIMEOUT
+# seconds. With several workers this needs the shared cache above, or a
+# logout in one worker would leave the session cached in the others.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = ['booking.auth.CachedModelBackend']
+AUTH_USER_CACHE_TIMEOUT = 15 * 60
+
+# Clients allowed to scrape /metrics/
+INTERNAL_IPS = ['127.0.0.1']
+
+
+# Maximum queries per request, by URL name. The test suite fails when a view
+# exceeds its budget, and the middleware logs a warning when one does in
+# production. Public views allow 2 extra queries for a logged-in visitor's
+# session and user, for when neither is cached.
+QUERY_BUDGETS = {
+    'booking:welcome': 2,
+    'booking:hotel_list': 3,
+    'booking:add_hotel': 4,
+    'booking:hotel_search': 8,
+    'booking:hotel_detail': 4,
+    'booking:hotel_availability': 5,
+    'booking:book_room': 15,
+    'booking:booking_confirmation': 3,
+    'booking:management_view': 3,
+    'booking:delete_booking': 7,
+    'booking:list_rooms': 3,
+    'booking:my_bookings': 3,
+    'booking:contact_us': 2,
+    'booking:recommend_hotels': 5,
+    'booking:add_room': 4,
+    'booking:add_customer': 3,
+    # Chunked deletes (booking.retention): a few statements per
+    # RETENTION_BATCH_SIZE rooms or bookings.
+    'booking:delete_hotel': 13,
+    'booking:get_suggestions': 3,
+    'booking:typeahead': 2,
+    'booking:metrics': 2,
+    'booking:api_hotels': 1,
+    'booking:api_hotel': 1,
+    'booking:api_rooms': 1,
+    'booking:api_room': 1,
+}
+
+# hotel_list, hotel_detail and list_rooms are cached whole for anonymous
+# visitors (booking.pagecache). Entries are invalidated by model signals,
+# so this only bounds how long unused pages stay in the cache.
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Keyset pagination: default and maximum rows per page (?page_size=)
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# JSON API (booking.api): largest ?page_size= and most ?ids= per request.
+API_MAX_PAGE_SIZE = 1000
+API_MAX_IDS = 500
+
+# Booking writes retry lock timeouts ("database is locked", deadlocks) with
+# capped exponential backoff, in seconds.
+BOOKING_MAX_ATTEMPTS = 5
+BOOKING_RETRY_BASE_DELAY = 0.05
+BOOKING_RETRY_MAX_DELAY = 1.0
+
+# Search activity is buffered in memory and written in batches by a
+# background thread (see booking.activity): flush every
+# ACTIVITY_FLUSH_INTERVAL seconds or once ACTIVITY_BATCH_SIZE events wait.
+# Beyond ACTIVITY_MAX_BUFFER pending events new ones are dropped. Events that
+# cannot be written at shutdown go to ACTIVITY_SPOOL_PATH and are replayed.
+ACTIVITY_BATCH_SIZE = 500
+ACTIVITY_FLUSH_INTERVAL = 2.0
+ACTIVITY_MAX_BUFFER = 50000
+ACTIVITY_SPOOL_PATH = BASE_DIR / 'activity.spool'
+ACTIVITY_FLUSH_IN_BACKGROUND = True
+
+# Outgoing mail is queued in the database and sent by a background thread
+# (see booking.mailqueue), MAIL_BATCH_SIZE messages per SMTP connection,
+# when something is queued and every MAIL_POLL_INTERVAL seconds. Failures are
+# retried after MAIL_RETRY_DELAY seconds, doubling up to MAIL_RETRY_MAX_DELAY,
+# and given up after MAIL_MAX_ATTEMPTS. A worker leases its batch for
+# MAIL_LEASE seconds. EMAIL_TIMEOUT keeps a stuck server from holding the
+# worker forever.
+MAIL_BATCH_SIZE = 50
+MAIL_POLL_INTERVAL = 30.0
+MAIL_RETRY_DELAY = 60
+MAIL_RETRY_MAX_DELAY = 60 * 60
+MAIL_MAX_ATTEMPTS = 8
+MAIL_LEASE = 5 * 60
+MAIL_IN_BACKGROUND = True
+EMAIL_TIMEOUT = 10
+
+# Recommendations are precomputed by `manage.py refresh_recommendations`
+# (see booking.recommendations): hotels kept per user, users scored per batch,
+# and the popularity fallback window and cache lifetime.
+RECOMMENDATION_COUNT = 10
+RECOMMENDATION_CHUNK_SIZE = 1000
+RECOMMENDATION_POPULAR_DAYS = 90
+RECOMMENDATION_POPULAR_TIMEOUT = 10 * 60
+
+# Bookings whose stay ended this many days ago are moved to ArchivedBooking by
+# `manage.py archive_bookings`; archival and hotel purges (booking.retention)
+# work through RETENTION_BATCH_SIZE rows at a time, pausing
+# RETENTION_BATCH_PAUSE seconds in between. Keep the archive window longer
+# than RECOMMENDATION_POPULAR_DAYS, which counts past bookings.
+BOOKING_ARCHIVE_AFTER_DAYS = 365
+RETENTION_BATCH_SIZE = 1000
+RETENTION_BATCH_PAUSE = 0.1
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -109,6 +296,29 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
 
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+# booking.perf gets one JSON line per request from
+# QueryInstrumentationMiddleware when DEBUG is off.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'booking.perf': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -125,11 +335,75 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content-hashed copies of every file, plus gzip (and,
+# with the brotli package, Brotli) variants of the text ones; see
+# booking.assets. Django serves them from STATIC_ROOT when
+# SERVE_STATIC_FILES is on, hashed names with a far-future Cache-Control
+# of STATIC_CACHE_MAX_AGE seconds. Turn it off when the web server serves
+# STATIC_ROOT itself.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'booking.assets.CompressedManifestStaticFilesStorage',
+    },
+}
+SERVE_STATIC_FILES = True
+STATIC_CACHE_MAX_AGE = 365 * 24 * 60 * 60
 
 # Media files (Uploaded images)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Hotel image derivatives (booking.images), built by a background worker
+# after an image is saved and by `manage.py build_image_variants`.
+IMAGE_VARIANT_WIDTHS = [320, 640, 1024, 1600]
+IMAGE_THUMBNAIL_SIZE = (160, 120)
+IMAGE_VARIANT_FORMAT = 'WEBP'
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_WORKERS = 1
+IMAGE_VARIANTS_IN_BACKGROUND = True
+
+# spaCy pipeline used for search. It is loaded on first use; only the
+# tokenizer and word vectors are needed, so every other component is excluded.
+SPACY_MODEL = 'en_core_web_md'
+SPACY_EXCLUDE = ['tok2vec', 'tagger', 'parser', 'senter', 'attribute_ruler', 'lemmatizer', 'ner']
+# Load the model when a WSGI/ASGI worker boots instead of on the first search.
+SPACY_WARMUP = False
+
+# Hotel embedding index used by hotel search and suggestions
+HOTEL_INDEX_PATH = BASE_DIR / 'search_index' / 'hotels.npz'
+# Word vectors exported by `manage.py export_word_vectors`. When present,
+# workers memory-map them instead of loading SPACY_MODEL.
+WORD_VECTORS_DIR = BASE_DIR / 'search_index' / 'vectors'
+# Search caches: query text -> vector LRU size, and how long ranked results
+# are kept (they are invalidated by catalog changes regardless).
+SEARCH_QUERY_CACHE_SIZE = 1024
+SEARCH_RESULTS_CACHE_TIMEOUT = 60 * 60
+# Most vector matches considered when a text query is combined with filters,
+# and the number of values returned per facet.
+SEARCH_MAX_RESULTS = 1000
+FACET_SIZE = 20
+# Hybrid search (booking.search.hybrid_search): how many full-text matches
+# are re-ranked with the word vectors, and the share of the final score
+# that comes from the full-text (BM25) score rather than the vectors.
+SEARCH_LEXICAL_CANDIDATES = 1000
+SEARCH_LEXICAL_WEIGHT = 0.5
+
+# Typeahead (booking.typeahead): suggestions per kind by default and at most
+# (?limit=). The in-memory index is built when a worker boots, kept up to
+# date by this process's hotel saves, and rebuilt in the background after
+# changes made elsewhere or once it is TYPEAHEAD_MAX_AGE seconds old (to
+# pick up booking popularity).
+TYPEAHEAD_LIMIT = 8
+TYPEAHEAD_MAX_LIMIT = 20
+TYPEAHEAD_MAX_AGE = 60 * 60
+TYPEAHEAD_REBUILD_IN_BACKGROUND = True
+TYPEAHEAD_WARMUP = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
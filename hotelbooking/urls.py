@@ -15,11 +15,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 
+from booking import assets
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include(('booking.urls','booking'), namespace='booking')),
@@ -29,3 +31,7 @@ urlpatterns = [
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+# Under DEBUG, runserver serves static files from the apps before this.
+if settings.SERVE_STATIC_FILES:
+    urlpatterns += [re_path(rf"^{settings.STATIC_URL.strip('/')}/(?P<path>.+)$", assets.serve, name='static')]
@@ -14,3 +14,15 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hotelbooking.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.SPACY_WARMUP:
+    from booking.nlp import warm_up
+
+    warm_up()
+
+if settings.TYPEAHEAD_WARMUP:
+    from booking.typeahead import warm_up as build_typeahead
+
+    build_typeahead()